@@ -0,0 +1,501 @@
+"""
+    Benchmarks for network_tools.
+
+    Usage:
+        python benchmarks.py codecs [--json]
+        python benchmarks.py compression [--json]
+        python benchmarks.py reliable [--json] [--loss 0.01]
+        python benchmarks.py unix [--json]
+        python benchmarks.py transports [--json] [--quick] [--output FILE]
+        python benchmarks.py compare BASELINE.json CURRENT.json [--threshold 0.1]
+
+    transports runs every client/server pair over loopback, sweeping payload size, concurrency and encoding, and
+    reports messages/s, MB/s and p50/p99/p999 latency. TCP latency is the round trip to the server's ack. UDP and
+    multicast latency is one way, from a timestamp embedded in each message.
+
+    compression reports, for each compressor and payload size of JSON records, the compression ratio against the
+    compress/decompress rate and the round trip throughput of framed TCP.
+
+    reliable compares ReliableUDPClient/ReliableUDPServer, on a link that drops the given fraction of datagrams each
+    way, with framed TCP on loopback, for messages larger than one datagram.
+
+    unix compares the Unix domain socket classes with their INET counterparts on loopback: framed stream round trips
+    (UnixStreamClient/UnixStreamServer against TCP) and batched datagrams (UnixDatagramClient/UnixDatagramServer
+    against UDP). speedup is each run's messages/s over the INET run's.
+
+    compare exits with status 1 if any run in CURRENT is slower (in messages/s) than the same run in BASELINE by more
+    than the threshold.
+"""
+import asyncio, json, os, pickle, random, selectors, shutil, struct, sys, tempfile, threading, time
+
+import network_tools as net
+
+LOOPBACK = '127.0.0.1'
+MULTICAST_GROUP = '224.1.1.1'
+MULTICAST_PORT = 12399
+
+# A typical record: a handful of numeric and string fields, with a short nested list
+RECORD = {
+    'id': 1234567,
+    'symbol': 'ABCD',
+    'price': 101.25,
+    'size': 300,
+    'side': 'buy',
+    'flags': [True, False, None],
+    'venues': ['X', 'Y', 'Z'],
+}
+
+PAYLOADS = (64, 1024, 4000, 65536)
+CONCURRENCY = (1, 8)
+ENCODINGS = (None, net.JSON, net.BINARY)
+COUNT = 2000
+
+# Modes that can only carry one buffer_size read (TCP) or datagram (UDP) per message
+UNFRAMED = ('baseline', 'batch')
+
+TIMESTAMP = struct.Struct('!d')
+
+
+def timed(function, argument, repeat):
+    """
+        Returns the number of calls per second function(argument) manages over repeat calls
+    """
+    start = time.perf_counter()
+    for i in range(repeat):
+        function(argument)
+    return repeat / (time.perf_counter() - start)
+
+
+def socket_path():
+    """
+        A path for a Unix domain socket, in a new temporary directory. Remove it with remove_socket().
+    """
+    return os.path.join(tempfile.mkdtemp(), 'benchmark.sock')
+
+
+def remove_socket(path):
+    shutil.rmtree(os.path.dirname(path), ignore_errors=True)
+
+
+def percentile(ordered, fraction):
+    if not ordered:
+        return None
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def summarise(run, latencies, sent, received, payload, elapsed):
+    """
+        Builds a result row from one run's raw measurements. Latencies are in seconds, and reported in microseconds.
+    """
+    latencies.sort()
+    return dict(run, **{
+        'sent': sent,
+        'received': received,
+        'messages_per_s': received / elapsed,
+        'mb_per_s': received * payload / elapsed / 1e6,
+        'p50_us': percentile(latencies, 0.5) and percentile(latencies, 0.5) * 1e6,
+        'p99_us': percentile(latencies, 0.99) and percentile(latencies, 0.99) * 1e6,
+        'p999_us': percentile(latencies, 0.999) and percentile(latencies, 0.999) * 1e6,
+    })
+
+
+def split(count, concurrency):
+    """
+        Splits count messages as evenly as possible between concurrency senders
+    """
+    return [count // concurrency + (i < count % concurrency) for i in range(concurrency)]
+
+
+def in_threads(target, counts):
+    threads = [threading.Thread(target=target, args=(count,)) for count in counts]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+
+def stamped(payload, encoding):
+    """
+        A message of roughly payload bytes, carrying its send time
+    """
+    if encoding is None:
+        return TIMESTAMP.pack(time.perf_counter()) + b'x' * max(0, payload - TIMESTAMP.size)
+    return [time.perf_counter(), 'x' * payload]
+
+
+def sent_at(content, encoding):
+    if encoding is None:
+        return TIMESTAMP.unpack_from(content)[0]
+    return content[0]
+
+
+def bench_codecs(record=RECORD, repeat=20000):
+    """
+        Measures the encode and decode rate and wire size of every registered codec, against pickle encoding the same data.
+        The text and raw codecs, which only carry strings and bytes, are given the record as JSON text.
+    """
+    text = json.dumps(record)
+    results = []
+
+    for name, codec in sorted(net.CODECS.items()):
+        if name == net.TEXT:
+            sample = text
+        elif name == net.RAW:
+            sample = text.encode()
+        else:
+            sample = record
+        payload = codec.encode(sample)
+
+        baseline = pickle.dumps(sample, pickle.HIGHEST_PROTOCOL)
+        results.append({
+            'codec': name,
+            'wire_bytes': len(payload),
+            'size_vs_pickle': len(payload) / len(baseline),
+            'encode_per_s': timed(codec.encode, sample, repeat),
+            'decode_per_s': timed(codec.decode, payload, repeat),
+            'pickle_encode_per_s': timed(pickle.dumps, sample, repeat),
+            'pickle_decode_per_s': timed(pickle.loads, baseline, repeat),
+        })
+    return results
+
+
+def records(payload, record=RECORD):
+    """
+        JSON text of a list of records, roughly payload bytes long
+    """
+    one = json.dumps(dict(record, id=0))
+    return json.dumps([dict(record, id=i) for i in range(max(1, payload // (len(one) + 2)))])
+
+
+def bench_tcp(mode, payload, concurrency, encoding, count=COUNT, compression=None, data=None, unix=False):
+    """
+        TCPClient/TCPServer round trips. mode is "baseline" (a connection per message), "framed", "keep_alive"
+        (pooled, framed connections) or "async" (AsyncTCPClient/AsyncTCPServer, framed). data defaults to payload
+        bytes of "x". If unix is True, UnixStreamClient/UnixStreamServer are used instead.
+    """
+    if mode == 'async':
+        return asyncio.run(bench_async_tcp(payload, concurrency, encoding, count))
+
+    options = {'framed': mode == 'framed', 'keep_alive': mode == 'keep_alive', 'compression': compression}
+    if unix:
+        server_class, client_class, address = net.UnixStreamServer, net.UnixStreamClient, {'path': socket_path()}
+    else:
+        server_class, client_class, address = net.TCPServer, net.TCPClient, {'host': LOOPBACK, 'port': 0}
+    server = server_class(ack='ACK', timeout=0.1, max_connections=128, **address, **options)
+    if not unix:
+        address['port'] = server.socket.getsockname()[1]
+    pool = net.ConnectionPool(max_connections=concurrency)
+    data = 'x' * payload if data is None else data
+    stop = threading.Event()
+
+    def serve():
+        while not stop.is_set():
+            server.listen(encoding=encoding)
+
+    latencies = []
+
+    def send(count):
+        client = client_class(timeout=10, pool=pool, **address, **options)
+        for i in range(count):
+            start = time.perf_counter()
+            client.send(data, encoding=encoding)
+            latencies.append(time.perf_counter() - start)
+
+    thread = threading.Thread(target=serve)
+    thread.start()
+    start = time.perf_counter()
+    try:
+        in_threads(send, split(count, concurrency))
+    finally:
+        elapsed = time.perf_counter() - start
+        stop.set()
+        thread.join()
+        pool.close()
+        server.socket.close()
+        if unix:
+            remove_socket(address['path'])
+
+    run = {'transport': 'unix' if unix else 'tcp', 'mode': mode, 'payload': payload, 'concurrency': concurrency, 'encoding': encoding}
+    return summarise(run, latencies, count, len(latencies), payload, elapsed)
+
+
+async def bench_async_tcp(payload, concurrency, encoding, count):
+    server = net.AsyncTCPServer(host=LOOPBACK, port=0, ack='ACK', framed=True)
+    await server.start(handler=lambda request: None, encoding=encoding)
+    port = server.server.sockets[0].getsockname()[1]
+    client = net.AsyncTCPClient(host=LOOPBACK, port=port, timeout=10, framed=True)
+    data = 'x' * payload
+    latencies = []
+
+    async def send(count):
+        for i in range(count):
+            start = time.perf_counter()
+            await client.send(data, encoding=encoding)
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*[send(n) for n in split(count, concurrency)])
+    elapsed = time.perf_counter() - start
+    await server.close()
+
+    run = {'transport': 'tcp', 'mode': 'async', 'payload': payload, 'concurrency': concurrency, 'encoding': encoding}
+    return summarise(run, latencies, count, len(latencies), payload, elapsed)
+
+
+def receive_datagrams(server, encoding, batched, expected, latencies, stop, finished):
+    # Runs on the receiving thread until every datagram arrived, or the senders finished and the socket went quiet.
+    # The time the last datagram arrived is appended to finished, so waiting out the quiet period isn't counted.
+    selector = selectors.DefaultSelector()
+    selector.register(server.socket, selectors.EVENT_READ)
+    received = 0
+
+    while received < expected:
+        if batched:
+            requests = server.listen_batch(timeout=0.2)
+        else:
+            requests = [server.listen()] if selector.select(0.2) else []
+
+        if not requests and stop.is_set():
+            break
+        now = time.perf_counter()
+        for request in requests:
+            latencies.append(now - sent_at(request.content, encoding))
+        received += len(requests)
+        if requests:
+            finished[:] = [now]
+
+
+def bench_datagrams(transport, mode, payload, concurrency, encoding, count=COUNT):
+    """
+        One way UDP, Unix domain ("unix_dgram") or multicast delivery. UDP and Unix mode is "baseline" (send/listen)
+        or "batch" (send_many/listen_batch). Lost datagrams count against messages/s.
+    """
+    batched = mode == 'batch'
+    path = None
+    if transport == 'udp':
+        server = net.UDPServer(host=LOOPBACK, port=0, encoding=encoding)
+        port = server.socket.getsockname()[1]
+        make_client = lambda: net.UDPClient(host=LOOPBACK, port=port)
+    elif transport == 'unix_dgram':
+        path = socket_path()
+        server = net.UnixDatagramServer(path=path, encoding=encoding)
+        make_client = lambda: net.UnixDatagramClient(path=path)
+    else:
+        server = net.MulticastServer(host=MULTICAST_GROUP, port=MULTICAST_PORT, encoding=encoding)
+        make_client = lambda: net.MulticastClient(host=MULTICAST_GROUP, port=MULTICAST_PORT, loop=True)
+
+    latencies, finished = [], []
+    stop = threading.Event()
+    receiver = threading.Thread(target=receive_datagrams, args=(server, encoding, batched, count, latencies, stop, finished))
+    receiver.start()
+
+    def send(count):
+        client = make_client()
+        if batched:
+            client.send_many((stamped(payload, encoding) for i in range(count)), encoding=encoding)
+        else:
+            for i in range(count):
+                client.send(stamped(payload, encoding), encoding=encoding)
+
+    start = time.perf_counter()
+    in_threads(send, split(count, concurrency))
+    stop.set()
+    receiver.join()
+    elapsed = (finished[0] if finished else time.perf_counter()) - start
+    server.socket.close()
+    if path is not None:
+        remove_socket(path)
+
+    run = {'transport': transport, 'mode': mode, 'payload': payload, 'concurrency': concurrency, 'encoding': encoding}
+    return summarise(run, latencies, count, len(latencies), payload, elapsed)
+
+
+def bench_compression(payloads=(1024, 16384, 65536), repeat=200, count=500):
+    """
+        For each compressor (and none), the compression ratio of JSON records against the compress/decompress rate in
+        MB/s of uncompressed data, and the messages/s and effective MB/s of framed TCP round trips carrying them
+    """
+    results = []
+    for compression in [None] + sorted(net.COMPRESSORS):
+        for payload in payloads:
+            text = records(payload)
+            data = text.encode()
+            if compression is None:
+                ratio, compress_rate, decompress_rate = 1.0, None, None
+            else:
+                compressor = net.get_compressor(compression)
+                compressed = compressor.compress(data)
+                ratio = len(compressed) / len(data)
+                compress_rate = timed(compressor.compress, data, repeat) * len(data) / 1e6
+                decompress_rate = timed(compressor.decompress, compressed, repeat) * len(data) / 1e6
+
+            run = bench_tcp('framed', len(data), 1, None, count, compression=compression, data=text)
+            results.append({
+                'compression': compression,
+                'payload': len(data),
+                'ratio': ratio,
+                'compress_mb_per_s': compress_rate,
+                'decompress_mb_per_s': decompress_rate,
+                'messages_per_s': run['messages_per_s'],
+                'mb_per_s': run['mb_per_s'],
+            })
+    return results
+
+
+def bench_reliable_udp(payload, loss, count=200, fragment_size=1400, seed=1):
+    """
+        ReliableUDPClient sends to a ReliableUDPServer, dropping loss of the datagrams sent each way. Latency is the
+        time for send() to have the whole message acknowledged.
+    """
+    server = net.ReliableUDPServer(host=LOOPBACK, port=0, timeout=0.5)
+    port = server.socket.getsockname()[1]
+    client = net.ReliableUDPClient(host=LOOPBACK, port=port, fragment_size=fragment_size, metrics=net.Metrics())
+
+    if loss:
+        def lossy(transmit, rng):
+            return lambda *args: None if rng.random() < loss else transmit(*args)
+        client._transmit = lossy(client._transmit, random.Random(seed))  # A generator per direction, as each is used by one thread
+        server._transmit = lossy(server._transmit, random.Random(seed + 1))
+
+    stop = threading.Event()
+    thread = threading.Thread(target=lambda: [server.listen() for i in iter(stop.is_set, True)])
+    thread.start()
+
+    data = b'x' * payload
+    latencies = []
+    start = time.perf_counter()
+    try:
+        for i in range(count):
+            sent = time.perf_counter()
+            client.send(data)
+            latencies.append(time.perf_counter() - sent)
+    finally:
+        elapsed = time.perf_counter() - start
+        stop.set()
+        thread.join()
+        server.socket.close()
+
+    mode = 'loss={:g},fragment={}'.format(loss, fragment_size)
+    run = {'transport': 'reliable_udp', 'mode': mode, 'payload': payload, 'concurrency': 1, 'encoding': None}
+    result = summarise(run, latencies, count, len(latencies), payload, elapsed)
+    result['retransmits'] = client.metrics.counters['retransmits']
+    return result
+
+
+def bench_reliable(payloads=(16384, 262144), loss=0.01, fragment_sizes=(1400, 16384), count=200):
+    """
+        Reliable UDP with and without loss, at an Ethernet sized and a loopback sized fragment, against framed TCP
+    """
+    results = []
+    for payload in payloads:
+        results.append(dict(bench_tcp('framed', payload, 1, None, count), retransmits=None))
+        for fragment_size in fragment_sizes:
+            for rate in (0, loss):
+                results.append(bench_reliable_udp(payload, rate, count, fragment_size))
+    return results
+
+
+def bench_unix(payloads=(64, 4000, 32768), count=COUNT):
+    """
+        Each Unix domain socket transport against its INET counterpart, one sender, raw bytes
+    """
+    results = []
+    for payload in payloads:
+        pairs = ((bench_tcp('framed', payload, 1, None, count), bench_tcp('framed', payload, 1, None, count, unix=True)),
+                 (bench_datagrams('udp', 'batch', payload, 1, None, count), bench_datagrams('unix_dgram', 'batch', payload, 1, None, count)))
+        for inet, unix in pairs:
+            results.append(dict(inet, speedup=1.0))
+            results.append(dict(unix, speedup=unix['messages_per_s'] / inet['messages_per_s'] if inet['messages_per_s'] else None))
+    return results
+
+
+def bench_transports(payloads=PAYLOADS, concurrency=CONCURRENCY, encodings=ENCODINGS, count=COUNT):
+    """
+        Sweeps every transport and mode over payload size, concurrency and encoding
+    """
+    runs = [(bench_tcp, (mode,)) for mode in ('baseline', 'framed', 'keep_alive', 'async')]
+    runs += [(bench_datagrams, ('udp', 'baseline')), (bench_datagrams, ('udp', 'batch')),
+             (bench_datagrams, ('multicast', 'baseline'))]
+
+    results = []
+    for function, args in runs:
+        for payload in payloads:
+            if payload > net._BaseConnection.buffer_size and (args[-1] in UNFRAMED or function is bench_datagrams):
+                continue  # Would be truncated
+            for senders in concurrency:
+                for encoding in encodings:
+                    results.append(function(*args, payload, senders, encoding, count))
+    return results
+
+
+def compare(baseline, current, threshold=0.1):
+    """
+        Pairs up runs with the same parameters and reports the change in messages/s. Returns the runs that regressed
+        by more than threshold.
+    """
+    key = lambda result: (result['transport'], result['mode'], result['payload'], result['concurrency'], result['encoding'])
+    before = {key(result): result for result in baseline}
+    rows, regressions = [], []
+
+    for result in current:
+        if key(result) not in before:
+            continue
+        old = before[key(result)]['messages_per_s']
+        change = (result['messages_per_s'] - old) / old if old else 0.0
+        rows.append(dict(zip(('transport', 'mode', 'payload', 'concurrency', 'encoding'), key(result)), change=change))
+        if change < -threshold:
+            regressions.append(rows[-1])
+    return rows, regressions
+
+
+def print_table(results):
+    columns = list(results[0])
+    print('  '.join('{:>14}'.format(column) for column in columns))
+    for result in results:
+        print('  '.join('{:>14.6g}'.format(value) if isinstance(value, float) else '{:>14}'.format(str(value)) for value in result.values()))
+
+
+def option(argv, name, default=None):
+    if name in argv:
+        return argv[argv.index(name) + 1]
+    return default
+
+
+def main(argv):
+    if not argv or argv[0] not in ('codecs', 'compression', 'reliable', 'unix', 'transports', 'compare'):
+        print(__doc__)
+        return 1
+
+    if argv[0] == 'compare':
+        with open(argv[1]) as baseline, open(argv[2]) as current:
+            rows, regressions = compare(json.load(baseline), json.load(current), float(option(argv, '--threshold', 0.1)))
+        if rows:
+            print_table(rows)
+        return 1 if regressions else 0
+
+    if argv[0] == 'codecs':
+        results = bench_codecs()
+    elif argv[0] == 'compression':
+        results = bench_compression()
+    elif argv[0] == 'reliable':
+        results = bench_reliable(loss=float(option(argv, '--loss', 0.01)))
+    elif argv[0] == 'unix':
+        results = bench_unix()
+    elif '--quick' in argv:
+        results = bench_transports(payloads=(64, 4000), concurrency=(1, 4), encodings=(None,), count=200)
+    else:
+        results = bench_transports()
+
+    if option(argv, '--output'):
+        with open(option(argv, '--output'), 'w') as output:
+            json.dump(results, output, indent=2)
+
+    if '--json' in argv:
+        print(json.dumps(results, indent=2))
+    else:
+        print_table(results)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -1,32 +1,486 @@
+"""
+    A load generator and sink for every network_tools transport, in the spirit of iperf.
+
+    Usage:
+        python main.py server TRANSPORT [options]
+        python main.py client TRANSPORT [options]
+        python main.py loopback TRANSPORT [options]
+
+    server receives until --duration passes (or Ctrl-C), reporting what arrives. client sends to a server for
+    --duration seconds. loopback runs both in one process, over loopback (or a temporary Unix domain socket), to size a
+    server before deploying it. Run with --help for the options.
+
+    TRANSPORT is tcp, async_tcp, udp, reliable_udp, multicast, unix (UnixStreamServer) or unix_dgram
+    (UnixDatagramServer).
+
+    Latency is each send's round trip to the server's ack for the acknowledged transports (tcp, async_tcp, unix and
+    reliable_udp). For datagrams it's the server's one way latency, from the trace header, so it's only reported where
+    the server runs (with both ends on one host for the times to compare). Messages are traced unless --no-trace is
+    given, which also lets datagram servers count lost and reordered messages. Both ends need the same transport,
+    --mode, --encoding, --compression and tracing.
+"""
+import argparse, asyncio, concurrent.futures, json, multiprocessing, os, shutil, signal, sys, tempfile, threading, time
+
 import network_tools as net
-import sys
 
-def main():
-    port = 12348
-    if sys.argv[1] == '-s':
-        server = net.UDPServer(port=port)
+TRANSPORTS = ('tcp', 'async_tcp', 'udp', 'reliable_udp', 'multicast', 'unix', 'unix_dgram')
+MODELS = ('threads', 'processes', 'asyncio')
+MODES = ('baseline', 'framed', 'keep_alive', 'multiplexed')
+
+# Transports whose send() waits for the server, so the client measures the round trip
+ACKED = ('tcp', 'async_tcp', 'unix', 'reliable_udp')
+
+# Transports that can't carry a trace header
+UNTRACED = ('async_tcp', 'reliable_udp')
+
+MULTICAST_GROUP = '224.1.1.1'
+UNIX_PATH = '/tmp/network_tools.sock'
+
+# Messages sent, payload bytes sent and send errors for each sender, and the stop event. Set in each worker process
+# by _initialise(), as they can only be shared by inheritance.
+_counters = None
+_stop = None
+
+
+def parse(argv):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('role', choices=('server', 'client', 'loopback'))
+    parser.add_argument('transport', choices=TRANSPORTS)
+    parser.add_argument('--host', help="Default 127.0.0.1, or {} for multicast.".format(MULTICAST_GROUP))
+    parser.add_argument('--port', type=int, default=12348, help="Default 12348. loopback picks a free port, except for multicast.")
+    parser.add_argument('--path', help="The Unix domain socket. Default {}, or a temporary path for loopback.".format(UNIX_PATH))
+    parser.add_argument('--mode', choices=MODES, default='framed', help="Default framed. How tcp and unix messages are delimited, and whether connections are reused (async_tcp is framed unless baseline).")
+    parser.add_argument('--payload', type=int, default=64, help="Default 64. Bytes per message, before encoding.")
+    parser.add_argument('--concurrency', type=int, default=1, help="Default 1. The number of senders.")
+    parser.add_argument('--model', choices=MODELS, default='threads', help="Default threads. What each sender runs in. asyncio runs every sender as a task on one event loop, and needs async_tcp.")
+    parser.add_argument('--rate', type=float, default=0, help="Default 0, as fast as possible. The total messages per second, shared between the senders.")
+    parser.add_argument('--duration', type=float, help="Seconds to send (or receive) for. Default 10, or until Ctrl-C for a server.")
+    parser.add_argument('--encoding', choices=sorted(net.CODECS), help="Default None, raw bytes.")
+    parser.add_argument('--compression', choices=sorted(net.COMPRESSORS))
+    parser.add_argument('--interval', type=float, default=1, help="Default 1. Seconds between live reports. 0 turns them off.")
+    parser.add_argument('--json', action='store_true', help="Print the final summary as JSON.")
+    parser.add_argument('--no-trace', dest='trace', action='store_false', help="Don't stamp messages with a sequence number and send time.")
+
+    args = parser.parse_args(argv)
+    if args.model == 'asyncio' and args.transport != 'async_tcp':
+        parser.error("the asyncio model needs the async_tcp transport")
+    if args.concurrency < 1 or args.payload < 0 or args.rate < 0:
+        parser.error("concurrency must be at least 1, and payload and rate can't be negative")
+    if args.host is None:
+        args.host = MULTICAST_GROUP if args.transport == 'multicast' else '127.0.0.1'
+    if args.duration is None:
+        args.duration = 0 if args.role == 'server' else 10
+    if args.transport in UNTRACED or args.mode == 'multiplexed':
+        args.trace = False
+    return args
+
+
+def options(args):
+    """
+        The keyword arguments the server and clients share
+    """
+    kwargs = {'encoding': args.encoding, 'compression': args.compression, 'trace': args.trace}
+    if args.transport in ('unix', 'unix_dgram'):
+        kwargs['path'] = args.path
+    else:
+        kwargs['host'], kwargs['port'] = args.host, args.port
+
+    if args.transport in ('tcp', 'unix'):
+        kwargs['framed'] = args.mode == 'framed'
+        kwargs['keep_alive'] = args.mode == 'keep_alive'
+        kwargs['multiplexed'] = args.mode == 'multiplexed'
+    elif args.transport == 'async_tcp':
+        kwargs['framed'] = args.mode != 'baseline'
+    return kwargs
+
+
+def make_server(args):
+    kwargs = dict(options(args), metrics=net.Metrics(), poll_interval=0.1)
+    if args.transport == 'tcp':
+        return net.TCPServer(ack='ACK', max_connections=max(128, args.concurrency), **kwargs)
+    if args.transport == 'unix':
+        return net.UnixStreamServer(ack='ACK', max_connections=max(128, args.concurrency), **kwargs)
+    if args.transport == 'async_tcp':
+        return net.AsyncTCPServer(ack='ACK', **kwargs)
+    if args.transport == 'udp':
+        return net.UDPServer(recv_buffer=1 << 22, **kwargs)
+    if args.transport == 'reliable_udp':
+        return net.ReliableUDPServer(recv_buffer=1 << 22, **kwargs)
+    if args.transport == 'multicast':
+        return net.MulticastServer(recv_buffer=1 << 22, **kwargs)
+    return net.UnixDatagramServer(**kwargs)
+
+
+def make_client(args):
+    kwargs = options(args)
+    if args.transport == 'tcp':
+        return net.TCPClient(timeout=10, pool=net.ConnectionPool(max_connections=1), **kwargs)
+    if args.transport == 'unix':
+        return net.UnixStreamClient(timeout=10, pool=net.ConnectionPool(max_connections=1), **kwargs)
+    if args.transport == 'async_tcp':
+        return net.AsyncTCPClient(timeout=10, **kwargs)
+    if args.transport == 'udp':
+        return net.UDPClient(**kwargs)
+    if args.transport == 'reliable_udp':
+        return net.ReliableUDPClient(**kwargs)
+    if args.transport == 'multicast':
+        return net.MulticastClient(loop=True, **kwargs)
+    return net.UnixDatagramClient(**kwargs)
+
+
+def payload(args):
+    # Raw bytes are sent as they are, anything else is encoded
+    return b'x' * args.payload if args.encoding is None else 'x' * args.payload
+
+
+def sink(server, stop, ready):
+    """
+        Receives until stop is set, answering multiplexed requests. Sets ready once the server is listening.
+    """
+    if isinstance(server, net.AsyncTCPServer):
+        return asyncio.run(async_sink(server, stop, ready))
+
+    ready.set()
+    respond = server.respond if getattr(server, 'multiplexed', False) else None
+    for batch in server.stream(batch=64, stop=stop):
+        if respond is not None:
+            for request in batch:
+                respond(request, b'ACK', encoding=None)
+
+
+async def async_sink(server, stop, ready):
+    await server.start(handler=lambda request: None)
+    ready.set()
+    while not stop.is_set():
+        await asyncio.sleep(server.poll_interval)
+    await server.close()
+
+
+class Pacer():
+    """
+        Spaces one sender's messages to its share of the target rate, until the duration has passed or stop is set
+    """
+    def __init__(self, args, stop):
+        self.interval = args.concurrency / args.rate if args.rate else 0
+        self.stop = stop
+        self.started = self.next = time.perf_counter()
+        self.deadline = self.started + args.duration
+        self.sent = 0
+
+    def wait(self):
+        """
+            Returns how long to sleep before the next message, or None once the sender should stop
+        """
+        self.sent += 1
+        if not self.sent & 255 and self.stop.is_set():  # Checking an Event every message would slow the fastest senders
+            return None
+        if not self.interval:
+            return 0 if time.perf_counter() < self.deadline else None
+
+        self.next += self.interval
+        if self.next >= self.deadline or self.stop.is_set():
+            return None
+        return max(0, self.next - time.perf_counter())
+
+
+def send_load(args, index, counters, metrics, stop):
+    """
+        One sender: sends args.payload sized messages, paced to its share of args.rate, timing each send
+    """
+    client = make_client(args)
+    send = client.publish if args.transport == 'multicast' else client.send
+    data, observe = payload(args), metrics.observe
+    pacer = Pacer(args, stop)
+
+    try:
+        delay = pacer.wait()
+        while delay is not None:
+            if delay:
+                time.sleep(delay)
+            start = time.perf_counter()
+            try:
+                send(data)
+            except OSError:
+                counters[index * 3 + 2] += 1
+            else:
+                observe('round_trip', time.perf_counter() - start)
+                counters[index * 3] += 1
+                counters[index * 3 + 1] += args.payload
+            delay = pacer.wait()
+    finally:
+        if hasattr(client, 'close'):
+            client.close()
+
+
+async def send_load_async(args, index, counters, metrics, stop):
+    # send_load() for AsyncTCPClient
+    client = make_client(args)
+    data, observe = payload(args), metrics.observe
+    pacer = Pacer(args, stop)
+
+    delay = pacer.wait()
+    while delay is not None:
+        await asyncio.sleep(delay)  # Even if 0, so the other senders get a turn
+        start = time.perf_counter()
+        try:
+            await client.send(data)
+        except OSError:
+            counters[index * 3 + 2] += 1
+        else:
+            observe('round_trip', time.perf_counter() - start)
+            counters[index * 3] += 1
+            counters[index * 3 + 1] += args.payload
+        delay = pacer.wait()
+
+
+def run_sender(args, index, counters, metrics, stop):
+    if args.transport == 'async_tcp':
+        asyncio.run(send_load_async(args, index, counters, metrics, stop))
+    else:
+        send_load(args, index, counters, metrics, stop)
+
+
+async def run_senders_async(args, counters, metrics, stop):
+    await asyncio.gather(*[send_load_async(args, i, counters, metrics, stop) for i in range(args.concurrency)])
+
+
+def _initialise(counters, stop):
+    # Runs in each worker process. The parent turns Ctrl-C into stop, so workers finish their messages and report.
+    global _counters, _stop
+    _counters, _stop = counters, stop
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+
+def _run_process(args, index):
+    # Runs in a worker process, returning its round trip histogram to be merged in the parent
+    metrics = net.Metrics()
+    run_sender(args, index, _counters, metrics, _stop)
+    return metrics.histograms['round_trip']
+
+
+def generate(args, counters, metrics, stop):
+    """
+        Runs every sender to completion. Returns the round trip histogram of the senders in other processes, which
+        aren't recorded in metrics.
+    """
+    if args.model == 'asyncio':
+        asyncio.run(run_senders_async(args, counters, metrics, stop))
+        return net.Histogram()
+
+    if args.model == 'threads':
+        threads = [threading.Thread(target=run_sender, args=(args, i, counters, metrics, stop), daemon=True)
+                   for i in range(args.concurrency)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return net.Histogram()
+
+    histogram = net.Histogram()
+    with concurrent.futures.ProcessPoolExecutor(args.concurrency, initializer=_initialise, initargs=(counters, stop)) as pool:
+        for result in [pool.submit(_run_process, args, i) for i in range(args.concurrency)]:
+            histogram.merge(result.result())
+    return histogram
+
+
+def latency(histogram):
+    """
+        A histogram's percentiles in microseconds, or None if nothing was recorded
+    """
+    if not histogram.count:
+        return None
+    return {key: round(histogram.percentile(fraction) * 1e6, 1) for key, fraction in
+            (('p50_us', 0.5), ('p99_us', 0.99), ('p999_us', 0.999))}
+
+
+class Report():
+    """
+        Tracks what was sent (from the senders' counters) and received (from the server's Metrics), for the live
+        report and the final summary
+    """
+    def __init__(self, args, counters=None, metrics=None, server=None):
+        self.args = args
+        self.counters = counters
+        self.metrics = metrics  # The senders' round trips, for threads and asyncio senders
+        self.server = server
+        self.started = self.last = time.perf_counter()
+        self.previous = (0, 0)
+
+    def sent(self):
+        if self.counters is None:
+            return 0, 0
+        values = self.counters[:]
+        return sum(values[0::3]), sum(values[2::3])
+
+    def received(self):
+        if self.server is None:
+            return 0
+        return self.server.metrics.counters['messages_in']
+
+    def histogram(self, extra=None):
+        # The latency that matters for the transport: the senders' round trips, or the server's one way latency
+        histogram = net.Histogram()
+        if self.args.transport in ACKED:
+            if self.metrics is not None:
+                with self.metrics._lock:
+                    histogram.merge(self.metrics.histograms['round_trip'])
+            if extra is not None:
+                histogram.merge(extra)
+        elif self.server is not None:
+            with self.server.metrics._lock:
+                histogram.merge(self.server.metrics.histograms['network_latency'])
+        return histogram
+
+    def live(self):
+        """
+            One line describing the interval since the last call
+        """
+        now = time.perf_counter()
+        sent, received = self.sent()[0], self.received()
+        elapsed = now - self.last or 1e-9
+        sent_rate = (sent - self.previous[0]) / elapsed
+        received_rate = (received - self.previous[1]) / elapsed
+        self.last, self.previous = now, (sent, received)
+
+        line = "[{:7.1f}s]".format(now - self.started)
+        if self.counters is not None:
+            line += "  sent {:>10.0f} msg/s {:>9.2f} MB/s".format(sent_rate, sent_rate * self.args.payload / 1e6)
+        if self.server is not None:
+            line += "  received {:>10.0f} msg/s {:>9.2f} MB/s".format(received_rate, received_rate * self.args.payload / 1e6)
+        percentiles = latency(self.histogram())
+        if percentiles:
+            line += "  latency p50 {p50_us:.0f}us p99 {p99_us:.0f}us".format(**percentiles)
+        if self.server is not None and self.args.trace and self.args.transport not in ACKED:
+            line += "  lost {}".format(self.server.metrics.counters['lost'])
+        return line
+
+    def summary(self, elapsed, extra=None):
+        """
+            The final results as a dict. extra is a round trip histogram from senders in other processes.
+        """
+        args = self.args
+        summary = {
+            'transport': args.transport,
+            'mode': args.mode if args.transport in ('tcp', 'unix', 'async_tcp') else None,
+            'payload': args.payload,
+            'concurrency': args.concurrency,
+            'model': args.model,
+            'rate': args.rate or None,
+            'encoding': args.encoding,
+            'compression': args.compression,
+            'seconds': round(elapsed, 3),
+        }
+        if self.counters is not None:
+            sent, errors = self.sent()
+            summary.update(sent=sent, errors=errors, sent_per_s=round(sent / elapsed, 1),
+                           sent_mb_per_s=round(sent * args.payload / elapsed / 1e6, 3))
+        if self.server is not None:
+            received = self.received()
+            summary.update(received=received, received_per_s=round(received / elapsed, 1),
+                           received_mb_per_s=round(received * args.payload / elapsed / 1e6, 3))
+            if args.trace and args.transport not in ACKED:
+                summary.update(lost=self.server.metrics.counters['lost'], reordered=self.server.metrics.counters['reordered'])
+        summary['latency'] = 'round_trip' if args.transport in ACKED else 'one_way'
+        summary.update(latency(self.histogram(extra)) or {'p50_us': None, 'p99_us': None, 'p999_us': None})
+        return summary
+
+
+def reporter(report, interval, stop):
+    # Prints a live report line every interval until stop is set
+    while not stop.wait(interval):
+        print(report.live(), flush=True)
+
+
+def drain(report, timeout=2.0, quiet=0.2):
+    """
+        Waits for messages still in flight to arrive: until nothing has for quiet seconds, or timeout passes
+    """
+    deadline = time.perf_counter() + timeout
+    received = report.received()
+    while time.perf_counter() < deadline:
+        time.sleep(quiet)
+        if report.received() == received:
+            return
+        received = report.received()
+
+
+def run(args):
+    """
+        Runs the role args asks for, returning the final summary
+    """
+    temporary = None
+    if args.transport in ('unix', 'unix_dgram') and args.path is None:
+        if args.role == 'loopback':
+            temporary = tempfile.mkdtemp()
+            args.path = os.path.join(temporary, 'main.sock')
+        else:
+            args.path = UNIX_PATH
+    if args.role == 'loopback' and args.transport not in ('multicast', 'unix', 'unix_dgram'):
+        args.port = 0
+
+    server = counters = metrics = None
+    stop, receiving = multiprocessing.Event(), threading.Event()
+    threads = []
+    try:
+        if args.role in ('server', 'loopback'):
+            server = make_server(args)
+            ready = threading.Event()
+            threads.append(threading.Thread(target=sink, args=(server, receiving, ready), daemon=True))
+            threads[-1].start()
+            ready.wait()
+            if args.port == 0:  # Send to the port the server was given
+                sock = server.server.sockets[0] if isinstance(server, net.AsyncTCPServer) else server.socket
+                args.port = sock.getsockname()[1]
+
+        if args.role in ('client', 'loopback'):
+            counters = multiprocessing.Array('Q', args.concurrency * 3, lock=False)
+            metrics = net.Metrics()
+
+        report = Report(args, counters, metrics, server)
+        if args.interval:
+            threads.append(threading.Thread(target=reporter, args=(report, args.interval, stop), daemon=True))
+            threads[-1].start()
+
+        extra = None
+        try:
+            if counters is not None:
+                extra = generate(args, counters, metrics, stop)
+            else:
+                stop.wait(args.duration or None)
+        except KeyboardInterrupt:
+            stop.set()
+        elapsed = time.perf_counter() - report.started
 
-        while True:
-            sender, data = server.listen()
-            print(data)
+        if server is not None and counters is not None:
+            drain(report)  # Count what was still in flight as received, but not the wait towards the rate
+        return report.summary(elapsed, extra)
 
-    elif sys.argv[1] == '-c':
-        client = net.UDPClient(port=port)
-        client.send("Hello")
+    finally:
+        stop.set()
+        receiving.set()
+        for thread in threads:
+            thread.join()
+        if server is not None and getattr(server, 'socket', None) is not None:
+            server.socket.close()
+        if temporary is not None:
+            shutil.rmtree(temporary, ignore_errors=True)
 
-    if sys.argv[1] == '-s':
-        server = net.TCPServer(port=port, ack='ACK')
 
-        while True:
-            sender, data = server.listen()
-            print(data)
+def print_summary(summary):
+    width = max(len(key) for key in summary)
+    for key, value in summary.items():
+        print("{:>{}}  {}".format(key, width, '-' if value is None else value))
 
-    elif sys.argv[1] == '-c':
 
-        client = net.TCPClient(port=port)
-        response = client.send("Hello")
-        print(response)
+def main(argv):
+    args = parse(argv)
+    summary = run(args)
+    if args.json:
+        print(json.dumps(summary, indent=2))
+    else:
+        print_summary(summary)
+    return 1 if summary.get('errors') else 0
 
 
 if __name__ == '__main__':
-    main()
+    sys.exit(main(sys.argv[1:]))
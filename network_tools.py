@@ -1,39 +1,685 @@
 # Standard Lib
 from __future__ import print_function
-import socket, struct, os, sys, time
-import pickle
+import errno, socket, struct, os, stat, sys, time
+import queue, select, selectors, threading
+import collections, itertools, weakref
+# asyncio, concurrent.futures and multiprocessing are slow to import, and only async connections, serve_forever(),
+# multiplexed clients and sharding need them, so they're imported where they're used
+import json, mmap, pickle, zlib
+
+try:
+    import lzma
+except ImportError:  # Python builds without liblzma
+    lzma = None
 
 # Not available in 2.7
 # from ipaddress import ip_network, ip_address
 # Local Imports
 import settings
 
+# Framed messages are prefixed with their length as a 4 byte, network order, unsigned int
+FRAME_HEADER = struct.Struct('!I')
+
+# File transfers are prefixed with their length as an 8 byte, network order, unsigned int, so they can exceed 4GB
+FILE_HEADER = struct.Struct('!Q')
+
+# Multiplexed messages are prefixed with their length and the id of the request they belong to, both 4 byte, network
+# order, unsigned ints
+MUX_HEADER = struct.Struct('!II')
+
+# Set in a response's request id when the server failed to answer the request. The response is the error message.
+MUX_ERROR = 0x80000000
+
+# Reliable UDP datagrams start with their kind and message id, then either the fragment's index and the message's
+# fragment count (DATA), or the cumulative ack and a bitmap of the 64 fragments after it that have arrived (ACK)
+RUDP_DATA = struct.Struct('!BIII')
+RUDP_ACK = struct.Struct('!BIIQ')
+_RUDP_DATA, _RUDP_ACK = 0, 1
+
+# Traced messages are prefixed with the sending client's stream id and the message's sequence number (4 byte, network
+# order, unsigned ints), and its send time (time.monotonic(), a double). TCP acks to them are prefixed with the sequence
+# number, and the server's receive and ack times.
+TRACE_HEADER = struct.Struct('!IId')
+TRACE_ACK = struct.Struct('!Idd')
+
+# Captures start with CAPTURE_MAGIC. Each record is then its receive time (seconds since the epoch, as a network order
+# double), the lengths of its sender and receiver (2 byte unsigned ints) and of its content (4 byte unsigned int),
+# followed by the sender and receiver (JSON) and the content.
+CAPTURE_MAGIC = b'NTCAPTURE\x01'
+CAPTURE_RECORD = struct.Struct('!dHHI')
+
+# Datagram receive buffers always have this much room, which holds any UDP datagram, so none are truncated
+MAX_DATAGRAM = 65536
+
+# Lets a blocking socket drain its queue without waiting. Not every platform has it.
+MSG_DONTWAIT = getattr(socket, 'MSG_DONTWAIT', 0)
+
+# Linux socket options that older Pythons don't name. None where they aren't available.
+_LINUX = sys.platform.startswith('linux')
+IP_PKTINFO = getattr(socket, 'IP_PKTINFO', 8 if _LINUX else None)
+IP_MULTICAST_ALL = getattr(socket, 'IP_MULTICAST_ALL', 49 if _LINUX else None)
+
+# Names of the built in codecs, for the encoding kwarg
+RAW = 'raw'
+TEXT = 'text'
+JSON = 'json'
+BINARY = 'binary'
+PICKLE = 'pickle'
+
+# Names of the built in compressors, for the compression kwarg
+ZLIB = 'zlib'
+LZMA = 'lzma'
+
+
+class RawCodec():
+    """
+        Passes bytes-like data through untouched.
+    """
+    def encode(self, data):
+        return data
+
+    def decode(self, data):
+        return data
+
+
+class TextCodec():
+    """
+        UTF-8 encoded strings.
+    """
+    def encode(self, data):
+        return data.encode('utf-8')
+
+    def decode(self, data):
+        return bytes(data).decode('utf-8')
+
+
+class JSONCodec():
+    """
+        UTF-8 encoded JSON. Safe to accept from untrusted peers.
+    """
+    def encode(self, data):
+        return json.dumps(data, separators=(',', ':')).encode('utf-8')
+
+    def decode(self, data):
+        return json.loads(bytes(data).decode('utf-8'))
+
+
+class BinaryCodec():
+    """
+        A compact, type tagged binary format for None, bools, ints, floats, strings, bytes, lists, tuples and dicts.
+        Every value is a one byte tag followed by the smallest fixed size struct that holds it, or a length prefix and
+        its contents. Unlike pickle, decoding can only ever build those types, so it is safe to accept from untrusted peers.
+    """
+    NONE, TRUE, FALSE, INT8, INT32, INT64, BIGINT, FLOAT, STR8, STR, BYTES, LIST, TUPLE, DICT = range(14)
+
+    _tag = struct.Struct('!B')
+    _int8 = struct.Struct('!Bb')
+    _int32 = struct.Struct('!Bi')
+    _int64 = struct.Struct('!Bq')
+    _float = struct.Struct('!Bd')
+    _short = struct.Struct('!BB')  # Tag and a length below 256
+    _sized = struct.Struct('!BI')  # Tag and length (or item count)
+
+    def encode(self, data):
+        out = bytearray()
+        self._encode(data, out)
+        return out
+
+    def _encode(self, value, out):
+        # Checked in order of how often they appear in typical records. bool is checked by exact type, so it isn't
+        # mistaken for an int.
+        kind = type(value)
+        if kind is str:
+            value = value.encode('utf-8')
+            if len(value) < 256:
+                out += self._short.pack(self.STR8, len(value))
+            else:
+                out += self._sized.pack(self.STR, len(value))
+            out += value
+        elif kind is int:
+            if -128 <= value < 128:
+                out += self._int8.pack(self.INT8, value)
+            elif -2 ** 31 <= value < 2 ** 31:
+                out += self._int32.pack(self.INT32, value)
+            elif -2 ** 63 <= value < 2 ** 63:
+                out += self._int64.pack(self.INT64, value)
+            else:
+                value = value.to_bytes((value.bit_length() + 8) // 8, 'big', signed=True)
+                out += self._sized.pack(self.BIGINT, len(value))
+                out += value
+        elif kind is float:
+            out += self._float.pack(self.FLOAT, value)
+        elif value is None:
+            out += self._tag.pack(self.NONE)
+        elif kind is bool:
+            out += self._tag.pack(self.TRUE if value else self.FALSE)
+        elif kind is dict:
+            out += self._sized.pack(self.DICT, len(value))
+            for key, item in value.items():
+                self._encode(key, out)
+                self._encode(item, out)
+        elif kind is list or kind is tuple:
+            out += self._sized.pack(self.LIST if kind is list else self.TUPLE, len(value))
+            for item in value:
+                self._encode(item, out)
+        elif kind in (bytes, bytearray, memoryview):
+            out += self._sized.pack(self.BYTES, len(value))
+            out += value
+        else:
+            raise TypeError("{} can't be encoded as binary".format(kind.__name__))
+
+    def decode(self, data):
+        value, offset = self._decode(memoryview(data), 0)
+        return value
+
+    def _decode(self, view, offset):
+        tag = view[offset]
+
+        if tag == self.STR8:
+            end = offset + 2 + view[offset + 1]
+            return str(view[offset + 2:end], 'utf-8'), end
+        if tag == self.INT8:
+            return self._int8.unpack_from(view, offset)[1], offset + 2
+        if tag == self.INT32:
+            return self._int32.unpack_from(view, offset)[1], offset + 5
+        if tag == self.INT64:
+            return self._int64.unpack_from(view, offset)[1], offset + 9
+        if tag == self.FLOAT:
+            return self._float.unpack_from(view, offset)[1], offset + 9
+        if tag == self.NONE:
+            return None, offset + 1
+        if tag == self.TRUE:
+            return True, offset + 1
+        if tag == self.FALSE:
+            return False, offset + 1
+
+        length = self._sized.unpack_from(view, offset)[1]
+        offset += self._sized.size
+
+        if tag == self.DICT:
+            value = {}
+            for i in range(length):
+                key, offset = self._decode(view, offset)
+                value[key], offset = self._decode(view, offset)
+            return value, offset
+        if tag == self.LIST or tag == self.TUPLE:
+            value = []
+            for i in range(length):
+                item, offset = self._decode(view, offset)
+                value.append(item)
+            return (value if tag == self.LIST else tuple(value)), offset
+        if tag == self.STR:
+            return str(view[offset:offset + length], 'utf-8'), offset + length
+        if tag == self.BYTES:
+            return bytes(view[offset:offset + length]), offset + length
+        if tag == self.BIGINT:
+            return int.from_bytes(view[offset:offset + length], 'big', signed=True), offset + length
+
+        raise ValueError("Unknown binary tag {}".format(tag))
+
+
+class PickleCodec():
+    """
+        Python's pickle. Only use this between trusted peers: unpickling data from the network can run arbitrary code.
+    """
+    def encode(self, data):
+        return pickle.dumps(data, pickle.HIGHEST_PROTOCOL)
+
+    def decode(self, data):
+        return pickle.loads(data)
+
+
+CODECS = {
+    RAW: RawCodec(),
+    TEXT: TextCodec(),
+    JSON: JSONCodec(),
+    BINARY: BinaryCodec(),
+    PICKLE: PickleCodec(),
+}
+
+
+def register_codec(name, codec):
+    """
+        Makes a codec available to the encoding kwarg by name.
+
+        :param name: The name to select the codec by
+        :type name: str
+
+        :param codec: An object with encode(data) -> bytes and decode(bytes-like) -> data methods
+    """
+    CODECS[name] = codec
+
+
+def get_codec(encoding):
+    """
+        Looks up a codec by name. Codec objects are returned as they are.
+    """
+    if hasattr(encoding, 'encode') and hasattr(encoding, 'decode') and not isinstance(encoding, str):
+        return encoding
+    try:
+        return CODECS[encoding]
+    except KeyError:
+        raise ValueError("Unknown encoding {!r}. Choose from {}".format(encoding, ', '.join(sorted(CODECS))))
+
+class ZlibCompressor():
+    """
+        DEFLATE compression. Fast, with a good ratio on repetitive records.
+    """
+    flag = 1
+
+    def __init__(self, level=6):
+        self.level = level
+
+    def compress(self, data):
+        return zlib.compress(data, self.level)
+
+    def decompress(self, data):
+        return zlib.decompress(data)
+
+
+class LZMACompressor():
+    """
+        LZMA compression. Smaller than zlib, but several times slower.
+    """
+    flag = 2
+
+    def __init__(self, preset=1):
+        self.preset = preset
+
+    def compress(self, data):
+        return lzma.compress(data, lzma.FORMAT_RAW, filters=[{'id': lzma.FILTER_LZMA2, 'preset': self.preset}])
+
+    def decompress(self, data):
+        return lzma.decompress(data, lzma.FORMAT_RAW, filters=[{'id': lzma.FILTER_LZMA2}])
+
+
+# Compressed connections prefix every message with one of these flag bytes, so each end can tell how it was sent
+UNCOMPRESSED = 0
+
+COMPRESSORS = {ZLIB: ZlibCompressor()}
+if lzma is not None:
+    COMPRESSORS[LZMA] = LZMACompressor()
+
+
+# What a compressor raises for data it can't decompress (or an unknown flag)
+_DECOMPRESSION_ERRORS = (ValueError, zlib.error) + ((lzma.LZMAError,) if lzma is not None else ())
+
+
+def get_compressor(compression):
+    """
+        Looks up a compressor by name, or by the flag byte it marks messages with.
+    """
+    for name, compressor in COMPRESSORS.items():
+        if compression == name or compression == compressor.flag:
+            return compressor
+    raise ValueError("Unknown compression {!r}. Choose from {}".format(compression, ', '.join(sorted(COMPRESSORS))))
+
+
+class Histogram():
+    """
+        An HDR style latency histogram. Values are bucketed with a fixed relative precision: every power of two is split
+        into 2 ** precision_bits linear sub-buckets, and percentiles are reported at a bucket's midpoint, so any value is
+        off by at most 1 / 2 ** (precision_bits + 1), and recording is a few integer operations whatever the range.
+
+        :param precision_bits: Default 5. Sub-buckets per power of two, as a power of two (5 gives 1.6% precision).
+        :type precision_bits: int
+    """
+    precision_bits = 5
+
+    def __init__(self, *args, **kwargs):
+
+        for key, value in kwargs.items():
+            setattr(self, key, value)
+
+        self.buckets = collections.Counter()  # Bucket lower bound, in nanoseconds: count
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def record(self, seconds):
+        nanos = round(seconds * 1e9)
+        shift = max(0, nanos.bit_length() - self.precision_bits - 1)  # Keep precision_bits below the leading one
+        self.buckets[nanos >> shift << shift] += 1
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def merge(self, other):
+        """
+            Adds another Histogram's values (with the same precision_bits) to this one, e.g. to combine histograms
+            recorded in several processes
+        """
+        self.buckets.update(other.buckets)
+        self.count += other.count
+        self.total += other.total
+        self.max = max(self.max, other.max)
+
+    def percentile(self, fraction):
+        """
+            Returns the value, in seconds, below which fraction of the recorded values fall. None if nothing was recorded.
+        """
+        if not self.count:
+            return None
+        rank = fraction * self.count
+        seen = 0
+        for bucket in sorted(self.buckets):
+            seen += self.buckets[bucket]
+            if seen >= rank:
+                width = 1 << max(0, bucket.bit_length() - self.precision_bits - 1)
+                return min((bucket + (width >> 1)) / 1e9, self.max)  # The midpoint, so the error is at most half a bucket
+        return self.max
+
+    def snapshot(self):
+        return {
+            'count': self.count,
+            'sum': self.total,
+            'max': self.max,
+            'p50': self.percentile(0.5),
+            'p99': self.percentile(0.99),
+            'p999': self.percentile(0.999),
+        }
+
+
+class Metrics():
+    """
+        Counters and latency histograms for connections. Pass a Metrics to a client or server with metrics=Metrics().
+        Several connections can share one Metrics to aggregate them. Connections without one (the default) skip all
+        instrumentation after a single None check.
+    """
+    COUNTERS = ('messages_in', 'messages_out', 'bytes_in', 'bytes_out', 'connections', 'errors', 'timeouts', 'retransmits',
+                'lost', 'reordered')
+    HISTOGRAMS = ('accept_latency', 'encode_time', 'network_latency', 'decode_time', 'ack_time', 'rtt', 'round_trip')
+
+    def __init__(self, *args, **kwargs):
+
+        for key, value in kwargs.items():
+            setattr(self, key, value)
+
+        self._lock = threading.Lock()
+        self.counters = dict.fromkeys(self.COUNTERS, 0)
+        self.histograms = {name: Histogram() for name in self.HISTOGRAMS}
+
+    def count(self, name, value=1):
+        with self._lock:
+            self.counters[name] += value
+
+    def received(self, nbytes, messages=1):
+        with self._lock:
+            self.counters['messages_in'] += messages
+            self.counters['bytes_in'] += nbytes
+
+    def sent(self, nbytes, messages=1):
+        with self._lock:
+            self.counters['messages_out'] += messages
+            self.counters['bytes_out'] += nbytes
+
+    def observe(self, name, seconds):
+        with self._lock:
+            self.histograms[name].record(seconds)
+
+    def snapshot(self):
+        """
+            Exports the current values as a dict
+        """
+        with self._lock:
+            return {
+                'counters': dict(self.counters),
+                'histograms': {name: histogram.snapshot() for name, histogram in self.histograms.items()},
+            }
+
+    def prometheus(self, prefix='network_tools'):
+        """
+            Exports the current values in the Prometheus text format. Histograms are exported as summaries.
+        """
+        snapshot = self.snapshot()
+        lines = []
+        for name, value in snapshot['counters'].items():
+            lines.append('# TYPE {}_{}_total counter'.format(prefix, name))
+            lines.append('{}_{}_total {}'.format(prefix, name, value))
+        for name, histogram in snapshot['histograms'].items():
+            metric = '{}_{}_seconds'.format(prefix, name)
+            lines.append('# TYPE {} summary'.format(metric))
+            for quantile, key in (('0.5', 'p50'), ('0.99', 'p99'), ('0.999', 'p999')):
+                value = histogram[key]
+                lines.append('{}{{quantile="{}"}} {}'.format(metric, quantile, 'NaN' if value is None else value))
+            lines.append('{}_sum {}'.format(metric, histogram['sum']))
+            lines.append('{}_count {}'.format(metric, histogram['count']))
+        return '\n'.join(lines) + '\n'
+
+
+class MetricsServer():
+    """
+        Serves a Metrics object's exports over HTTP from a background thread, e.g. for a Prometheus scraper.
+
+        :param metrics: The Metrics to export
+        :type metrics: Metrics
+
+        :param host: Default "127.0.0.1".
+        :type host: str
+
+        :param port: Default 9100. 0 picks a free port.
+        :type port: int
+
+        :param exporters: Default {"/metrics": Prometheus text, "/snapshot": JSON}. Maps each path to a (content type, function(metrics) -> str) pair.
+        :type exporters: dict
+    """
+    metrics = None
+    host = '127.0.0.1'
+    port = 9100
+    exporters = None
+
+    def __init__(self, *args, **kwargs):
+
+        for key, value in kwargs.items():
+            setattr(self, key, value)
+
+        if self.exporters is None:
+            self.exporters = {
+                '/metrics': ('text/plain; version=0.0.4', Metrics.prometheus),
+                '/snapshot': ('application/json', lambda metrics: json.dumps(metrics.snapshot())),
+            }
+
+        import http.server, socketserver  # Imported here, as only metrics exporters need it and it's slow to import
+
+        exporters, metrics = self.exporters, self.metrics
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path not in exporters:
+                    self.send_error(404)
+                    return
+                content_type, export = exporters[self.path]
+                body = export(metrics).encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass  # Scrapes shouldn't spam the terminal
+
+        class Server(socketserver.ThreadingMixIn, http.server.HTTPServer):
+            daemon_threads = True  # http.server.ThreadingHTTPServer, which is only in 3.7+
+
+        self.server = Server((self.host, self.port), Handler)
+        self.port = self.server.server_address[1]
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self._thread.start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class Resolver():
+    """
+        A thread safe cache in front of socket.getaddrinfo, shared by every client through RESOLVER, so repeated sends
+        never wait on the name server. Failed lookups are cached too (for negative_ttl), so a missing host doesn't
+        hit the resolver on every attempt either.
+
+        :param ttl: Default 300. Seconds a successful lookup is reused for.
+        :type ttl: Union[int, float]
+
+        :param negative_ttl: Default 10. Seconds a failed lookup is remembered for.
+        :type negative_ttl: Union[int, float]
+    """
+    ttl = 300
+    negative_ttl = 10
+
+    def __init__(self, *args, **kwargs):
+
+        for key, value in kwargs.items():
+            setattr(self, key, value)
+
+        self._lock = threading.Lock()
+        self._cache = {}  # getaddrinfo arguments: (expiry time, result or socket.gaierror)
+
+    def getaddrinfo(self, host, port, family=0, type=0):
+        """
+            Cached socket.getaddrinfo(host, port, family, type)
+        """
+        key = (host, port, family, type)
+        now = time.monotonic()
+
+        with self._lock:
+            expires, result = self._cache.get(key, (0, None))
+        if expires <= now:
+            try:
+                result = socket.getaddrinfo(host, port, family, type)
+                expires = now + self.ttl
+            except socket.gaierror as e:
+                result = e
+                expires = now + self.negative_ttl
+            with self._lock:
+                self._cache[key] = (expires, result)
+
+        if isinstance(result, socket.gaierror):
+            raise result
+        return result
+
+    def resolve(self, host, port, family=0, type=0):
+        """
+            Returns the first socket address host and port resolve to
+        """
+        return self.getaddrinfo(host, port, family, type)[0][4]
+
+    def clear(self):
+        with self._lock:
+            self._cache.clear()
+
+
+RESOLVER = Resolver()
+
+
+def default_host():
+    """
+        This machine's IPv4 address, or localhost's if the hostname doesn't resolve. Looked up on first use rather than
+        at import, and cached by RESOLVER.
+    """
+    try:
+        return RESOLVER.resolve(socket.gethostname(), None, socket.AF_INET)[0]
+    except socket.gaierror:
+        return RESOLVER.resolve('localhost', None, socket.AF_INET)[0]
+
+
+class _DefaultHost():
+    # Stands in for the host class attribute, resolving default_host() when a connection without a host reads it
+    def __get__(self, instance, owner):
+        return default_host()
+
+
+# Marks a Transmission whose raw data hasn't been decoded yet
+_UNDECODED = object()
+
+
 class Transmission():
     """
         Successful connections will return a Transmission object. To print the content, simply print the Transmission object.
 
-        :param content: The bytearray that was received
-        :type content: bytearray
+        Servers don't decode what they receive until content is first read, so messages that are only counted,
+        forwarded or filtered on their sender never pay for decoding. Raw data may be a memoryview over a buffer the
+        server reuses (see UDPServer.listen_batch). Call copy() to keep such a Transmission, or release() once done with it.
+
+        :param content: The decoded data, or the bytes that were received if there's no encoding
+        :type content: Union[bytes, bytearray, memoryview, object]
 
         :param sender: The (host:port) tuple of the socket that sent the data
         :type sender: tuple
 
         :param receiver: The (host:port) tuple of the socket that received the data
         :type receiver: tuple
-    """
-    content = None
-    sender = None
-    receiver = None
 
-    def __init__(self, *args, **kwargs):
+        :param raw: The bytes that were received, if content is to be decoded from them on first access
+        :type raw: Union[bytes, bytearray, memoryview]
 
-        # Go through keyword arguments, and either save their values to our
-        # instance, or raise an error.
-        for key, value in kwargs.items():
-            setattr(self, key, value)
+        :param encoding: Default None. The codec raw is decoded with
+        :type encoding: Union[None, str]
+
+        :param reply_to: Default None. For requests received by a multiplexed TCPServer, the (connection, request id, send lock) that TCPServer.respond() answers on
+        :type reply_to: Union[None, tuple]
+
+        Traced messages (see trace on clients and servers) also carry their sequence number, and the time.monotonic()
+        they were sent at, received at, decoded at (once content is first read) and acked at (TCP only). Responses to
+        traced TCP messages carry the request's times and its rtt: the seconds from sending to the ack arriving.
+        These are None for messages that weren't traced.
+    """
+    __slots__ = ('raw', 'sender', 'receiver', 'encoding', 'reply_to', '_content',
+                 'sequence', 'sent_at', 'received_at', 'decoded_at', 'acked_at', 'rtt')
+
+    def __init__(self, content=None, sender=None, receiver=None, raw=None, encoding=None, reply_to=None):
+        self.sender = sender
+        self.receiver = receiver
+        self.encoding = encoding
+        self.reply_to = reply_to
+        self.sequence = self.sent_at = self.received_at = self.decoded_at = self.acked_at = self.rtt = None
+
+        if raw is None:
+            self.raw = self._content = content
+        else:
+            self.raw = raw
+            self._content = _UNDECODED if encoding else raw
+
+    @property
+    def content(self):
+        if self._content is _UNDECODED:
+            self._content = get_codec(self.encoding).decode(self.raw)
+            if self.received_at is not None:
+                self.decoded_at = time.monotonic()
+        return self._content
+
+    @content.setter
+    def content(self, value):
+        self._content = value
+
+    def copy(self):
+        """
+            Returns a Transmission that owns its data, so it stays valid after the receive buffer is reused
+        """
+        raw = bytes(self.raw) if isinstance(self.raw, memoryview) else self.raw
+        copy = Transmission(sender=self.sender, receiver=self.receiver, raw=raw, encoding=self.encoding, reply_to=self.reply_to)
+        if self._content is not _UNDECODED and self._content is not self.raw:
+            copy._content = self._content
+        copy.sequence, copy.sent_at, copy.received_at = self.sequence, self.sent_at, self.received_at
+        copy.decoded_at, copy.acked_at, copy.rtt = self.decoded_at, self.acked_at, self.rtt
+        return copy
+
+    def release(self):
+        """
+            Drops this Transmission's reference to the receive buffer, so the buffer can be reused or freed
+        """
+        if self._content is self.raw:
+            self._content = None
+        if isinstance(self.raw, memoryview):
+            self.raw.release()
+        self.raw = None
 
     def __str__(self):
-        return self.content
+        content = self.content
+        if isinstance(content, (bytes, bytearray, memoryview)):
+            return bytes(content).decode('utf-8', 'replace')
+        return str(content)
 
     def __repr__(self):
         return str(self.content)
@@ -43,7 +689,7 @@ class _BaseConnection():
     """
         Base class to build network connections from.
 
-        :param host: Default hostname. An IP address to accept connections through.
+        :param host: Default hostname. An IP address to accept connections through. The hostname is only resolved if no host is given.
         :type host: str
 
         :param port: Default 10000. A port to accept connections through.
@@ -55,19 +701,57 @@ class _BaseConnection():
         :param identifier: A name for the server
         :type identifier: Union[str, int]
 
-        :param buffer_size: Default 4096. The size, in bytes of the buffer. Must be between 0 and 4096
+        :param buffer_size: Default 4096. The size, in bytes, of the first read. Reads that fill the buffer double it for the next read, up to max_buffer_size, so it grows with the messages received.
         :type buffer_size: int
 
+        :param max_buffer_size: Default 65536. The most buffer_size grows to. 65536 holds any UDP datagram.
+        :type max_buffer_size: int
+
+        :param recv_buffer: Default None. If set, the kernel receive buffer (SO_RCVBUF) size in bytes. Larger buffers absorb bursts that would otherwise be dropped. The kernel may cap (and on Linux doubles) the value.
+        :type recv_buffer: Union[None, int]
+
+        :param send_buffer: Default None. If set, the kernel send buffer (SO_SNDBUF) size in bytes.
+        :type send_buffer: Union[None, int]
+
+        :param framed: Default False. If True, stream messages are prefixed with their length, so the receiver reads exactly one whole message.
+        :type framed: bool
+
+        :param encoding: Default None. The name of the codec (see CODECS) used when send() or listen() aren't given an encoding. If None, strings are sent as UTF-8 and data is received as bytes.
+        :type encoding: Union[None, str]
+
+        :param metrics: Default None. A Metrics object to count messages, bytes, errors and latencies in. If None, nothing is measured.
+        :type metrics: Union[None, Metrics]
+
+        :param compression: Default None. The name of the compressor (see COMPRESSORS) clients compress messages with. Every message then carries a flag byte saying how it was compressed, so servers must also set compression (to any compressor) to read them.
+        :type compression: Union[None, str]
+
+        :param compress_min_size: Default 512. Messages smaller than this many bytes are sent uncompressed.
+        :type compress_min_size: int
+
+        :param max_frame_size: Default 64 MiB. The largest framed message accepted. A frame header announcing more closes the connection, rather than allocating whatever a peer asks for.
+        :type max_frame_size: int
+
+        :param trace: Default False. If True, TCPClient, UDPClient and MulticastClient stamp every message with a sequence number and its send time, and servers record when each message was received, decoded and acked on its Transmission. With metrics, each stage's latency is observed, and datagram servers count sequence gaps as lost and late arrivals as reordered. Both ends must set it. Send times come from time.monotonic(), so one way latencies are only meaningful on a single host. Not supported by multiplexed, async or reliable UDP connections.
+        :type trace: bool
+
     """
-    try:  # TODO: This is a bit hacky
-        host = socket.gethostbyname(socket.gethostname())
-    except socket.gaierror:
-        host = socket.gethostbyname('localhost')
+    host = _DefaultHost()
 
     port = 10000
     timeout = None
     identifier = ""
     buffer_size = 4096
+    max_buffer_size = 65536
+    recv_buffer = None
+    send_buffer = None
+    framed = False
+    encoding = None
+    metrics = None
+    compression = None
+    compress_min_size = 512
+    max_frame_size = 64 * 1024 * 1024
+    family = socket.AF_INET
+    trace = False
 
     def __init__(self, *args, **kwargs):
 
@@ -76,18 +760,176 @@ class _BaseConnection():
         for key, value in kwargs.items():
             setattr(self, key, value)
 
+    @property
+    def endpoint(self):
+        """
+            The address the server is bound to, or the client sends to, as given: (host, port)
+        """
+        return (self.host, self.port)
+
+    @property
+    def read_size(self):
+        """
+            The size of the next read: buffer_size, or larger once reads have filled it
+        """
+        return max(self.buffer_size, getattr(self, '_read_size', 0))
+
+    def _observe_read(self, nbytes):
+        # Adaptive read sizing. A read that filled the buffer may have been cut short, so double the next one (or
+        # more, for a datagram that was larger than read_size).
+        size = self.read_size
+        if nbytes >= size and size < self.max_buffer_size:
+            while size <= nbytes:
+                size *= 2
+            self._read_size = min(size, self.max_buffer_size)
+
+    def tune(self, sock):
+        """
+            Applies recv_buffer and send_buffer to a socket
+        """
+        if self.recv_buffer is not None:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, self.recv_buffer)
+        if self.send_buffer is not None:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, self.send_buffer)
+        return sock
+
+    def send_frame(self, sock, data, request_id=None):
+        """
+            Send data on a stream socket, prefixed with its length, and the request id it belongs to if one is given
+        """
+        header = FRAME_HEADER.pack(len(data)) if request_id is None else MUX_HEADER.pack(len(data), request_id)
+
+        # Send the header and payload together without concatenating (copying) them
+        sent = sock.sendmsg([header, data]) if hasattr(sock, 'sendmsg') else 0
+        if sent < len(header):
+            sock.sendall(memoryview(header)[sent:])
+            sent = len(header)
+        if sent - len(header) < len(data):
+            sock.sendall(memoryview(data)[sent - len(header):])
+
+    def recv_into_exactly(self, sock, view):
+        """
+            Fill a memoryview from a stream socket, raising ConnectionError if the peer closes first
+        """
+        received = 0
+        while received < len(view):
+            count = sock.recv_into(view[received:])
+            if count == 0:
+                raise ConnectionError("connection closed after {} of {} bytes".format(received, len(view)))
+            received += count
+
+    def recv_frame(self, sock):
+        """
+            Receive one length prefixed message from a stream socket into a single preallocated bytearray. Raises
+            ConnectionError if the peer closes first, or announces a frame larger than max_frame_size.
+        """
+        header = bytearray(FRAME_HEADER.size)
+        self.recv_into_exactly(sock, memoryview(header))
+        length, = FRAME_HEADER.unpack(header)
+
+        data = bytearray(self._frame_size(length))
+        self.recv_into_exactly(sock, memoryview(data))
+        return data
+
+    def recv_mux_frame(self, sock):
+        """
+            Receive one multiplexed message from a stream socket. Returns its request id and data. Raises
+            ConnectionError like recv_frame().
+        """
+        header = bytearray(MUX_HEADER.size)
+        self.recv_into_exactly(sock, memoryview(header))
+        length, request_id = MUX_HEADER.unpack(header)
+
+        data = bytearray(self._frame_size(length))
+        self.recv_into_exactly(sock, memoryview(data))
+        return request_id, data
+
+    def _frame_size(self, length):
+        # Frame lengths come from the peer, so refuse to allocate more than max_frame_size for one
+        if length > self.max_frame_size:
+            if self.metrics is not None:
+                self.metrics.count('errors')
+            raise ConnectionError("{}{} refused a {} byte frame, larger than max_frame_size ({}){}".format(settings.RED, self.identifier, length, self.max_frame_size, settings.NORMAL))
+        return length
+
+    def _recv_available(self, sock):
+        # Reads an unframed message: one blocking read, and if that fills the (growing) buffer, the rest of the message,
+        # until nothing more arrives within read_timeout
+        size = self.read_size
+        data = sock.recv(size)
+        self._observe_read(len(data))
+        if len(data) < size:
+            return data
+
+        chunks = [data]
+        while True:
+            size = self.read_size
+            try:
+                chunk = sock.recv(size, MSG_DONTWAIT)
+            except BlockingIOError:
+                if not select.select([sock], [], [], self.read_timeout)[0]:
+                    break
+                chunk = sock.recv(size)
+            if not chunk:
+                break  # The client closed the connection
+            chunks.append(chunk)
+            self._observe_read(len(chunk))
+        return b''.join(chunks)
+
+    def encode(self, data, encoding, compress=True):
+        """
+            Serialise the data with the codec registered under encoding. If encoding is None, strings are UTF-8 encoded
+            and bytes-like data is sent as it is. The result is then compressed (see compress()).
+        """
+        if not encoding:
+            if not isinstance(data, (bytes, bytearray, memoryview)):
+                data = bytearray(data, encoding='utf-8')
+        else:
+            data = get_codec(encoding).encode(data)
+
+        return self.compress(data, compress)
 
     def decode(self, data, encoding):
         """
-            Serialise the data
+            Deserialise the data with the codec registered under encoding. If encoding is None the data is returned as it is.
         """
         if not encoding:
             return data
-        if encoding == JSON:
-            data = pickle.loads(b''.join(data))
-        elif encoding == TEXT:
-            data = str(data)
-        return data
+        return get_codec(encoding).decode(data)
+
+    def compress(self, data, compress=True):
+        """
+            Compresses data, if compression is set and data is at least compress_min_size bytes, and prefixes the flag
+            byte. If compress is False this message is flagged and sent uncompressed.
+        """
+        if self.compression is None:
+            return data
+
+        if compress and len(data) >= self.compress_min_size:
+            compressor = get_compressor(self.compression)
+            compressed = compressor.compress(data)
+            if len(compressed) < len(data):
+                return bytes((compressor.flag,)) + compressed
+        return bytes((UNCOMPRESSED,)) + data
+
+    def decompress(self, data):
+        """
+            Strips the flag byte from a message received with compression set, and decompresses it if it was compressed.
+            Raises ConnectionError if the message has no flag, an unknown one, or doesn't decompress, as it came from a
+            peer that isn't speaking the same protocol.
+        """
+        if self.compression is None:
+            return data
+        if not data:
+            raise ConnectionError("{}{} received a message with no compression flag{}".format(settings.RED, self.identifier, settings.NORMAL))
+
+        flag = data[0]
+        if flag == UNCOMPRESSED:
+            return memoryview(data)[1:]  # Don't copy the payload just to drop the flag
+        try:
+            return get_compressor(flag).decompress(memoryview(data)[1:])
+        except _DECOMPRESSION_ERRORS as e:
+            raise ConnectionError("{}{} received a corrupt message: {}{}".format(settings.RED, self.identifier, e, settings.NORMAL))
 
     def __del__(self):
 
@@ -102,19 +944,23 @@ class _BaseClient(_BaseConnection):
     """
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)  # _BaseConnection.init()
+        self._stream = int.from_bytes(os.urandom(4), 'big')  # Tells this client's sequence apart from others' when tracing
+        self._sequence = itertools.count()
 
     def send(self, data, *args, **kwargs):
         pass
 
-    def encode(self, data, encoding):
-
-        if not encoding:
-            data = bytearray(data, encoding='utf-8')
-
-        elif encoding == JSON:
-            data = pickle.dumps(data)
+    def _stamp(self, data):
+        # Prefixes an encoded message with a trace header. Returns the traced message, its sequence number and send time.
+        sequence = next(self._sequence) & 0xFFFFFFFF
+        sent_at = time.monotonic()
+        return TRACE_HEADER.pack(self._stream, sequence, sent_at) + data, sequence, sent_at
 
-        return data
+    def address(self, type=socket.SOCK_STREAM):
+        """
+            The server's (host, port) socket address, through the shared RESOLVER cache
+        """
+        return RESOLVER.resolve(self.host, self.port, socket.AF_INET, type)
 
 class _BaseServer(_BaseConnection):
     """
@@ -122,8 +968,20 @@ class _BaseServer(_BaseConnection):
 
         :param peek: Default 0. The slice length of received packets to print
         :type peek: bool
+
+        :param reuse_port: Default False. If True, sets SO_REUSEPORT so several servers (e.g. one per process) can bind the same address, and the kernel balances traffic between them.
+        :type reuse_port: bool
+
+        :param poll_interval: Default 0.5. Seconds between stream()'s checks of its stop token.
+        :type poll_interval: float
+
+        :param capture: Default None. A Capture every received request is recorded in, to replay() later.
+        :type capture: Union[None, Capture]
     """
     peek = 0
+    reuse_port = False
+    poll_interval = 0.5
+    capture = None
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs) # _BaseConnection.init()
@@ -133,12 +991,153 @@ class _BaseServer(_BaseConnection):
         for key, value in kwargs.items():
             setattr(self, key, value)
 
-    def listen(self):
+        self._sequences = {}  # (sender host, stream id): the next sequence number expected, when tracing
+
+    def listen(self, *args, **kwargs):
         if self.timeout and self.timeout < 0:
             raise ValueError("timeout must be a positive integer")
 
-        if self.buffer_size <= 0 or self.buffer_size > 4096:
-            raise ValueError("buffer_size must be between 0 and 4096")
+        if self.buffer_size <= 0 or self.buffer_size > self.max_buffer_size:
+            raise ValueError("buffer_size must be between 0 and max_buffer_size ({})".format(self.max_buffer_size))
+
+    def stream(self, batch=None, stop=None, *args, **kwargs):
+        """
+            Yields requests as they arrive. Unlike calling listen() in a loop, the settings are validated once, and
+            whatever has already arrived is received together. UDP content is a memoryview into a reused buffer, as
+            with listen_batch(), so it's only valid until the stream resumes: call request.copy() to keep it longer.
+
+            Servers stream by implementing _receive_batch(max_packets, timeout, encoding), which waits up to timeout
+            seconds (forever if None) for requests and returns a list of up to max_packets of them, empty if none
+            arrived. Servers without it raise TypeError.
+
+            :param batch: Default None. If set, yield lists of up to batch requests (whatever had arrived), rather than one request at a time.
+            :type batch: Union[None, int]
+
+            :param stop: Default None. An event (anything with is_set()) that ends the stream once set. It's checked at least every poll_interval seconds. If None, the stream never ends.
+            :type stop: Union[None, threading.Event]
+
+            :param encoding: Default self.encoding. The encoding to decode received data with.
+            :type encoding: Union[None, str]
+        """
+        max_packets, timeout, encoding = self._stream_settings(batch, stop, *args, **kwargs)
+        receive = self._streamer()
+
+        while stop is None or not stop.is_set():
+            requests = receive(max_packets, timeout, encoding)
+            if batch is None:
+                yield from requests
+            elif requests:
+                yield requests
+
+    async def astream(self, batch=None, stop=None, *args, **kwargs):
+        """
+            stream() as an async iterator, for use with "async for". Each batch is received in the event loop's
+            default executor, so the loop isn't blocked while the server waits. Takes the same arguments as stream().
+        """
+        import asyncio
+        max_packets, timeout, encoding = self._stream_settings(batch, stop, *args, **kwargs)
+        receive = self._streamer()
+        loop = asyncio.get_running_loop()
+
+        while stop is None or not stop.is_set():
+            requests = await loop.run_in_executor(None, receive, max_packets, timeout, encoding)
+            if batch is None:
+                for request in requests:
+                    yield request
+            elif requests:
+                yield requests
+
+    def _streamer(self):
+        # The server's _receive_batch(), or a TypeError if it doesn't have one
+        try:
+            return self._receive_batch
+        except AttributeError:
+            raise TypeError("{}{} doesn't implement _receive_batch(), so it can't stream{}".format(settings.RED, type(self).__name__, settings.NORMAL))
+
+    def _stream_settings(self, batch, stop, *args, **kwargs):
+        # Validates stream()'s arguments, returning the most requests to receive at once, how long to wait for them
+        # and the encoding
+        _BaseServer.listen(self, *args, **kwargs)
+        if batch is not None and batch < 1:
+            raise ValueError("batch must be at least 1")
+        timeout = None if stop is None else self.poll_interval
+        return batch or 64, timeout, kwargs.get('encoding', self.encoding)
+
+    def _untrace(self, data, sender, gaps=True):
+        # Splits a traced message's header from the rest of it. Returns the rest, and the message's (sequence number,
+        # send time, receive time), or None if it's too short to be traced. With metrics, observes the one way latency
+        # and, if gaps is set, counts sequence numbers skipped as lost and ones that arrive after them as reordered.
+        received_at = time.monotonic()
+        if len(data) < TRACE_HEADER.size:
+            return data, None
+        stream, sequence, sent_at = TRACE_HEADER.unpack_from(data)
+
+        metrics = self.metrics
+        if metrics is not None:
+            metrics.observe('network_latency', max(0.0, received_at - sent_at))
+            if gaps:
+                key = (sender[0] if isinstance(sender, tuple) else sender, stream)
+                ahead = (sequence - self._sequences.get(key, sequence)) & 0xFFFFFFFF
+                if ahead < 0x80000000:
+                    if ahead:
+                        metrics.count('lost', ahead)
+                    self._sequences[key] = (sequence + 1) & 0xFFFFFFFF
+                else:  # Counted as lost when a later message overtook it
+                    metrics.count('reordered')
+                    metrics.count('lost', -1)
+        return data[TRACE_HEADER.size:], (sequence, sent_at, received_at)
+
+    def drops(self):
+        """
+            The number of datagrams the kernel dropped because this server's receive queue was full, since the socket
+            was opened. Read from /proc/net, so only available for UDP sockets on Linux: None otherwise.
+        """
+        if not _LINUX or self.socket.type != socket.SOCK_DGRAM:
+            return None
+
+        inode = str(os.fstat(self.socket.fileno()).st_ino)
+        for table in ('/proc/net/udp', '/proc/net/udp6'):
+            try:
+                with open(table) as lines:
+                    next(lines)  # Column headings
+                    for line in lines:
+                        fields = line.split()
+                        if fields[9] == inode:
+                            return int(fields[-1])
+            except OSError:
+                pass
+        return None
+
+    @property
+    def _datagram_room(self):
+        # The free space every datagram is received into: any UDP datagram, or max_buffer_size if that's larger
+        return max(MAX_DATAGRAM, self.max_buffer_size)
+
+    def _bind(self, sock):
+        sock.bind(self.endpoint)
+
+    def _drop(self, error):
+        # Counts and reports a received message that couldn't be read, so the server can carry on with the next
+        if self.metrics is not None:
+            self.metrics.count('errors')
+        print("{}{} reported {}{}".format(settings.RED, self.identifier, error, settings.NORMAL))
+
+    def _receive_traced(self, batch, data, encoding, sender, receiver):
+        # Appends a traced datagram to a batch
+        data, trace = self._untrace(data, sender)
+        request = Transmission(raw=self.decompress(data), encoding=encoding, sender=sender, receiver=receiver)
+        if trace is not None:
+            request.sequence, request.sent_at, request.received_at = trace
+        batch.append(request)
+
+    def _arena(self, max_packets):
+        # The buffer a batch of datagrams is received into, packed one after another, and reused between calls. Every
+        # datagram is received with at least _datagram_room bytes free, so none is truncated. There's room for
+        # max_packets datagrams of read_size, so the buffer grows with the datagrams observed.
+        size = max_packets * self.read_size + self._datagram_room
+        if self._buffer is None or len(self._buffer) != size:
+            self._buffer = memoryview(bytearray(size))
+        return self._buffer
 
 
 class TCPServer(_BaseServer):
@@ -151,18 +1150,41 @@ class TCPServer(_BaseServer):
 
         :param identifier: Default 'Anonymous TCP Server'. A name for the server for cases where multiple servers are running simultaneously.
         :type identifier: Union[int, str]
+
+        :param keep_alive: Default False. If True, connections stay open after each message so clients can reuse them. Implies framed.
+        :type keep_alive: bool
+
+        :param multiplexed: Default False. If True, every message carries a request id, and is answered with respond() rather than ACKed, in any order. Clients must also be multiplexed. Implies keep_alive.
+        :type multiplexed: bool
+
+        :param read_timeout: Default 0.01. Unframed messages have no length, so after a read fills the buffer the server keeps reading until no more of the message arrives for this many seconds. A sender that stalls for longer has the rest of its message cut off, so use framed for large messages.
+        :type read_timeout: float
     """
     max_connections = 10
     ack = ""
     identifier = "Anonymous TCP Server"
+    keep_alive = False
+    multiplexed = False
+    read_timeout = 0.01
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs) # _BaseServer.super()
+        self._selector = None
+        self._shutdown = threading.Event()
+        self._send_locks = weakref.WeakKeyDictionary()  # Connection: lock, so responses from several threads don't interleave
+
+        if self.multiplexed:
+            self.keep_alive = True
+        if self.keep_alive:
+            self.framed = True
 
         try:
             # Instantiate the socket as a TCP server
-            self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            self.socket.bind((self.host, self.port))
+            self.socket = self.tune(socket.socket(self.family, socket.SOCK_STREAM))
+            self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)  # Rebind while old connections are in TIME_WAIT
+            if self.reuse_port:
+                self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+            self._bind(self.socket)
             self.socket.listen(self.max_connections)
 
             if self.timeout is not None:
@@ -171,7 +1193,8 @@ class TCPServer(_BaseServer):
             if self.peek > 0:
                 print("{}{} opened on {}:{}{}".format(settings.GREEN, self.identifier, self.host, self.port, settings.NORMAL))
         except OSError as e:
-            raise OSError("{}Address {}:{} could not be assigned.{}".format(settings.RED, self.host, self.port, settings.NORMAL))
+            address = self.endpoint if isinstance(self.endpoint, str) else "{}:{}".format(*self.endpoint)
+            raise OSError("{}Address {} could not be assigned.{}".format(settings.RED, address, settings.NORMAL))
             if hasattr(self, 'socket'):
                 self.socket.close()
 
@@ -184,31 +1207,538 @@ class TCPServer(_BaseServer):
         """
         super().listen(*args, **kwargs)
         peek = kwargs.get('peek', None)
-        encoding = kwargs.get('encoding', None)
+        encoding = kwargs.get('encoding', self.encoding)
 
         if self.max_connections < 1:
             raise ValueError("max_connections must be at least 1")
 
         try:
-            connection, address = self.socket.accept()
-            data = []
-            packet = connection.recv(self.buffer_size)
-            data.append(packet)
-            connection.sendall(self.ack.encode()) # ACK the clients message
-            data = self.decode(data, encoding)
-
-            if peek:
-                print("{}{} received: {}...{}".format(settings.GREEN, self.identifier, str(data)[:peek], settings.NORMAL))
-
-            request = Transmission(content=data, sender=address, receiver=(self.host,self.port))
-            return request
+            while True:
+                connection, address = self._next_connection()
+                if connection is None:
+                    if self.metrics is not None:
+                        self.metrics.count('timeouts')
+                    return None  # Nothing arrived within self.timeout
+
+                try:
+                    request = self.receive(connection, address, encoding=encoding, peek=peek)
+                except OSError:
+                    if self.keep_alive:
+                        self._selector.unregister(connection)
+                    connection.close()
+                    raise
+                if not self.keep_alive:
+                    connection.close()
+                    return request
+                if request is not None:
+                    return request
+
+                # The client closed a kept alive connection
+                self._selector.unregister(connection)
+                connection.close()
 
         except socket.error as e:
+            if self.metrics is not None:
+                self.metrics.count('errors')
             raise socket.error("{}{} reported {}{}".format(settings.RED, self.identifier, e, settings.NORMAL))
 
-        finally:
-            if self.timeout:
-                time.sleep(self.timeout)
+    def receive(self, connection, address, *args, **kwargs):
+        """
+            Reads one message from an accepted connection and ACKs it. The connection is left open.
+            Returns None if the client closed the connection before sending anything.
+
+            :param connection: An accepted socket
+            :type connection: socket.socket
+
+            :param address: The (host:port) tuple of the client
+            :type address: tuple
+
+            :param accepted: Default None. The time.perf_counter() the connection was accepted at, to measure how long it waited to be served.
+            :type accepted: Union[None, float]
+        """
+        peek = kwargs.get('peek', None)
+        encoding = kwargs.get('encoding', self.encoding)
+        ack = self.ack.encode()
+        metrics = self.metrics
+
+        if metrics is not None and kwargs.get('accepted') is not None:
+            metrics.observe('accept_latency', time.perf_counter() - kwargs['accepted'])
+
+        reply_to = trace = None
+        if self.multiplexed:
+            try:
+                request_id, data = self.recv_mux_frame(connection)
+            except ConnectionError:
+                return None
+            lock = self._send_locks.get(connection)
+            if lock is None:
+                lock = self._send_locks[connection] = threading.Lock()
+            reply_to, ack = (connection, request_id, lock), b''  # Answered by respond()
+        elif self.framed:
+            try:
+                data = self.recv_frame(connection)
+            except ConnectionError:
+                return None
+            if self.trace:
+                data, trace, ack = self._trace_ack(data, address, ack)
+            self.send_frame(connection, ack) # ACK the clients message
+        else:
+            data = self._recv_available(connection)
+            if self.trace:
+                data, trace, ack = self._trace_ack(data, address, ack)
+            connection.sendall(ack) # ACK the clients message
+
+        request = Transmission(raw=self.decompress(data), encoding=encoding, sender=address, receiver=self.endpoint, reply_to=reply_to)
+        if trace is not None:
+            request.sequence, request.sent_at, request.received_at, request.acked_at = trace
+        if self.capture is not None:
+            self.capture.record(request)
+
+        if metrics is not None:
+            metrics.received(len(data))
+            if ack:
+                metrics.sent(len(ack))
+            start = time.perf_counter()
+            request.content  # Decode now, to time it
+            metrics.observe('decode_time', time.perf_counter() - start)
+
+        if peek:
+            print("{}{} received: {}...{}".format(settings.GREEN, self.identifier, str(request)[:peek], settings.NORMAL))
+
+        return request
+
+    def _trace_ack(self, data, address, ack):
+        # Strips a traced message's header, and prefixes the ack with the request's sequence number and receive and
+        # ack times. Returns the message, its (sequence number, send, receive and ack times) and the ack.
+        data, trace = self._untrace(data, address, gaps=False)
+        if trace is None:
+            return data, None, ack
+        acked_at = time.monotonic()
+        if self.metrics is not None:
+            self.metrics.observe('ack_time', acked_at - trace[2])
+        return data, trace + (acked_at,), TRACE_ACK.pack(trace[0], trace[2], acked_at) + ack
+
+    def respond(self, request, data, *args, **kwargs):
+        """
+            Answers a request received by a multiplexed server. Requests can be answered in any order, and from any
+            thread. The response is encoded (and compressed) like a client's message.
+
+            :param request: A Transmission returned by listen(), or passed to a serve_forever() handler
+            :type request: Transmission
+
+            :param data: The response
+        """
+        if request.reply_to is None:
+            raise ValueError("{}{} can only respond to requests received in multiplexed mode{}".format(settings.RED, self.identifier, settings.NORMAL))
+
+        connection, request_id, lock = request.reply_to
+        data = self.encode(data, kwargs.get('encoding', self.encoding), kwargs.get('compress', True))
+        with lock:
+            self.send_frame(connection, data, request_id)
+
+        if self.metrics is not None:
+            self.metrics.sent(len(data))
+
+    def respond_error(self, request, error):
+        """
+            Answers a request received by a multiplexed server with an error. The client's future raises RemoteError
+            with the error's message.
+        """
+        if request.reply_to is None:
+            raise ValueError("{}{} can only respond to requests received in multiplexed mode{}".format(settings.RED, self.identifier, settings.NORMAL))
+
+        connection, request_id, lock = request.reply_to
+        message = "{}: {}".format(type(error).__name__, error).encode('utf-8') if isinstance(error, BaseException) else str(error).encode('utf-8')
+        with lock:
+            self.send_frame(connection, message, request_id | MUX_ERROR)
+
+    def listen_file(self, path, *args, **kwargs):
+        """
+            Waits for a file sent with TCPClient.send_file(), and streams it to path in constant memory.
+            Returns a Transmission whose content is path, or None if nothing arrived within self.timeout.
+
+            :param path: Where to write the file. It is created, or truncated if it exists.
+            :type path: str
+
+            :param mmap: Default False. If True, the file is sized up front and received straight into a memory map of it, rather than through a buffer.
+            :type mmap: bool
+
+            :param chunk_size: Default 1MB. The most bytes read from the socket at once.
+            :type chunk_size: int
+        """
+        super().listen(*args, **kwargs)
+
+        try:
+            connection, address = self._next_connection()
+            if connection is None:
+                if self.metrics is not None:
+                    self.metrics.count('timeouts')
+                return None
+
+            try:
+                return self.receive_file(connection, address, path, **kwargs)
+            finally:
+                if self.keep_alive:
+                    self._selector.unregister(connection)
+                connection.close()
+
+        except socket.error as e:
+            if self.metrics is not None:
+                self.metrics.count('errors')
+            raise socket.error("{}{} reported {}{}".format(settings.RED, self.identifier, e, settings.NORMAL))
+
+    def receive_file(self, connection, address, path, *args, **kwargs):
+        """
+            Reads one file from an accepted connection into path and ACKs it. The connection is left open.
+            Takes the same mmap and chunk_size kwargs as listen_file().
+        """
+        chunk_size = kwargs.get('chunk_size', 1024 * 1024)
+        header = bytearray(FILE_HEADER.size)
+        self.recv_into_exactly(connection, memoryview(header))
+        size, = FILE_HEADER.unpack(header)
+
+        with open(path, 'w+b') as file:
+            if kwargs.get('mmap', False) and size > 0:
+                file.truncate(size)
+                with mmap.mmap(file.fileno(), size) as mapped, memoryview(mapped) as view:
+                    for start in range(0, size, chunk_size):
+                        self.recv_into_exactly(connection, view[start:start + chunk_size])
+            else:
+                view = memoryview(bytearray(min(size, chunk_size)))
+                remaining = size
+                while remaining:
+                    count = connection.recv_into(view[:remaining])
+                    if count == 0:
+                        raise ConnectionError("connection closed after {} of {} bytes".format(size - remaining, size))
+                    file.write(view[:count])
+                    remaining -= count
+
+        ack = self.ack.encode()
+        if self.framed:
+            self.send_frame(connection, ack)
+        else:
+            connection.sendall(ack)
+
+        if self.metrics is not None:
+            self.metrics.received(size + FILE_HEADER.size)
+            self.metrics.sent(len(ack))
+        if kwargs.get('peek'):
+            print("{}{} received {} bytes into {}{}".format(settings.GREEN, self.identifier, size, path, settings.NORMAL))
+
+        return Transmission(content=path, sender=address, receiver=self.endpoint)
+
+    def serve_forever(self, handler, workers=4, executor="thread", *args, **kwargs):
+        """
+            Accepts connections until shutdown() is called, and calls handler with each request on a pool of workers,
+            so slow handlers (or decoding) don't hold up the accept loop.
+
+            With executor="thread", each connection is received, ACKed and decoded on a worker thread. With
+            executor="process", the accept loop receives and ACKs each message, and a worker process decodes it and
+            calls handler, which must be picklable (e.g. a module level function).
+
+            At most workers + backlog requests are held at once. Once that many are waiting, the accept loop stops
+            accepting until a worker is free, so excess clients queue in the kernel's listen backlog rather than in memory.
+
+            If the server is multiplexed, each request is answered with handler's return value, or with ack if it
+            returns None. Requests on one connection are handled concurrently, so they may be answered out of order.
+
+            :param handler: Called with each Transmission. Its return value is ignored, unless the server is multiplexed.
+            :type handler: callable
+
+            :param workers: Default 4. The number of worker threads or processes.
+            :type workers: int
+
+            :param executor: Default "thread". "thread" or "process".
+            :type executor: str
+
+            :param backlog: Default workers. The number of requests that may wait for a free worker.
+            :type backlog: int
+
+            :param poll_interval: Default 0.5. Seconds between checks for shutdown() while idle.
+            :type poll_interval: float
+        """
+        import concurrent.futures
+        _BaseServer.listen(self, *args, **kwargs)
+        encoding = kwargs.get('encoding', self.encoding)
+        backlog = kwargs.get('backlog', workers)
+        poll_interval = kwargs.get('poll_interval', 0.5)
+
+        if executor == "thread":
+            pool = concurrent.futures.ThreadPoolExecutor(workers)
+        elif executor == "process":
+            pool = concurrent.futures.ProcessPoolExecutor(workers)
+        else:
+            raise ValueError('executor must be "thread" or "process"')
+
+        slots = threading.BoundedSemaphore(workers + backlog)
+        self._shutdown.clear()
+
+        def done(future, request=None):
+            slots.release()
+            if future.exception() is not None:
+                print("{}{} handler reported {}{}".format(settings.RED, self.identifier, future.exception(), settings.NORMAL))
+                if request is not None:
+                    self._answer(request, None, error=future.exception())
+            elif request is not None:
+                self._answer(request, future.result(), encoding)
+
+        with pool:
+            while not self._shutdown.is_set():
+                connection, address = self._next_connection(poll_interval)
+                if connection is None:
+                    continue
+
+                accepted = time.perf_counter()
+                slots.acquire()  # Backpressure: wait for a free worker or queue slot
+                if executor == "thread":
+                    if self.keep_alive:
+                        self._selector.unregister(connection)  # Stop watching it while a worker reads from it
+                    future = pool.submit(self._serve_connection, connection, address, handler, encoding, accepted)
+                else:
+                    request = self._receive_or_close(connection, address)
+                    if request is None:
+                        slots.release()
+                        continue
+                    future = pool.submit(_handle_in_process, handler, bytes(request.raw), encoding, address, self.endpoint)  # memoryviews can't be pickled
+                    if self.multiplexed:
+                        future.add_done_callback(lambda future, request=request: done(future, request))
+                        continue
+                future.add_done_callback(done)
+
+    def shutdown(self):
+        """
+            Stops serve_forever() at its next poll_interval.
+        """
+        self._shutdown.set()
+
+    def _serve_connection(self, connection, address, handler, encoding, accepted=None):
+        # Runs on a worker thread
+        try:
+            request = self.receive(connection, address, encoding=encoding, accepted=accepted)
+        except OSError as e:
+            request = None
+            self._drop(e)
+
+        if request is not None and self.keep_alive:
+            self._selector.register(connection, selectors.EVENT_READ, address)  # Watch it for the next message
+        else:
+            connection.close()
+
+        if request is not None:
+            try:
+                result = handler(request)
+            except Exception as e:
+                if self.multiplexed:
+                    self._answer(request, None, error=e)
+                raise
+            if self.multiplexed:
+                self._answer(request, result, encoding)
+
+    def _answer(self, request, result, encoding=None, error=None):
+        # Responds to a multiplexed request with its handler's result, or the error it raised, so the client is never
+        # left waiting for a response that isn't coming
+        try:
+            if error is None:
+                try:
+                    return self.respond(request, self.ack if result is None else result, encoding=encoding)
+                except (TypeError, ValueError) as e:  # The result can't be encoded
+                    error = e
+            self.respond_error(request, error)
+        except OSError as e:
+            if self.metrics is not None:
+                self.metrics.count('errors')
+            print("{}{} reported {}{}".format(settings.RED, self.identifier, e, settings.NORMAL))
+
+    def _receive_batch(self, max_packets, timeout, encoding):
+        # Receives one request from each connection with data waiting, after waiting up to timeout for the first
+        batch = []
+        while len(batch) < max_packets:
+            connection, address = self._next_connection(timeout)
+            if connection is None:
+                break
+            request = self._receive_or_close(connection, address, encoding)
+            if request is not None:
+                batch.append(request)
+            timeout = 0  # Only take what's already arrived
+        return batch
+
+    def _receive_or_close(self, connection, address, encoding=None):
+        # Receives one request, undecoded for a worker process by default. Connections that are finished with are
+        # closed.
+        try:
+            request = self.receive(connection, address, encoding=encoding)
+        except OSError as e:
+            request = None
+            self._drop(e)
+
+        if request is None or not self.keep_alive:
+            if self.keep_alive:
+                self._selector.unregister(connection)
+            connection.close()
+        return request
+
+    def _next_connection(self, timeout=None):
+        """
+            Waits up to timeout (by default self.timeout) for a connection with data to read. Kept alive connections
+            are watched alongside the listening socket, otherwise each call accepts a new connection.
+            Returns (None, None) on timeout.
+        """
+        if self._selector is None:
+            self._selector = selectors.DefaultSelector()
+            self._selector.register(self.socket, selectors.EVENT_READ)
+
+        while True:
+            events = self._selector.select(self.timeout if timeout is None else timeout)
+            if not events:
+                return None, None
+
+            for key, mask in events:
+                if key.fileobj is not self.socket:
+                    return key.fileobj, key.data
+
+                connection, address = self.socket.accept()
+                connection.setblocking(True)
+                if self.metrics is not None:
+                    self.metrics.count('connections')
+                if not self.keep_alive:
+                    return connection, address
+                self._selector.register(connection, selectors.EVENT_READ, address)
+
+
+def _connect(address, timeout=None):
+    # Opens a stream connection to a resolved (host, port), or a Unix domain socket path
+    if not isinstance(address, str):
+        return socket.create_connection(address, timeout)
+
+    connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        connection.settimeout(timeout)
+        connection.connect(address)
+    except OSError:
+        connection.close()
+        raise
+    return connection
+
+
+def _handle_in_process(handler, data, encoding, sender, receiver):
+    # Runs in a TCPServer.serve_forever() worker process, so decoding happens off the accepting process
+    return handler(Transmission(raw=data, encoding=encoding, sender=sender, receiver=receiver))
+
+
+class ConnectionPool():
+    """
+        A thread safe pool of open TCP connections, keyed by (host, port), or Unix domain socket path. Used by clients
+        created with keep_alive=True.
+
+        :param max_connections: Default 8. The most connections, in use or idle, the pool holds open to each (host, port).
+        :type max_connections: int
+
+        :param ttl: Default 60. Seconds an idle connection may sit in the pool before it is closed.
+        :type ttl: Union[int, float]
+    """
+    max_connections = 8
+    ttl = 60
+
+    def __init__(self, *args, **kwargs):
+
+        for key, value in kwargs.items():
+            setattr(self, key, value)
+
+        self._lock = threading.Condition()
+        self._idle = collections.defaultdict(collections.deque)  # (host, port): deque of (socket, last used time)
+        self._open = collections.Counter()  # (host, port): number of open connections
+
+    def acquire(self, address, timeout=None):
+        """
+            Returns a healthy connection to address, reusing an idle one if possible. Blocks for up to timeout seconds
+            if max_connections are already in use.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+
+        with self._lock:
+            while True:
+                self._evict(address)
+                idle = self._idle[address]
+
+                while idle:
+                    connection, last_used = idle.pop()  # Most recently used first, so the rest age out
+                    if self._healthy(connection):
+                        connection.settimeout(timeout)
+                        return connection
+                    self._close(address, connection)
+
+                if self._open[address] < self.max_connections:
+                    self._open[address] += 1
+                    break
+
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    raise socket.timeout("no free connection to {}".format(address))
+                self._lock.wait(remaining)
+
+        # Connect outside the lock, so a slow handshake doesn't block other threads
+        try:
+            target = address
+            if isinstance(address, tuple):
+                target = RESOLVER.resolve(address[0], address[1], socket.AF_INET, socket.SOCK_STREAM)
+            return _connect(target, timeout)
+        except OSError:
+            with self._lock:
+                self._open[address] -= 1
+                self._lock.notify()
+            raise
+
+    def release(self, address, connection):
+        """
+            Returns a connection to the pool once a request/response has completed on it.
+        """
+        with self._lock:
+            self._idle[address].append((connection, time.monotonic()))
+            self._lock.notify()
+
+    def discard(self, address, connection):
+        """
+            Closes a connection that failed mid request, rather than returning it to the pool.
+        """
+        with self._lock:
+            self._close(address, connection)
+            self._lock.notify()
+
+    def close(self):
+        """
+            Closes every idle connection.
+        """
+        with self._lock:
+            for address, idle in self._idle.items():
+                while idle:
+                    self._close(address, idle.pop()[0])
+            self._lock.notify_all()
+
+    def _evict(self, address):
+        idle = self._idle[address]
+        expiry = time.monotonic() - self.ttl
+        while idle and idle[0][1] < expiry:
+            self._close(address, idle.popleft()[0])
+
+    def _close(self, address, connection):
+        self._open[address] -= 1
+        connection.close()
+
+    @staticmethod
+    def _healthy(connection):
+        # An idle connection should have nothing to read. EOF means the server closed it, and stray data means the
+        # stream is out of step, so neither can be reused.
+        try:
+            connection.setblocking(False)
+            return not connection.recv(1, socket.MSG_PEEK)
+        except BlockingIOError:
+            return True
+        except OSError:
+            return False
+
+
+# Shared by every client created with keep_alive=True, unless one is given a pool of its own
+DEFAULT_POOL = ConnectionPool()
 
 
 class TCPClient(_BaseClient):
@@ -221,55 +1751,572 @@ class TCPClient(_BaseClient):
 
         :param timeout: Default None. Time to wait, in seconds, for a response from the server. If set to None, the client is set to blocking mode, and will not time out until the server responds, or an error is thrown.
         :type timeout: Union[int, None]
+
+        :param keep_alive: Default False. If True, connections are taken from (and returned to) a ConnectionPool rather than opened for every send. Implies framed, and the server must be created with keep_alive=True.
+        :type keep_alive: bool
+
+        :param pool: Default None. The ConnectionPool used when keep_alive is True. If None, the module wide DEFAULT_POOL is shared.
+        :type pool: Union[None, ConnectionPool]
+
+        :param multiplexed: Default False. If True, every request goes over one long lived connection, tagged with a request id, so many can be outstanding at once (see submit()). The server must be created with multiplexed=True.
+        :type multiplexed: bool
     """
     identifier = "Anonymous TCP Client"
     timeout = None
+    keep_alive = False
+    pool = None
+    multiplexed = False
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
 
+        if self.keep_alive:
+            self.framed = True
+            if self.pool is None:
+                self.pool = DEFAULT_POOL
+
+        if self.multiplexed:
+            self.framed = True
+            self._mux = None  # The multiplexed connection, opened on first use
+            self._mux_lock = threading.Lock()
+            self._pending = {}  # Request id: (future, encoding, time sent)
+            self._request_id = 0
+
 
     def send(self, data, *args, **kwargs):
         """
             :param data: The data to send
+
+            :param compress: Default True. If False, this message is sent uncompressed even if compression is set.
+            :type compress: bool
         """
-        encoding = kwargs.get('encoding', None)
+        if self.multiplexed:
+            return self._wait(self.submit(data, *args, **kwargs))
+
+        encoding = kwargs.get('encoding', self.encoding)
+        metrics = self.metrics
+
+        if self.trace and metrics is not None:
+            start = time.perf_counter()
+            data = self.encode(data, encoding, kwargs.get('compress', True))
+            metrics.observe('encode_time', time.perf_counter() - start)
+        else:
+            data = self.encode(data, encoding, kwargs.get('compress', True))
+        exchange = self._send_pooled if self.keep_alive else self._send_once
+        if self.trace:
+            untraced, exchange = exchange, lambda data: self._exchange_traced(untraced, data)
+
+        if metrics is None:
+            return exchange(data)
+
+        start = time.perf_counter()
+        try:
+            response = exchange(data)
+        except socket.timeout:
+            metrics.count('timeouts')
+            raise
+        except OSError:
+            metrics.count('errors')
+            raise
+
+        metrics.observe('round_trip', time.perf_counter() - start)
+        metrics.sent(len(data))
+        metrics.received(len(response.content))
+        return response
+
+    def _exchange_traced(self, exchange, data):
+        # Stamps the message, sends it with exchange(), and takes the request's times from the traced ack
+        data, sequence, sent_at = self._stamp(data)
+        response = exchange(data)
+        arrived_at = time.monotonic()
+
+        content = response.content
+        if len(content) < TRACE_ACK.size:
+            return response  # The server isn't tracing
+        response.sequence, response.received_at, response.acked_at = TRACE_ACK.unpack_from(content)
+        response.raw = response.content = content[TRACE_ACK.size:]
+        response.sent_at, response.rtt = sent_at, arrived_at - sent_at
+
+        if self.metrics is not None:
+            self.metrics.observe('rtt', response.rtt)
+        return response
+
+    def _send_once(self, data):
+        # Sends data on a new connection, and reads the reply
+        try:
+            self.socket = self.tune(socket.socket(self.family, socket.SOCK_STREAM))
+            self.socket.settimeout(self.timeout)
+            self.socket.connect(self.address())
+
+            if self.framed:
+                self.send_frame(self.socket, data)
+                return self._recv_response()
+
+            self.socket.sendall(data)  # Retries partial sends without copying what's left
+            return self._recv_response()
+
+        except socket.timeout as e:
+            raise socket.timeout('{}{}: {}{}'.format(settings.RED, self.identifier, e, settings.NORMAL))
+
+        finally:
+            self.socket.close()
+
+    def submit(self, data, *args, **kwargs):
+        """
+            Sends a request on the multiplexed connection without waiting for its response. Returns a
+            concurrent.futures.Future that resolves to the response Transmission, decoded with the request's encoding.
+            Responses may arrive in any order.
+
+            :param data: The data to send
+
+            :param compress: Default True. If False, this message is sent uncompressed even if compression is set.
+            :type compress: bool
+        """
+        import concurrent.futures
+        if not self.multiplexed:
+            raise ValueError("{}{} can only submit() when multiplexed{}".format(settings.RED, self.identifier, settings.NORMAL))
+
+        encoding = kwargs.get('encoding', self.encoding)
+        data = self.encode(data, encoding, kwargs.get('compress', True))
+        future = concurrent.futures.Future()
+
+        with self._mux_lock:
+            try:
+                if self._mux is None:
+                    self._mux = self.tune(_connect(self.address(), self.timeout))
+                    self._mux.settimeout(None)  # The reader thread waits as long as requests are outstanding
+                    threading.Thread(target=self._read_responses, args=(self._mux,), daemon=True).start()
+                connection = self._mux
+
+                self._request_id = (self._request_id + 1) % MUX_ERROR  # The top bit flags errors
+                request_id = self._request_id
+                self._pending[request_id] = (future, encoding, time.perf_counter())
+                self.send_frame(connection, data, request_id)  # Under the lock, so frames from several threads don't interleave
+            except OSError as e:
+                error = e
+            else:
+                error = None
 
-        data = self.encode(data, encoding)
-        response = []
+        if error is not None:
+            if self.metrics is not None:
+                self.metrics.count('errors')
+            if self._mux is not None:
+                self._disconnect(self._mux, error)
+            raise socket.error('{}{}: {}{}'.format(settings.RED, self.identifier, error, settings.NORMAL))
 
+        if self.metrics is not None:
+            self.metrics.sent(len(data))
+        return future
+
+    def close(self):
+        """
+            Closes the multiplexed connection. Outstanding requests fail with ConnectionError.
+        """
+        if self.multiplexed and self._mux is not None:
+            self._mux.shutdown(socket.SHUT_RDWR)  # Wakes the reader thread, which fails what's outstanding
+
+    def _wait(self, future):
+        # Waits up to timeout for a submitted request's response
+        import concurrent.futures
         try:
-            self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            self.socket.settimeout(self.timeout)
-            self.socket.connect((self.host, self.port))
-
-            totalsent = 0
-            while totalsent < len(data):
-                packet = data[totalsent:]
-                print('Sending...', packet)
-                sent = self.socket.send(packet)
-                if sent == 0:
-                    raise RuntimeError("socket connection broken")
-                totalsent = totalsent + sent
-            chunks = []
-            bytes_recd = 0
+            return future.result(self.timeout)
+        except concurrent.futures.TimeoutError:
+            with self._mux_lock:
+                for request_id, pending in list(self._pending.items()):
+                    if pending[0] is future:
+                        del self._pending[request_id]  # A late response is dropped
+            if self.metrics is not None:
+                self.metrics.count('timeouts')
+            raise socket.timeout('{}{}: no response within {}s{}'.format(settings.RED, self.identifier, self.timeout, settings.NORMAL))
+
+    def _read_responses(self, connection):
+        # Runs on a daemon thread while the multiplexed connection is open, resolving each response's future
+        receiver = connection.getsockname()
+        try:
+            while True:
+                request_id, data = self.recv_mux_frame(connection)
+                with self._mux_lock:
+                    pending = self._pending.pop(request_id & ~MUX_ERROR, None)
+                if pending is None:
+                    continue  # Its send() timed out
+
+                future, encoding, sent = pending
+                if request_id & MUX_ERROR:
+                    message = bytes(data).decode('utf-8', 'replace')
+                    future.set_exception(RemoteError('{}{}: {}{}'.format(settings.RED, self.identifier, message, settings.NORMAL)))
+                    continue
+                response = Transmission(raw=self.decompress(data), encoding=encoding, sender=self.endpoint, receiver=receiver)
+                if self.metrics is not None:
+                    self.metrics.observe('round_trip', time.perf_counter() - sent)
+                    self.metrics.received(len(data))
+                if not future.done():
+                    future.set_result(response)
+        except (OSError, ValueError) as e:
+            self._disconnect(connection, e)
+
+    def _disconnect(self, connection, error):
+        # Closes a broken multiplexed connection, and fails the requests waiting on it
+        with self._mux_lock:
+            if self._mux is not connection:
+                return
+            self._mux, pending, self._pending = None, self._pending, {}
+        connection.close()
+
+        for future, encoding, sent in pending.values():
+            if not future.done():
+                future.set_exception(ConnectionError('{}{}: {}{}'.format(settings.RED, self.identifier, error, settings.NORMAL)))
+
+    def send_file(self, path, offset=0, count=None):
+        """
+            Sends a file on a new connection, to a server calling listen_file(). The kernel copies the file straight to
+            the socket (where the platform supports sendfile), so it is never held in memory.
+
+            :param path: The file to send
+            :type path: str
+
+            :param offset: Default 0. The byte to start sending from.
+            :type offset: int
+
+            :param count: Default None. The number of bytes to send. If None, send until the end of the file.
+            :type count: Union[None, int]
+
+            :return: The server's ack
+        """
+        start = time.perf_counter()
+        try:
+            with open(path, 'rb') as file:
+                size = os.fstat(file.fileno()).st_size - offset
+                if count is not None:
+                    size = min(size, count)
+
+                self.socket = self.tune(socket.socket(self.family, socket.SOCK_STREAM))
+                self.socket.settimeout(self.timeout)
+                self.socket.connect(self.address())
 
+                self.socket.sendall(FILE_HEADER.pack(size))
+                self.socket.sendfile(file, offset, size)
+                response = self._recv_response()
+
+        except socket.timeout as e:
+            if self.metrics is not None:
+                self.metrics.count('timeouts')
+            raise socket.timeout('{}{}: {}{}'.format(settings.RED, self.identifier, e, settings.NORMAL))
+        except OSError:
+            if self.metrics is not None:
+                self.metrics.count('errors')
+            raise
+        finally:
+            if hasattr(self, 'socket'):
+                self.socket.close()
+
+        if self.metrics is not None:
+            self.metrics.observe('round_trip', time.perf_counter() - start)
+            self.metrics.sent(size + FILE_HEADER.size)
+            self.metrics.received(len(response.content))
+        return response
+
+    def _recv_response(self):
+        # Reads the reply to a message sent on self.socket
+        if self.framed:
+            content = self.recv_frame(self.socket)  # The reply is complete once its length is read, no need to wait for EOF
+        else:
+            chunks = []
             while True:
-                chunk = self.socket.recv(self.buffer_size)
+                chunk = self.socket.recv(self.read_size)
                 if chunk == b'':
                     break
-                    # raise RuntimeError("socket connection broken")
+                self._observe_read(len(chunk))
                 chunks.append(chunk)
-                bytes_recd = bytes_recd + len(chunk)
+            content = b''.join(chunks)
+        return Transmission(content=content, receiver=self.socket.getsockname(), sender=self.endpoint)
 
-            response = Transmission(content=b''.join(chunks), receiver=self.socket.getsockname(), sender=(self.host, self.port))
-            return response
+    def _send_pooled(self, data):
+        # Pooled sockets are never stored on self.socket, so __del__ can't close one another client is using
+        address = self.endpoint
+        connection = self.tune(self.pool.acquire(address, self.timeout))
 
+        try:
+            self.send_frame(connection, data)
+            content = self.recv_frame(connection)
+            response = Transmission(content=content, receiver=connection.getsockname(), sender=address)
         except socket.timeout as e:
+            self.pool.discard(address, connection)
             raise socket.timeout('{}{}: {}{}'.format(settings.RED, self.identifier, e, settings.NORMAL))
+        except OSError:
+            self.pool.discard(address, connection)
+            raise
+
+        self.pool.release(address, connection)
+        return response
+
+
+class AsyncTCPServer(_BaseServer):
+    """
+        An asyncio TCP Server. Every accepted connection is handled in its own task, so a slow client does not stall
+        the others. Received requests are queued and returned by listen(), or passed straight to a handler by serve().
+
+        :param max_connections: Default 1024. The backlog of pending connections passed to the listening socket.
+        :type max_connections: int
+
+        :param ack: Default "". If set, the server will respond to all requests with the ack value (the return value of listen() is unaffected).
+        :type ack: Union[str, int]
+
+        :param identifier: Default 'Anonymous Async TCP Server'. A name for the server for cases where multiple servers are running simultaneously.
+        :type identifier: Union[int, str]
+
+        :param read_timeout: Default 0.01. Unframed messages have no length, so after a read fills the buffer the server keeps reading until no more of the message arrives for this many seconds.
+        :type read_timeout: float
+    """
+    max_connections = 1024
+    ack = ""
+    identifier = "Anonymous Async TCP Server"
+    read_timeout = 0.01
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs) # _BaseServer.super()
+        self.server = None
+        self._handler = None
+        self._encoding = None
+        self._requests = None
 
+    async def start(self, handler=None, encoding=None):
+        """
+            Open the listening socket. Must be awaited from inside a running event loop.
+
+            :param handler: Default None. A function (or coroutine function) called with each Transmission. If None, requests are queued for listen().
+            :type handler: Union[None, callable]
+
+            :param encoding: Default None. The encoding to decode received data with.
+        """
+        import asyncio
+        super().listen()  # _BaseServer.listen() validates the settings
+
+        if self.max_connections < 1:
+            raise ValueError("max_connections must be at least 1")
+
+        self._handler = handler
+        self._encoding = encoding if encoding is not None else self.encoding
+        self._requests = asyncio.Queue()
+
+        try:
+            self.server = await asyncio.start_server(self._handle, self.host, self.port, backlog=self.max_connections)
+        except OSError as e:
+            raise OSError("{}Address {}:{} could not be assigned.{}".format(settings.RED, self.host, self.port, settings.NORMAL))
+
+        for sock in self.server.sockets:
+            self.tune(sock)  # Accepted connections inherit the listening socket's buffer sizes
+
+        if self.peek > 0:
+            print("{}{} opened on {}:{}{}".format(settings.GREEN, self.identifier, self.host, self.port, settings.NORMAL))
+        return self
+
+    async def _handle(self, reader, writer):
+        import asyncio
+        address = writer.get_extra_info('peername')
+        ack = self.ack.encode()
+
+        if self.metrics is not None:
+            self.metrics.count('connections')
+
+        try:
+            while True:
+                if self.framed:
+                    try:
+                        header = await reader.readexactly(FRAME_HEADER.size)
+                    except asyncio.IncompleteReadError as e:
+                        if e.partial:
+                            raise
+                        return  # The client closed a kept alive connection between messages
+                    data = await reader.readexactly(self._frame_size(FRAME_HEADER.unpack(header)[0]))
+                    writer.write(FRAME_HEADER.pack(len(ack)))
+                else:
+                    data = await self._read_available(reader)
+                writer.write(ack) # ACK the clients message
+                await writer.drain()
+
+                if not self.framed:
+                    writer.close()  # Unframed clients read the reply until EOF
+                    await self._dispatch(data, address)
+                    return
+                await self._dispatch(data, address)
+
+        except (OSError, asyncio.IncompleteReadError) as e:
+            if self.metrics is not None:
+                self.metrics.count('errors')
+            print("{}{} reported {}{}".format(settings.RED, self.identifier, e, settings.NORMAL))
         finally:
-            self.socket.close()
+            writer.close()
+
+    async def _read_available(self, reader):
+        # The asyncio counterpart of _recv_available(): if the first read fills the (growing) buffer, keep reading until
+        # nothing more of the message arrives within read_timeout
+        import asyncio
+        size = self.read_size
+        data = await reader.read(size)
+        self._observe_read(len(data))
+        if len(data) < size:
+            return data
+
+        chunks = [data]
+        while True:
+            try:
+                chunk = await asyncio.wait_for(reader.read(self.read_size), self.read_timeout)
+            except asyncio.TimeoutError:
+                break
+            if not chunk:
+                break  # The client closed the connection
+            chunks.append(chunk)
+            self._observe_read(len(chunk))
+        return b''.join(chunks)
+
+    async def _dispatch(self, data, address):
+        import asyncio
+        metrics = self.metrics
+        request = Transmission(raw=self.decompress(data), encoding=self._encoding, sender=address, receiver=(self.host, self.port))
+        if self.capture is not None:
+            self.capture.record(request)
+
+        if metrics is not None:
+            metrics.received(len(data))
+            metrics.sent(len(self.ack))
+            start = time.perf_counter()
+            request.content  # Decode now, to time it
+            metrics.observe('decode_time', time.perf_counter() - start)
+
+        if self.peek:
+            print("{}{} received: {}...{}".format(settings.GREEN, self.identifier, str(request)[:self.peek], settings.NORMAL))
+
+        if self._handler is None:
+            self._requests.put_nowait(request)
+        else:
+            result = self._handler(request)
+            if asyncio.iscoroutine(result):
+                await result
+
+    async def listen(self, *args, **kwargs):
+        """
+            Waits for the next request sent to the server, starting the server first if needed.
+
+            :param encoding: Default None. The encoding to decode received data with.
+        """
+        if self.server is None:
+            await self.start(encoding=kwargs.get('encoding', self.encoding))
+        return await self._requests.get()
+
+    async def stream(self, batch=None, stop=None, *args, **kwargs):
+        """
+            Like _BaseServer.stream(), but an async iterator, starting the server first if needed.
+        """
+        import asyncio
+        max_packets, timeout, encoding = self._stream_settings(batch, stop, *args, **kwargs)
+        if self.server is None:
+            await self.start(encoding=encoding)
+        requests = self._requests
+
+        while stop is None or not stop.is_set():
+            try:
+                batched = [await asyncio.wait_for(requests.get(), timeout)]
+            except asyncio.TimeoutError:
+                continue
+            while len(batched) < max_packets and not requests.empty():
+                batched.append(requests.get_nowait())
+
+            if batch is None:
+                for request in batched:
+                    yield request
+            else:
+                yield batched
+
+    astream = stream
+
+    async def serve(self, handler, *args, **kwargs):
+        """
+            Calls handler with every request until the server is closed.
+
+            :param handler: A function (or coroutine function) called with each Transmission.
+            :type handler: callable
+        """
+        import asyncio
+        await self.start(handler=handler, encoding=kwargs.get('encoding', self.encoding))
+        try:
+            await self.server.serve_forever()
+        except asyncio.CancelledError:
+            pass
+
+    async def close(self):
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+            self.server = None
+
+
+class AsyncTCPClient(_BaseClient):
+    """
+        An asyncio TCP Client. Like TCPClient, each send() opens its own connection, so any number of sends can be
+        awaited concurrently (e.g. with asyncio.gather).
+
+        :param identifier: Default "Anonymous Async TCP Client". A name for the client for cases where multiple clients are running simultaneously.
+        :type identifier: Union[int, str]
+
+        :param timeout: Default None. Time to wait, in seconds, for a response from the server. If set to None, send() waits until the server responds, or an error is thrown.
+        :type timeout: Union[int, None]
+    """
+    identifier = "Anonymous Async TCP Client"
+    timeout = None
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+
+    async def send(self, data, *args, **kwargs):
+        """
+            :param data: The data to send
+
+            :param compress: Default True. If False, this message is sent uncompressed even if compression is set.
+            :type compress: bool
+        """
+        import asyncio
+        encoding = kwargs.get('encoding', self.encoding)
+
+        data = self.encode(data, encoding, kwargs.get('compress', True))
+        metrics = self.metrics
+        start = time.perf_counter()
+        writer = None
+
+        try:
+            reader, writer = await asyncio.wait_for(asyncio.open_connection(*self.address()), self.timeout)
+            self.tune(writer.get_extra_info('socket'))
+            if self.framed:
+                writer.write(FRAME_HEADER.pack(len(data)))
+            writer.write(data)
+            await writer.drain()
+
+            if self.framed:
+                header = await asyncio.wait_for(reader.readexactly(FRAME_HEADER.size), self.timeout)
+                content = await asyncio.wait_for(reader.readexactly(FRAME_HEADER.unpack(header)[0]), self.timeout)
+            else:
+                content = await asyncio.wait_for(reader.read(), self.timeout) # Read until the server closes the connection
+            response = Transmission(content=content, receiver=writer.get_extra_info('sockname'), sender=(self.host, self.port))
+
+            if metrics is not None:
+                metrics.observe('round_trip', time.perf_counter() - start)
+                metrics.sent(len(data))
+                metrics.received(len(content))
+            return response
+
+        except asyncio.TimeoutError as e:
+            if metrics is not None:
+                metrics.count('timeouts')
+            raise socket.timeout('{}{}: timed out{}'.format(settings.RED, self.identifier, settings.NORMAL))
+
+        except (OSError, asyncio.IncompleteReadError):
+            if metrics is not None:
+                metrics.count('errors')
+            raise
+
+        finally:
+            if writer is not None:
+                writer.close()
+
 
 class UDPServer(_BaseServer):
     """
@@ -283,12 +2330,16 @@ class UDPServer(_BaseServer):
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
+        self._selector = None
+        self._buffer = None
 
         try:
             # Instantiate the socket as a UDP server
-            self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            self.socket = self.tune(socket.socket(self.family, socket.SOCK_DGRAM))
             self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-            self.socket.bind((self.host, self.port))
+            if self.reuse_port:
+                self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+            self._bind(self.socket)
             if self.timeout is not None:
                 self.socket.setblocking(False)
 
@@ -303,10 +2354,94 @@ class UDPServer(_BaseServer):
     def listen(self, *args, **kwargs):
         super().listen(*args, **kwargs)
 
-        data, sender = self.socket.recvfrom(self.buffer_size)
-        request = Transmission(content=data, sender=sender, receiver=(self.host, self.port))
+        encoding = kwargs.get('encoding', self.encoding)
+
+        buffer = self._arena(1)
+        nbytes, sender = self.socket.recvfrom_into(buffer)
+        self._observe_read(nbytes)
+        data, trace = bytes(buffer[:nbytes]), None
+        if self.trace:
+            data, trace = self._untrace(data, sender)
+        try:
+            request = Transmission(raw=self.decompress(data), encoding=encoding, sender=sender, receiver=self.endpoint)
+        except ConnectionError:
+            if self.metrics is not None:
+                self.metrics.count('errors')
+            raise
+        if trace is not None:
+            request.sequence, request.sent_at, request.received_at = trace
+        if self.capture is not None:
+            self.capture.record(request)
+
+        if self.metrics is not None:
+            self.metrics.received(len(data))
+            start = time.perf_counter()
+            request.content  # Decode now, to time it
+            self.metrics.observe('decode_time', time.perf_counter() - start)
         return request
 
+    def listen_batch(self, max_packets=64, timeout=None, *args, **kwargs):
+        """
+            Waits up to timeout seconds for a datagram, then receives up to max_packets of the datagrams already queued
+            without blocking again. Datagrams are received into a buffer that is reused between calls, so the content of
+            each Transmission is a memoryview that is only valid until the next call to listen_batch().
+            Call request.copy() to keep it longer. If an encoding is given, each request is decoded when its content is
+            first read.
+
+            :param max_packets: Default 64. The most datagrams to return.
+            :type max_packets: int
+
+            :param timeout: Default None. Seconds to wait for the first datagram. If None, wait until one arrives.
+            :type timeout: Union[None, int, float]
+
+            :return: A list of Transmissions, empty if nothing arrived within timeout.
+        """
+        super().listen(*args, **kwargs)
+
+        if max_packets < 1:
+            raise ValueError("max_packets must be at least 1")
+        return self._receive_batch(max_packets, timeout, kwargs.get('encoding', self.encoding))
+
+    def _receive_batch(self, max_packets, timeout, encoding):
+        buffer = self._arena(max_packets)
+        if self._selector is None:
+            self._selector = selectors.DefaultSelector()
+            self._selector.register(self.socket, selectors.EVENT_READ)
+        if not self._selector.select(timeout):
+            return []
+
+        receiver = self.endpoint
+        recvfrom_into = self.socket.recvfrom_into
+        decompress = self.decompress
+        trace = self.trace
+        batch = []
+        received = largest = 0
+        end = len(buffer) - self._datagram_room
+
+        while received <= end and len(batch) < max_packets:
+            try:
+                nbytes, sender = recvfrom_into(buffer[received:], 0, MSG_DONTWAIT)
+            except BlockingIOError:
+                break  # The queue is drained
+            largest = max(largest, nbytes)
+            try:
+                if trace:
+                    self._receive_traced(batch, buffer[received:received + nbytes], encoding, sender, receiver)
+                else:
+                    batch.append(Transmission(raw=decompress(buffer[received:received + nbytes]), encoding=encoding, sender=sender, receiver=receiver))
+            except ConnectionError as e:
+                self._drop(e)
+                continue  # Received into space the next datagram overwrites
+            received += nbytes
+
+        self._observe_read(largest)  # Make room for more datagrams this size next time
+        if self.capture is not None:
+            self.capture.record_many(batch)
+        if self.metrics is not None:
+            self.metrics.received(received, len(batch))
+        return batch
+
+
 class UDPClient(_BaseClient):
     """
         A UDP Client
@@ -320,30 +2455,540 @@ class UDPClient(_BaseClient):
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
-        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.socket = self.tune(socket.socket(self.family, socket.SOCK_DGRAM))
+        self._connected_to = None
 
     def send(self, data, *args, **kwargs):
         """
             :param data: The data to send
+
+            :param compress: Default True. If False, this message is sent uncompressed even if compression is set.
+            :type compress: bool
         """
 
         super().send(data, *args, **kwargs)
-        self.socket.sendto(data.encode(), (self.host, self.port))
+        if self.trace and self.metrics is not None:
+            start = time.perf_counter()
+            data = self.encode(data, kwargs.get('encoding', self.encoding), kwargs.get('compress', True))
+            self.metrics.observe('encode_time', time.perf_counter() - start)
+        else:
+            data = self.encode(data, kwargs.get('encoding', self.encoding), kwargs.get('compress', True))
+        if self.trace:
+            data = self._stamp(data)[0]
+
+        if self._connected_to is not None:
+            # Some platforms refuse sendto() on a connected socket, so reconnect if host or port has changed since
+            address = self.endpoint
+            if self._connected_to != address:
+                self.socket.connect(self.address(socket.SOCK_DGRAM))
+                self._connected_to = address
+            self.socket.send(data)
+        else:
+            self.socket.sendto(data, self.address(socket.SOCK_DGRAM))
+
+        if self.metrics is not None:
+            self.metrics.sent(len(data))
+
+    def send_many(self, iterable, *args, **kwargs):
+        """
+            Sends each item as its own datagram. The socket is connected to (host, port) first, so the address is
+            resolved once rather than on every datagram. Items that are already bytes-like are sent without copying,
+            unless compression is set.
+
+            :param iterable: The data to send, one datagram per item
+            :return: The number of datagrams sent
+        """
+        encoding = kwargs.get('encoding', self.encoding)
+        compress = kwargs.get('compress', True)
+
+        address = self.endpoint
+        if self._connected_to != address:
+            self.socket.connect(self.address(socket.SOCK_DGRAM))
+            self._connected_to = address
+
+        send = self.socket.send
+        count = nbytes = 0
+        for data in iterable:
+            if isinstance(data, (bytes, bytearray, memoryview)):
+                data = self.compress(data, compress)
+            else:
+                data = self.encode(data, encoding, compress)
+            if self.trace:
+                data = self._stamp(data)[0]
+            nbytes += send(data)
+            count += 1
+
+        if self.metrics is not None:
+            self.metrics.sent(nbytes, count)
+        return count
+
+class ReliableUDPServer(UDPServer):
+    """
+        Receives messages of any size from ReliableUDPClients. Fragments are reassembled per sender and message, and
+        selectively ACKed each time the socket's queue is drained, so a burst of fragments costs one ACK. listen()
+        returns each message once, when it is complete. Fragments are received into their own buffer, so buffer_size
+        does not limit the clients' fragment_size.
+
+        Fragments are only received and ACKed while listen() is running, so a client's send() can only complete while
+        the server is listening. Keep calling listen() (e.g. with a timeout, in a loop) until clients are done, or a
+        client whose last ACK was lost will retransmit to nobody and give up.
+
+        :param identifier: Default "Anonymous Reliable UDP Server". A name for the server for cases where multiple servers are running simultaneously.
+        :type identifier: Union[int, str]
+
+        :param reassembly_timeout: Default 30. Seconds an incomplete message is kept after its last fragment arrived.
+        :type reassembly_timeout: Union[int, float]
+
+        :param max_fragments: Default 65536. The most fragments a message may have. Fragments announcing more are dropped, rather than allocating whatever a peer asks for. Messages whose fragments add up to more than max_frame_size bytes are dropped too.
+        :type max_fragments: int
+    """
+    identifier = "Anonymous Reliable UDP Server"
+    reassembly_timeout = 30
+    max_fragments = 65536
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._partial = {}  # (sender, message id): [fragments, missing, cumulative ack, last arrival, bytes]
+        self._delivered = collections.OrderedDict()  # (sender, message id): fragment count, of recent messages
+        self._ready = collections.deque()
+        self._fragment = memoryview(bytearray(65535))  # The largest UDP datagram
+
+    def listen(self, *args, **kwargs):
+        """
+            Waits for the next complete message. Returns None if self.timeout passes first.
+        """
+        _BaseServer.listen(self, *args, **kwargs)
+        encoding = kwargs.get('encoding', self.encoding)
+
+        if self._selector is None:
+            self._selector = selectors.DefaultSelector()
+            self._selector.register(self.socket, selectors.EVENT_READ)
+
+        deadline = None if self.timeout is None else time.perf_counter() + self.timeout
+        while not self._ready:
+            remaining = None if deadline is None else deadline - time.perf_counter()
+            if remaining is not None and remaining <= 0:
+                if self.metrics is not None:
+                    self.metrics.count('timeouts')
+                return None
+            if self._selector.select(remaining):
+                self._receive_fragments()
+
+        data, sender = self._ready.popleft()
+        try:
+            request = Transmission(raw=self.decompress(data), encoding=encoding, sender=sender, receiver=self.endpoint)
+        except ConnectionError:
+            if self.metrics is not None:
+                self.metrics.count('errors')
+            raise
+        if self.capture is not None:
+            self.capture.record(request)
+
+        if self.metrics is not None:
+            self.metrics.received(len(data))
+            start = time.perf_counter()
+            request.content  # Decode now, to time it
+            self.metrics.observe('decode_time', time.perf_counter() - start)
+        return request
+
+    def _receive_batch(self, max_packets, timeout, encoding):
+        # Returns the messages completed by whatever fragments arrive within timeout
+        if self._selector is None:
+            self._selector = selectors.DefaultSelector()
+            self._selector.register(self.socket, selectors.EVENT_READ)
+        if not self._ready and self._selector.select(timeout):
+            self._receive_fragments()
+
+        batch = []
+        received = 0
+        while self._ready and len(batch) < max_packets:
+            data, sender = self._ready.popleft()
+            try:
+                batch.append(Transmission(raw=self.decompress(data), encoding=encoding, sender=sender, receiver=self.endpoint))
+            except ConnectionError as e:
+                self._drop(e)
+                continue
+            received += len(data)
+
+        if self.capture is not None:
+            self.capture.record_many(batch)
+        if self.metrics is not None and batch:
+            self.metrics.received(received, len(batch))
+        return batch
+
+    def _receive_fragments(self, max_packets=256):
+        # Drains up to max_packets queued fragments, then ACKs every message they belonged to
+        view = self._fragment
+        recvfrom_into = self.socket.recvfrom_into
+        header = RUDP_DATA.size
+        touched = {}
+        now = time.perf_counter()
+
+        for i in range(max_packets):
+            try:
+                nbytes, sender = recvfrom_into(view, 0, MSG_DONTWAIT)
+            except BlockingIOError:
+                break
+            if nbytes < header:
+                continue
+            kind, message_id, index, count = RUDP_DATA.unpack_from(view)
+            if kind != _RUDP_DATA or index >= count:
+                continue
+
+            key = (sender, message_id)
+            if key in self._delivered:
+                touched[key] = self._delivered[key]  # A retransmission, because our ACK was lost
+                continue
+
+            state = self._partial.get(key)
+            if state is None:
+                if count > self.max_fragments:
+                    self._reject(key)
+                    continue
+                state = self._partial[key] = [[None] * count, count, 0, now, 0]
+            fragments = state[0]
+            if len(fragments) != count:
+                continue  # Not the count this message started with
+            touched[key] = count
+            if fragments[index] is None:
+                fragments[index] = bytes(view[header:nbytes])
+                state[1] -= 1
+                state[4] += nbytes - header
+                if state[4] > self.max_frame_size:
+                    self._reject(key)
+                    continue
+            state[3] = now
+
+            if state[1] == 0:
+                del self._partial[key]
+                self._delivered[key] = count
+                if len(self._delivered) > 1024:
+                    self._delivered.popitem(last=False)
+                self._ready.append((b''.join(fragments), sender))
+
+        for key, count in touched.items():
+            if key in self._partial or key in self._delivered:
+                self._acknowledge(key, count)
+
+        for key, state in list(self._partial.items()):
+            if now - state[3] > self.reassembly_timeout:
+                del self._partial[key]  # The client gave up on it
+
+    def _reject(self, key):
+        # Drops a message too large to reassemble. Its client gets no ACKs, so it gives up.
+        self._partial.pop(key, None)
+        if self.metrics is not None:
+            self.metrics.count('errors')
+
+    def _acknowledge(self, key, count):
+        sender, message_id = key
+        state = self._partial.get(key)
+
+        if state is None:
+            cumulative, bitmap = count, 0  # Delivered
+        else:
+            fragments, cumulative = state[0], state[2]
+            while fragments[cumulative] is not None:
+                cumulative += 1
+            state[2] = cumulative
+
+            bitmap = 0
+            for bit, fragment in enumerate(fragments[cumulative + 1:cumulative + 65]):
+                if fragment is not None:
+                    bitmap |= 1 << bit
+
+        self._transmit(RUDP_ACK.pack(_RUDP_ACK, message_id, cumulative, bitmap), sender)
+
+    def _transmit(self, data, address):
+        self.socket.sendto(data, address)
+
+
+class ReliableUDPClient(UDPClient):
+    """
+        Delivers messages of any size to a ReliableUDPServer. Each message is split into numbered fragments, sent with
+        a sliding window, and retransmitted until the server selectively ACKs them: a fragment is resent as soon as an
+        ACK shows a later one arrived without it, or when it times out. The timeout adapts to the measured round trip.
+        send() returns once the whole message is acknowledged.
+
+        :param identifier: Default "Anonymous Reliable UDP Client". A name for the client for cases where multiple clients are running simultaneously.
+        :type identifier: Union[int, str]
+
+        :param fragment_size: Default 1400. Payload bytes per datagram. Keep it under the path MTU, less 41 bytes of headers.
+        :type fragment_size: int
+
+        :param window: Default 64. The most unacknowledged fragments in flight, up to 65.
+        :type window: int
+
+        :param retries: Default 10. Timeouts in a row, without an ACK making progress, before send() raises socket.timeout.
+        :type retries: int
+    """
+    identifier = "Anonymous Reliable UDP Client"
+    fragment_size = 1400
+    window = 64
+    retries = 10
+    min_rto = 0.002
+    max_rto = 1.0
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+
+        if not 0 < self.window <= 65:
+            raise ValueError("window must be between 1 and 65")
+
+        self._message_id = struct.unpack('!I', os.urandom(4))[0]  # So a new client on a reused port isn't mistaken for the old one
+        self._selector = selectors.DefaultSelector()
+        self._selector.register(self.socket, selectors.EVENT_READ)
+        self._srtt = None
+        self._rttvar = 0.0
+        self._rto = 0.1
+
+    def send(self, data, *args, **kwargs):
+        """
+            :param data: The data to send
+
+            :param compress: Default True. If False, this message is sent uncompressed even if compression is set.
+            :type compress: bool
+        """
+        encoding = kwargs.get('encoding', self.encoding)
+        data = memoryview(self.encode(data, encoding, kwargs.get('compress', True)))
+
+        address = self.endpoint
+        if self._connected_to != address:
+            self.socket.connect(self.address(socket.SOCK_DGRAM))  # Only the server's ACKs are received
+            self._connected_to = address
+
+        self._message_id = (self._message_id + 1) & 0xFFFFFFFF
+        start = time.perf_counter()
+        try:
+            self._deliver(self._message_id, data)
+        except socket.timeout as e:
+            if self.metrics is not None:
+                self.metrics.count('timeouts')
+            raise socket.timeout('{}{}: {}{}'.format(settings.RED, self.identifier, e, settings.NORMAL))
+
+        if self.metrics is not None:
+            self.metrics.observe('round_trip', time.perf_counter() - start)
+            self.metrics.sent(len(data))
+
+    def send_many(self, iterable, *args, **kwargs):
+        """
+            Sends each item as its own reliable message.
+
+            :return: The number of messages sent
+        """
+        count = 0
+        for data in iterable:
+            self.send(data, *args, **kwargs)
+            count += 1
+        return count
+
+    def _deliver(self, message_id, data):
+        size = self.fragment_size
+        count = max(1, -(-len(data) // size))
+        acked = bytearray(count)
+        retransmitted = bytearray(count)
+        sent_at = [0.0] * count  # When each fragment was last sent
+        base = following = 0  # The oldest unacknowledged fragment, and the next never sent
+        strikes = 0  # Timeouts in a row without progress
+        ack = bytearray(RUDP_ACK.size)
+
+        def transmit(index):
+            self._transmit(RUDP_DATA.pack(_RUDP_DATA, message_id, index, count), data[index * size:(index + 1) * size])
+            sent_at[index] = time.perf_counter()
+
+        while base < count:
+            while following < count and following < base + self.window:
+                transmit(following)
+                following += 1
+
+            # Wait for ACKs until the oldest outstanding fragment is due to be resent
+            oldest = min(sent_at[i] for i in range(base, following) if not acked[i])
+            wait = oldest + self._rto - time.perf_counter()
+            if wait > 0 and self._selector.select(wait):
+                while True:
+                    try:
+                        nbytes = self.socket.recv_into(ack, 0, MSG_DONTWAIT)
+                    except BlockingIOError:
+                        break
+                    if nbytes != RUDP_ACK.size:
+                        continue
+                    kind, acked_id, cumulative, bitmap = RUDP_ACK.unpack(ack)
+                    if kind != _RUDP_ACK or acked_id != message_id:
+                        continue  # A late ACK for an earlier message
+
+                    now = time.perf_counter()
+                    newest = -1
+                    for i in range(base, min(cumulative, following)):
+                        if not acked[i]:
+                            acked[i] = 1
+                            newest = i
+                            if not retransmitted[i]:
+                                self._sample(now - sent_at[i])  # Karn's rule: retransmissions give ambiguous samples
+                    while bitmap:
+                        i = cumulative + 1 + (bitmap & -bitmap).bit_length() - 1
+                        bitmap &= bitmap - 1
+                        if i < following and not acked[i]:
+                            acked[i] = 1
+                            newest = max(newest, i)
+                            if not retransmitted[i]:
+                                self._sample(now - sent_at[i])
+                    if newest < 0:
+                        continue
+                    strikes = 0
+
+                    # Fragments are delivered in order on a quiet path, so any sent before one that arrived were lost
+                    for i in range(base, newest):
+                        if not acked[i] and not retransmitted[i]:
+                            retransmitted[i] = 1
+                            transmit(i)
+                            if self.metrics is not None:
+                                self.metrics.count('retransmits')
+                    while base < count and acked[base]:
+                        base += 1
+                continue
+
+            strikes += 1
+            if strikes > self.retries:
+                raise socket.timeout("message {} was not acknowledged after {} retries".format(message_id, self.retries))
+
+            now = time.perf_counter()
+            for i in range(base, following):
+                if not acked[i] and now - sent_at[i] >= self._rto:
+                    retransmitted[i] = 1
+                    transmit(i)
+                    if self.metrics is not None:
+                        self.metrics.count('retransmits')
+            self._rto = min(self._rto * 2, self.max_rto)  # Back off
+
+    def _sample(self, rtt):
+        # Updates the retransmission timeout from a round trip time, as TCP does (RFC 6298)
+        if self._srtt is None:
+            self._srtt, self._rttvar = rtt, rtt / 2
+        else:
+            self._rttvar = 0.75 * self._rttvar + 0.25 * abs(self._srtt - rtt)
+            self._srtt = 0.875 * self._srtt + 0.125 * rtt
+        self._rto = min(max(self._srtt + 4 * self._rttvar, self.min_rto), self.max_rto)
+
+    def _transmit(self, header, payload):
+        self.socket.sendmsg([header, payload])  # Without concatenating (copying) them
+
+
+class _UnixSocket():
+    """
+        Makes a connection class talk over a Unix domain socket at path, rather than an IP (host, port). Peers on the
+        same host skip the loopback IP stack (checksums, routing, TCP congestion control) entirely.
+    """
+    family = getattr(socket, 'AF_UNIX', None)
+    path = None
+
+    @property
+    def endpoint(self):
+        if self.path is None:
+            raise ValueError("{}{} needs a path{}".format(settings.RED, self.identifier, settings.NORMAL))
+        return self.path
+
+    def address(self, type=socket.SOCK_STREAM):
+        return self.endpoint
+
+    def _bind(self, sock):
+        # A socket file left behind by a server that wasn't closed cleanly would make bind() fail, so replace it, but
+        # only once nothing answers on it: a live server keeps its path, as a TCPServer keeps its port
+        path = self.endpoint
+        try:
+            if stat.S_ISSOCK(os.stat(path).st_mode):
+                probe = socket.socket(socket.AF_UNIX, sock.type)
+                try:
+                    probe.connect(path)
+                except ConnectionRefusedError:
+                    os.unlink(path)
+                else:
+                    raise OSError(errno.EADDRINUSE, "{} is in use".format(path))
+                finally:
+                    probe.close()
+        except FileNotFoundError:
+            pass
+        sock.bind(path)
+
+
+class UnixStreamServer(_UnixSocket, TCPServer):
+    """
+        A drop in replacement for TCPServer, for clients on the same host, listening on a Unix domain socket.
+        Transmissions' receiver is the path, and their sender is usually "" (clients don't bind a path).
+
+        :param path: The filesystem path of the socket. A stale socket file there is replaced, but a path another server is bound to raises OSError.
+        :type path: str
+    """
+    identifier = "Anonymous Unix Stream Server"
+
+
+class UnixStreamClient(_UnixSocket, TCPClient):
+    """
+        A drop in replacement for TCPClient, that sends to a UnixStreamServer. keep_alive, framed and multiplexed work
+        as they do over TCP.
+
+        :param path: The filesystem path of the server's socket.
+        :type path: str
+    """
+    identifier = "Anonymous Unix Stream Client"
+
+
+class UnixDatagramServer(_UnixSocket, UDPServer):
+    """
+        A drop in replacement for UDPServer, for clients on the same host, bound to a Unix domain socket. Unlike UDP,
+        datagrams are never lost: a client blocks while the server's queue is full. They can be larger than UDP's
+        too, up to the sender's SO_SNDBUF (usually about 208 KiB).
+
+        :param path: The filesystem path of the socket. A stale socket file there is replaced, but a path another server is bound to raises OSError.
+        :type path: str
+
+        :param max_buffer_size: Default 262144. Datagrams larger than this are truncated.
+        :type max_buffer_size: int
+    """
+    identifier = "Anonymous Unix Datagram Server"
+    max_buffer_size = 262144
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        if self.socket.fileno() == -1:  # UDPServer closes the socket if it can't bind, rather than raising
+            raise OSError("{}Address {} could not be assigned.{}".format(settings.RED, self.path, settings.NORMAL))
+
+
+class UnixDatagramClient(_UnixSocket, UDPClient):
+    """
+        A drop in replacement for UDPClient, that sends to a UnixDatagramServer.
+
+        :param path: The filesystem path of the server's socket.
+        :type path: str
+    """
+    identifier = "Anonymous Unix Datagram Client"
+
 
 class MulticastServer(_BaseServer):
     """
-        A Multicast Client
+        A Multicast Server. One socket receives from any number of groups, which can be joined and left while it runs.
+        All groups must be the same IP version as host. Each Transmission's receiver is the (group, port) it was sent to.
 
-        :param identifier: Default "Anonymous Multicast Client". A name for the server for cases where multiple servers are running simultaneously.
+        :param identifier: Default "Anonymous Multicast Server". A name for the server for cases where multiple servers are running simultaneously.
         :type identifier: Union[int, str]
 
+        :param groups: Default None. Groups to join as well as host.
+        :type groups: Union[None, list]
+
+        :param interface: Default None. The interface to join groups on: an IPv4 address, or an IPv6 interface index. If None, the kernel chooses.
+        :type interface: Union[None, str, int]
+
     """
 
-    identifier = "Anonymous Multicast Client"
+    identifier = "Anonymous Multicast Server"
     host = "224.0.0.0"
+    groups = None
+    interface = None
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
+        self._joined = {}  # Group address: membership request
+        self._selector = None
+        self._buffer = None
 
         # Check if host was a valid multicast address
         # if not self.host_in_range(self.host, "224.0.0.0/4"):
@@ -351,58 +2996,185 @@ class MulticastServer(_BaseServer):
 
         try:
             # Look up multicast group address in name server and find out IP version
-            addrinfo = socket.getaddrinfo(self.host, None)[0]
+            self.family = RESOLVER.getaddrinfo(self.host, None, 0, socket.SOCK_DGRAM)[0][0]
 
             # Create a socket
-            self.socket = socket.socket(addrinfo[0], socket.SOCK_DGRAM)
+            self.socket = self.tune(socket.socket(self.family, socket.SOCK_DGRAM))
 
             if self.timeout is not None:
                 self.socket.setblocking(False)
             # Allow multiple copies of this program on one machine
             # (not strictly needed)
             self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            if self.reuse_port:
+                self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+
+            # Bind to every address on the port, and ask for each datagram's destination, so one socket can tell
+            # apart all the groups it joins
+            if self.family == socket.AF_INET:  # IPv4
+                if IP_MULTICAST_ALL is not None:
+                    self.socket.setsockopt(socket.IPPROTO_IP, IP_MULTICAST_ALL, 0)  # Only groups this socket joined
+                if IP_PKTINFO is not None:
+                    self.socket.setsockopt(socket.IPPROTO_IP, IP_PKTINFO, 1)
+                self.socket.bind(('', self.port))
+                self._ancillary_size = socket.CMSG_SPACE(12)  # struct in_pktinfo
+            else:  # IPV6
+                self.socket.setsockopt(socket.IPPROTO_IPV6, socket.IPV6_RECVPKTINFO, 1)
+                self.socket.bind(('::', self.port))
+                self._ancillary_size = socket.CMSG_SPACE(20)  # struct in6_pktinfo
 
-            # Bind it to the port
-            self.socket.bind((self.host, self.port))
-
-            group_bin = socket.inet_pton(addrinfo[0], addrinfo[4][0])
-            # Join MultiCast group
-            if addrinfo[0] == socket.AF_INET:  # IPv4
-                mreq = group_bin + struct.pack('=I', socket.INADDR_ANY)
-                self.socket.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP, mreq)
+            # Join MultiCast groups
+            for group in [self.host] + list(self.groups or []):
+                self.join(group)
 
-            else:  # IPV6
-                mreq = group_bin + struct.pack('@I', 0)
-                self.socket.setsockopt(socket.IPPROTO_IPV6, socket.IPV6_JOIN_GROUP, mreq)
             if self.peek > 0:
                 print("{}{} opened on {}:{}{}".format(settings.GREEN, self.identifier, self.host, self.port, settings.NORMAL))
 
         except OSError as e:
             raise OSError("{}{} {}{}".format(settings.RED, self.identifier, e, settings.NORMAL))
 
+    def join(self, group, interface=None):
+        """
+            Starts receiving datagrams sent to group.
 
-    def listen(self, *args, **kwargs):
-        super().listen(*args, **kwargs)
+            :param interface: Default None. Overrides the server's interface for this group.
+        """
+        group = RESOLVER.resolve(group, None, self.family, socket.SOCK_DGRAM)[0]
+        mreq = self._membership(group, self.interface if interface is None else interface)
 
-        encoding = kwargs.get('encoding', None)
+        if self.family == socket.AF_INET:  # IPv4
+            self.socket.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP, mreq)
+        else:  # IPV6
+            self.socket.setsockopt(socket.IPPROTO_IPV6, socket.IPV6_JOIN_GROUP, mreq)
+        self._joined[group] = mreq
 
-        try:
-            data, sender = self.socket.recvfrom(self.buffer_size)
+    def leave(self, group):
+        """
+            Stops receiving datagrams sent to group.
+        """
+        group = RESOLVER.resolve(group, None, self.family, socket.SOCK_DGRAM)[0]
+        mreq = self._joined.pop(group)
+
+        if self.family == socket.AF_INET:  # IPv4
+            self.socket.setsockopt(socket.IPPROTO_IP, socket.IP_DROP_MEMBERSHIP, mreq)
+        else:  # IPV6
+            self.socket.setsockopt(socket.IPPROTO_IPV6, socket.IPV6_LEAVE_GROUP, mreq)
+
+    @property
+    def joined(self):
+        return list(self._joined)
+
+    def _membership(self, group, interface):
+        group_bin = socket.inet_pton(self.family, group)
+        if self.family == socket.AF_INET:  # IPv4
+            return group_bin + (socket.inet_aton(interface) if interface else struct.pack('=I', socket.INADDR_ANY))
+        return group_bin + struct.pack('@I', interface or 0)
+
+    def _receive_into(self, view, flags=0):
+        # Receives one datagram into view. Returns its size, sender, and the group it was sent to (None if the
+        # platform can't tell).
+        nbytes, ancdata, msg_flags, sender = self.socket.recvmsg_into([view], self._ancillary_size, flags)
+
+        group = None
+        for level, kind, data in ancdata:
+            if level == socket.IPPROTO_IP and kind == IP_PKTINFO:
+                group = socket.inet_ntop(socket.AF_INET, data[8:12])  # in_pktinfo.ipi_addr, the destination
+            elif level == socket.IPPROTO_IPV6 and kind == socket.IPV6_PKTINFO:
+                group = socket.inet_ntop(socket.AF_INET6, data[:16])  # in6_pktinfo.ipi6_addr
+        return nbytes, sender, group
 
-            while data[-1:] == '\0':
-                data = data[:-1]  # Strip trailing \0's
+    def listen(self, *args, **kwargs):
+        super().listen(*args, **kwargs)
 
-            if encoding:
-                data = self.decode(data, encoding)
+        encoding = kwargs.get('encoding', self.encoding)
+        view = self._arena(1)
 
-            request = Transmission(content=data, sender=sender, receiver=(self.host, self.port))
+        try:
+            while True:
+                nbytes, sender, group = self._receive_into(view)
+                if group is None or group in self._joined:
+                    break  # Otherwise it's a unicast datagram to our port, rather than one of our groups
+
+            self._observe_read(nbytes)
+            data, trace = bytes(view[:nbytes]), None
+            if self.trace:
+                data, trace = self._untrace(data, sender)
+            try:
+                request = Transmission(raw=self.decompress(data), encoding=encoding, sender=sender, receiver=(group or self.host, self.port))
+            except ConnectionError:
+                if self.metrics is not None:
+                    self.metrics.count('errors')
+                raise  # Not a socket error, so the socket stays open
+            if trace is not None:
+                request.sequence, request.sent_at, request.received_at = trace
+            if self.capture is not None:
+                self.capture.record(request)
+
+            if self.metrics is not None:
+                self.metrics.received(len(data))
+                start = time.perf_counter()
+                request.content  # Decode now, to time it
+                self.metrics.observe('decode_time', time.perf_counter() - start)
             return request
 
         except socket.error as e:
+            if self.metrics is not None:
+                self.metrics.count('errors')
             if self.socket:
                 self.socket.close()
             raise socket.error('{}{}: {}{}'.format(settings.RED, self.identifier, e, settings.NORMAL))
 
+    def listen_batch(self, max_packets=64, timeout=None, *args, **kwargs):
+        """
+            Like UDPServer.listen_batch(): waits up to timeout seconds for a datagram, then receives up to max_packets
+            of the datagrams already queued, into a buffer that is reused between calls. The content of each
+            Transmission is only valid until the next call; call request.copy() to keep it longer.
+
+            :return: A list of Transmissions, empty if nothing arrived within timeout.
+        """
+        super().listen(*args, **kwargs)
+
+        if max_packets < 1:
+            raise ValueError("max_packets must be at least 1")
+        return self._receive_batch(max_packets, timeout, kwargs.get('encoding', self.encoding))
+
+    def _receive_batch(self, max_packets, timeout, encoding):
+        buffer = self._arena(max_packets)
+        if self._selector is None:
+            self._selector = selectors.DefaultSelector()
+            self._selector.register(self.socket, selectors.EVENT_READ)
+        if not self._selector.select(timeout):
+            return []
+
+        batch = []
+        received = largest = 0
+        end = len(buffer) - self._datagram_room
+        while received <= end and len(batch) < max_packets:
+            try:
+                nbytes, sender, group = self._receive_into(buffer[received:], MSG_DONTWAIT)
+            except BlockingIOError:
+                break  # The queue is drained
+            largest = max(largest, nbytes)
+            if group is not None and group not in self._joined:
+                continue  # Received into space the next datagram overwrites
+            try:
+                if self.trace:
+                    self._receive_traced(batch, buffer[received:received + nbytes], encoding, sender, (group or self.host, self.port))
+                else:
+                    batch.append(Transmission(raw=self.decompress(buffer[received:received + nbytes]), encoding=encoding, sender=sender, receiver=(group or self.host, self.port)))
+            except ConnectionError as e:
+                self._drop(e)
+                continue
+            received += nbytes
+
+        self._observe_read(largest)
+
+        if self.capture is not None:
+            self.capture.record_many(batch)
+        if self.metrics is not None:
+            self.metrics.received(received, len(batch))
+        return batch
+
     # def host_in_range(self, ip_address, mask):
     #
     #     ip_range = ip_network(mask)
@@ -411,42 +3183,571 @@ class MulticastServer(_BaseServer):
     class InvalidAddressException(BaseException):
         pass
 
+
 class MulticastClient(_BaseClient):
+    """
+        A Multicast Client
+
+        send() sets up a new socket for every message. For high rates, publish() and publish_many() instead configure
+        one socket the first time they're called, and reuse it until close().
+
+        :param loop: Default False. If True, packets are also delivered to multicast servers on this host.
+        :type loop: bool
+
+        :param ttl: Default None. The multicast time-to-live (IPv4) or hop limit (IPv6). If None, timeout is used, or 0 if that isn't set either.
+        :type ttl: Union[None, int]
+
+        :param rate: Default None. The most messages per second publish() and publish_many() send. If None, they aren't paced.
+        :type rate: Union[None, int, float]
+
+        :param burst: Default 1. How many messages may be sent back to back when pacing, after the publisher has been idle.
+        :type burst: int
+    """
+    identifier = "Anonymous Multicast Client"
+    loop = False
+    ttl = None
+    rate = None
+    burst = 1
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
+        self._publisher = None
+        self._tokens = 0.0
+        self._refilled = 0.0
 
     """
         :param data: The data to send
+
+        :param compress: Default True. If False, this message is sent uncompressed even if compression is set.
+        :type compress: bool
     """
-    def send(self, data):
+    def send(self, data, *args, **kwargs):
+        encoding = kwargs.get('encoding', self.encoding)
+        data = self.encode(data, encoding, kwargs.get('compress', True))
+        if self.trace:
+            data = self._stamp(data)[0]
+        sock = None
 
         try:
-            addrinfo = socket.getaddrinfo(self.host, None)[0]
-            self.socket = socket.socket(addrinfo[0], socket.SOCK_DGRAM)
+            sock, group = self._open()
+            sock.sendto(data, group)
+            if self.metrics is not None:
+                self.metrics.sent(len(data))
 
-            # Set Time-to-live (optional)
-            if self.timeout:
-                ttl_bin = struct.pack('@i', self.timeout)
-            else:
-                ttl_bin = struct.pack('@i', 0)  # self.timout is None if not set. TODO: This is unintuitive behaviour
+        except socket.error as e:
+            if self.metrics is not None:
+                self.metrics.count('errors')
+            raise socket.error('{}{}: {}{}'.format(settings.RED, self.identifier, e, settings.NORMAL))
+        finally:
+            if sock is not None:
+                sock.close()
 
-            if addrinfo[0] == socket.AF_INET:  # IPv4
-                self.socket.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, ttl_bin)
-                sock_type = socket.IPPROTO_IP
-            else: # IPv6
-                socket.setsockopt(socket.IPPROTO_IPV6, socket.IPV6_MULTICAST_HOPS, ttl_bin)
-                sock_type = socket.IPPROTO_IPV6
+    def publish(self, data, *args, **kwargs):
+        """
+            Sends data on the publisher's long lived socket, paced to rate.
+
+            :param data: The data to send
 
-            # Ignore packets sent from self TODO: make this an option
-            self.socket.setsockopt(sock_type, socket.IP_MULTICAST_LOOP, 0)
-            self.socket.sendto(pickle.dumps(data), (addrinfo[4][0], self.port))
+            :param compress: Default True. If False, this message is sent uncompressed even if compression is set.
+            :type compress: bool
+        """
+        return self.publish_many((data,), *args, **kwargs)
+
+    def publish_many(self, iterable, *args, **kwargs):
+        """
+            Sends each item as its own datagram on the publisher's long lived socket, paced to rate. Items that are
+            already bytes-like are sent without copying, unless compression is set.
 
+            :param iterable: The data to send, one datagram per item
+            :return: The number of datagrams sent
+        """
+        encoding = kwargs.get('encoding', self.encoding)
+        compress = kwargs.get('compress', True)
+
+        if self._publisher is None:
+            self._publisher, group = self._open()
+            self._publisher.connect(group)  # The group is resolved and checked once, not per datagram
+            self._tokens = self.burst
+            self._refilled = time.perf_counter()
+
+        send = self._publisher.send
+        count = nbytes = 0
+        try:
+            for data in iterable:
+                if isinstance(data, (bytes, bytearray, memoryview)):
+                    data = self.compress(data, compress)
+                else:
+                    data = self.encode(data, encoding, compress)
+                if self.rate:
+                    self._pace()
+                if self.trace:
+                    data = self._stamp(data)[0]  # After pacing, so the send time is when it's sent
+                nbytes += send(data)
+                count += 1
         except socket.error as e:
+            if self.metrics is not None:
+                self.metrics.count('errors')
             raise socket.error('{}{}: {}{}'.format(settings.RED, self.identifier, e, settings.NORMAL))
         finally:
-            if self.socket:
-                self.socket.close()
+            if self.metrics is not None:
+                self.metrics.sent(nbytes, count)
+        return count
+
+    def close(self):
+        if getattr(self, '_publisher', None) is not None:
+            self._publisher.close()
+            self._publisher = None
+
+    def __del__(self):
+        self.close()
+        super().__del__()
+
+    def _pace(self):
+        # A token bucket: tokens refill at rate per second, up to burst, and each datagram spends one
+        now = time.perf_counter()
+        self._tokens = min(self.burst, self._tokens + (now - self._refilled) * self.rate)
+        self._refilled = now
+
+        if self._tokens < 1:
+            time.sleep((1 - self._tokens) / self.rate)
+            self._refilled = time.perf_counter()
+            self._tokens = 0.0
+        else:
+            self._tokens -= 1
+
+    def _open(self):
+        # Returns a new socket configured for the group, and the group's address
+        addrinfo = RESOLVER.getaddrinfo(self.host, self.port, 0, socket.SOCK_DGRAM)[0]
+        sock = self.tune(socket.socket(addrinfo[0], socket.SOCK_DGRAM))
+
+        try:
+            # Set Time-to-live (optional)
+            ttl = self.ttl if self.ttl is not None else (self.timeout or 0)
+
+            if addrinfo[0] == socket.AF_INET:  # IPv4
+                sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, ttl)
+                sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_LOOP, int(self.loop))  # Ignore packets sent from self, unless loop is set
+            else: # IPv6
+                sock.setsockopt(socket.IPPROTO_IPV6, socket.IPV6_MULTICAST_HOPS, ttl)
+                sock.setsockopt(socket.IPPROTO_IPV6, socket.IPV6_MULTICAST_LOOP, int(self.loop))
+        except OSError:
+            sock.close()
+            raise
+
+        return sock, addrinfo[4]
+
+class Reactor():
+    """
+        Drives any number of servers from one thread. Each registered server's socket is watched by a single selector,
+        and its callback is called with every Transmission the server receives.
+
+        :param timeout: Default None. Seconds run() waits for events before checking whether it has been stopped. If None, run() waits until an event arrives.
+        :type timeout: Union[None, int, float]
+    """
+    timeout = None
+
+    def __init__(self, *args, **kwargs):
+
+        for key, value in kwargs.items():
+            setattr(self, key, value)
+
+        self._selector = selectors.DefaultSelector()
+        self._running = False
+
+    def register(self, server, callback, *args, **kwargs):
+        """
+            :param server: A TCPServer, UDPServer or MulticastServer
+            :param callback: Called with each Transmission the server receives
+            :type callback: callable
+
+            Any keyword arguments (e.g. encoding) are passed to the server when it receives a message.
+        """
+        _BaseServer.listen(server)  # Validate the server's settings once, up front
+        self._selector.register(server.socket, selectors.EVENT_READ, (server, callback, kwargs, None))
+
+    def unregister(self, server):
+        """
+            Stops watching a server, and closes any connections it has open.
+        """
+        for key in list(self._selector.get_map().values()):
+            if key.data[0] is server:
+                self._selector.unregister(key.fileobj)
+                if key.fileobj is not server.socket:
+                    key.fileobj.close()
+
+    def run_once(self, timeout=None):
+        """
+            Waits up to timeout seconds for sockets to become readable, and dispatches their messages.
+            Returns the number of events handled.
+        """
+        events = self._selector.select(timeout)
+
+        for key, mask in events:
+            server, callback, kwargs, address = key.data
+
+            if not isinstance(server, TCPServer):
+                try:
+                    request = server.listen(**kwargs)
+                except ConnectionError as e:  # A corrupt message. The server carries on with the next.
+                    print("{}{} reported {}{}".format(settings.RED, server.identifier, e, settings.NORMAL))
+                    continue
+                callback(request)
+
+            elif address is None:
+                # The listening socket is readable, so accept() won't block
+                connection, address = server.socket.accept()
+                connection.setblocking(True)
+                self._selector.register(connection, selectors.EVENT_READ, (server, callback, kwargs, address))
+
+            else:
+                self._receive(key.fileobj, server, callback, kwargs, address)
+
+        return len(events)
+
+    def _receive(self, connection, server, callback, kwargs, address):
+        try:
+            request = server.receive(connection, address, **kwargs)
+        except OSError as e:
+            server._drop(e)
+            request = None
+
+        if request is None or not server.keep_alive:
+            self._selector.unregister(connection)
+            connection.close()
+
+        if request is not None:
+            callback(request)
+
+    def run(self):
+        """
+            Dispatches events until stop() is called.
+        """
+        self._running = True
+        while self._running:
+            self.run_once(self.timeout)
+
+    def stop(self):
+        self._running = False
+
+    def close(self):
+        for server in {key.data[0] for key in self._selector.get_map().values()}:
+            self.unregister(server)
+        self._selector.close()
+
+
+class ShardedServer():
+    """
+        Runs one server per worker process, all bound to the same (host, port) with SO_REUSEPORT, so the kernel spreads
+        connections (TCP) or datagrams (UDP) across them and receiving isn't limited to one core. Workers that exit are
+        restarted by check() (or run()).
+
+        :param server_class: Default UDPServer. UDPServer or TCPServer.
+        :type server_class: type
+
+        :param handler: Called in the worker process with each Transmission. Must be picklable if the platform spawns rather than forks processes. UDP content is a memoryview that is only valid until the handler returns, unless an encoding is set.
+        :type handler: callable
+
+        :param workers: Default os.cpu_count(). The number of worker processes.
+        :type workers: int
+
+        :param server_kwargs: Default {}. Keyword arguments for each worker's server (host, port, encoding etc.).
+        :type server_kwargs: dict
+
+        :param poll_interval: Default 0.5. Seconds between a worker's checks for stop(), and between run()'s checks for dead workers.
+        :type poll_interval: float
+    """
+    server_class = None
+    handler = None
+    workers = None
+    server_kwargs = None
+    poll_interval = 0.5
+
+    def __init__(self, *args, **kwargs):
+        import multiprocessing
+
+        for key, value in kwargs.items():
+            setattr(self, key, value)
+
+        if self.server_class is None:
+            self.server_class = UDPServer
+        if self.workers is None:
+            self.workers = os.cpu_count() or 1
+        if self.server_kwargs is None:
+            self.server_kwargs = {}
+
+        self._stop = multiprocessing.Event()
+        self._counters = multiprocessing.Array('Q', self.workers * 2, lock=False)  # messages, bytes for each worker
+        self._processes = [None] * self.workers
+        self._restarts = [0] * self.workers
+
+    def start(self):
+        self._stop.clear()
+        for index in range(self.workers):
+            self._spawn(index)
+        return self
+
+    def check(self):
+        """
+            Restarts any worker that has exited. Returns the number restarted.
+        """
+        restarted = 0
+        for index, process in enumerate(self._processes):
+            if process is not None and not process.is_alive() and not self._stop.is_set():
+                process.join()
+                self._restarts[index] += 1
+                self._spawn(index)
+                restarted += 1
+        return restarted
+
+    def run(self):
+        """
+            Starts the workers, and restarts any that exit, until stop() is called (e.g. from a signal handler).
+        """
+        self.start()
+        while not self._stop.wait(self.poll_interval):
+            self.check()
+
+    def stop(self, timeout=None):
+        self._stop.set()
+        for process in self._processes:
+            if process is not None:
+                process.join(timeout)
+                if process.is_alive():
+                    process.terminate()
+
+    def stats(self):
+        """
+            Returns per worker and total message and byte counts.
+        """
+        workers = []
+        for index, process in enumerate(self._processes):
+            workers.append({
+                'pid': process.pid if process else None,
+                'alive': bool(process and process.is_alive()),
+                'messages': self._counters[index * 2],
+                'bytes': self._counters[index * 2 + 1],
+                'restarts': self._restarts[index],
+            })
+        return {
+            'workers': workers,
+            'messages': sum(worker['messages'] for worker in workers),
+            'bytes': sum(worker['bytes'] for worker in workers),
+        }
+
+    def _spawn(self, index):
+        import multiprocessing
+        process = multiprocessing.Process(
+            target=_run_shard,
+            args=(index, self.server_class, self.server_kwargs, self.handler, self._counters, self._stop, self.poll_interval),
+            daemon=True,
+        )
+        process.start()
+        self._processes[index] = process
+
+
+def _run_shard(index, server_class, server_kwargs, handler, counters, stop, poll_interval):
+    # Runs in a ShardedServer worker process
+    kwargs = dict(server_kwargs, reuse_port=True, poll_interval=poll_interval)
+    encoding = kwargs.pop('encoding', None)
+    server = server_class(**kwargs)
+
+    for requests in server.stream(batch=64, stop=stop, encoding=None):
+        for request in requests:
+            counters[index * 2] += 1
+            counters[index * 2 + 1] += len(request.raw)
+            if encoding:
+                request.content = server.decode(request.raw, encoding)
+            if handler is not None:
+                handler(request)
+
+
+class Capture():
+    """
+        Records Transmissions to an append-only binary log, to read with CaptureReader and replay(). record() only
+        copies the content and queues it, so receiving isn't slowed by disk writes: a background thread writes the
+        queue out. Capturing to an existing log appends to it.
+
+        :param path: The log's filesystem path.
+        :type path: str
+
+        :param flush_interval: Default 1. The most seconds a record may wait in the write buffer before it's flushed to the file.
+        :type flush_interval: Union[int, float]
+    """
+    path = None
+    flush_interval = 1
+
+    def __init__(self, *args, **kwargs):
+
+        for key, value in kwargs.items():
+            setattr(self, key, value)
+
+        self.records = 0  # Written so far
+        self._queue = queue.SimpleQueue()
+        self._file = open(self.path, 'ab')
+        if self._file.tell() == 0:
+            self._file.write(CAPTURE_MAGIC)
+        self._thread = threading.Thread(target=self._write, daemon=True)
+        self._thread.start()
+
+    def record(self, transmission, timestamp=None):
+        """
+            Queues a Transmission to be written, stamped with timestamp (by default now, in seconds since the epoch).
+            Never blocks. The content is copied, so the receive buffer can be reused straight away.
+        """
+        self._queue.put((time.time() if timestamp is None else timestamp, transmission.sender, transmission.receiver, bytes(transmission.raw)))
+
+    def record_many(self, transmissions):
+        """
+            record() each of a batch of Transmissions, all stamped with the same time
+        """
+        timestamp = time.time()
+        for transmission in transmissions:
+            self._queue.put((timestamp, transmission.sender, transmission.receiver, bytes(transmission.raw)))
+
+    def close(self):
+        """
+            Writes out everything recorded so far, then closes the log
+        """
+        self._queue.put(None)
+        self._thread.join()
+        self._file.close()
+
+    def _write(self):
+        # Runs on the writer thread until close()
+        get, write, pack = self._queue.get, self._file.write, CAPTURE_RECORD.pack
+        while True:
+            try:
+                record = get(timeout=self.flush_interval)
+            except queue.Empty:
+                self._file.flush()
+                continue
+            if record is None:
+                self._file.flush()
+                return
+
+            timestamp, sender, receiver, data = record
+            sender, receiver = _pack_address(sender), _pack_address(receiver)
+            write(pack(timestamp, len(sender), len(receiver), len(data)))
+            write(sender)
+            write(receiver)
+            write(data)
+            self.records += 1
+
+
+def _pack_address(address):
+    return b'' if address is None else json.dumps(address, separators=(',', ':')).encode()
+
+
+def _unpack_address(data):
+    if not data:
+        return None
+    address = json.loads(bytes(data))
+    return tuple(address) if isinstance(address, list) else address
+
+
+class CaptureReader():
+    """
+        Reads a log written by Capture. The file is memory mapped, so iterating over a large capture doesn't read it
+        into memory first. Iterating yields (timestamp, Transmission) pairs, whose content is a memoryview into the map:
+        call request.copy() to keep one after the reader is closed. A record cut short (by a crash mid write) ends
+        the capture.
+
+        :param path: The log's filesystem path.
+        :type path: str
+
+        :param encoding: Default None. The encoding Transmissions are decoded with when their content is read.
+        :type encoding: Union[None, str]
+    """
+    path = None
+    encoding = None
+
+    def __init__(self, *args, **kwargs):
+
+        for key, value in kwargs.items():
+            setattr(self, key, value)
+
+        with open(self.path, 'rb') as file:
+            if file.read(len(CAPTURE_MAGIC)) != CAPTURE_MAGIC:
+                raise ValueError("{}{} is not a capture{}".format(settings.RED, self.path, settings.NORMAL))
+            self._map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        self._view = memoryview(self._map)
+
+    def __iter__(self):
+        view, encoding = self._view, self.encoding
+        unpack, header = CAPTURE_RECORD.unpack_from, CAPTURE_RECORD.size
+        offset, end = len(CAPTURE_MAGIC), len(view)
+
+        while offset + header <= end:
+            timestamp, sender, receiver, length = unpack(view, offset)
+            start = offset + header + sender + receiver
+            if start + length > end:
+                return
+            addresses = offset + header
+            yield timestamp, Transmission(raw=view[start:start + length], encoding=encoding,
+                                          sender=_unpack_address(view[addresses:addresses + sender]),
+                                          receiver=_unpack_address(view[addresses + sender:start]))
+            offset = start + length
+
+    def close(self):
+        """
+            Unmaps the file, or if Transmissions read from it are still referenced, leaves it to be unmapped once
+            they're freed.
+        """
+        self._view.release()
+        try:
+            self._map.close()
+        except BufferError:
+            pass
+
+
+def replay(capture, client, speed=1.0, *args, **kwargs):
+    """
+        Sends every request in a capture through a client, as it was received (content encoded, and decompressed).
+        Multicast clients use publish(). With speed None, datagram clients send everything with send_many() (or
+        publish_many()).
+
+        :param capture: A CaptureReader, or the path of a capture
+        :type capture: Union[CaptureReader, str]
+
+        :param client: The client to send through: TCPClient, UDPClient or MulticastClient
+        :type client: _BaseClient
+
+        :param speed: Default 1.0. Replay at this multiple of the captured pace: 1.0 is the original pacing, 10 is ten times faster. If None, send as fast as possible.
+        :type speed: Union[None, float]
+
+        :return: The number of requests sent
+    """
+    reader = CaptureReader(path=capture) if isinstance(capture, str) else capture
+    send_many = getattr(client, 'publish_many', None) or getattr(client, 'send_many', None)
+    send = getattr(client, 'publish', None) or client.send
+    count = 0
+
+    try:
+        if speed is None and send_many is not None:
+            return send_many(request.raw for timestamp, request in reader)
+
+        first = start = None
+        for timestamp, request in reader:
+            if speed is not None:
+                if first is None:
+                    first, start = timestamp, time.perf_counter()
+                delay = start + (timestamp - first) / speed - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+            send(request.raw)
+            count += 1
+        return count
+    finally:
+        if reader is not capture:
+            reader.close()
+
 
 class InitialisationException(BaseException):
     pass
+
+
+class RemoteError(Exception):
+    """
+        Raised by a multiplexed TCPClient's future when the server failed to answer the request
+    """
+    pass
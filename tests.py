@@ -1,5 +1,27 @@
 import network_tools as net
+import benchmarks
+import main
+import asyncio
+import contextlib
+import io
+import json
+import os
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import urllib.request
+import time
 import unittest
+import unittest.mock
+
+
+def shout(request):
+    # A serve_forever(executor="process") handler has to be picklable, so defined at module level
+    return bytes(request.content).upper()
 
 
 class TestNetworkTools(unittest.TestCase):
@@ -43,11 +65,252 @@ class TestNetworkTools(unittest.TestCase):
         server = net.TCPServer(port=56544, timeout=1)
         server.buffer_size = -1
         self.assertRaises(ValueError, server.listen)
-        server.buffer_size = 4097
+        server.buffer_size = server.max_buffer_size + 1
         self.assertRaises(ValueError, server.listen)
         server.buffer_size = 0
         self.assertRaises(ValueError, server.listen)
 
+        # An unframed message is read until no more of it arrives within read_timeout, even if the sender stalls
+        server = net.TCPServer(host='127.0.0.1', port=12381, ack='ACK', read_timeout=0.2)
+        requests = []
+        thread = threading.Thread(target=lambda: requests.append(server.listen()))
+        thread.start()
+        sock = socket.create_connection(('127.0.0.1', 12381))
+        try:
+            for i in range(8):
+                sock.sendall(b'x' * 100003)
+                time.sleep(0.01)
+            thread.join()
+            self.assertEqual(sock.recv(3), b'ACK')
+        finally:
+            sock.close()
+        self.assertEqual(len(requests[0].raw), 800024)
+
+
+    def test_async_tcp(self):
+
+        async def exchange():
+            server = net.AsyncTCPServer(host='127.0.0.1', port=12350, ack='ACK')
+            await server.start()
+            client = net.AsyncTCPClient(host='127.0.0.1', port=12350, timeout=2)
+
+            responses = await asyncio.gather(*[client.send("foo{}".format(i)) for i in range(50)])
+            requests = [await server.listen() for i in range(50)]
+
+            await client.send(b'x' * 100000)  # Unframed, so read over several growing reads
+            large = await server.listen()
+            await server.close()
+            return responses, requests, large
+
+        responses, requests, large = asyncio.run(exchange())
+        self.assertEqual({r.content for r in responses}, {b'ACK'})
+        self.assertEqual(sorted(r.content for r in requests), sorted("foo{}".format(i).encode() for i in range(50)))
+        self.assertEqual(len(large.raw), 100000)
+
+    def test_tcp_framed(self):
+        server = net.TCPServer(host='127.0.0.1', port=12351, ack='ACK', framed=True)
+        client = net.TCPClient(host='127.0.0.1', port=12351, timeout=2, framed=True)
+        payload = 'x' * (4 * 1024 * 1024)
+
+        requests = []
+        thread = threading.Thread(target=lambda: requests.append(server.listen()))
+        thread.start()
+        response = client.send(payload)
+        thread.join()
+
+        self.assertEqual(response.content, b'ACK')
+        self.assertEqual(len(requests[0].content), len(payload))
+
+        # A header announcing more than max_frame_size is refused before anything is allocated
+        connection = net.TCPServer(host='127.0.0.1', port=12370, max_frame_size=1024, metrics=net.Metrics())
+        left, right = socket.socketpair()
+        try:
+            left.sendall(net.FRAME_HEADER.pack(2 ** 31))
+            self.assertRaises(ConnectionError, connection.recv_frame, right)
+            left.sendall(net.MUX_HEADER.pack(2 ** 31, 1))
+            self.assertRaises(ConnectionError, connection.recv_mux_frame, right)
+            self.assertEqual(connection.metrics.counters['errors'], 2)
+        finally:
+            left.close()
+            right.close()
+            connection.socket.close()
+
+    def test_tcp_keep_alive(self):
+        server = net.TCPServer(host='127.0.0.1', port=12352, ack='ACK', keep_alive=True, timeout=2)
+        pool = net.ConnectionPool(max_connections=2)
+        client = net.TCPClient(host='127.0.0.1', port=12352, timeout=2, keep_alive=True, pool=pool)
+
+        requests = []
+        thread = threading.Thread(target=lambda: requests.extend(server.listen() for i in range(20)))
+        thread.start()
+        responses = [client.send("foo") for i in range(20)]
+        thread.join()
+
+        self.assertEqual({bytes(r.content) for r in responses}, {b'ACK'})
+        self.assertEqual(len({r.sender for r in requests}), 1)  # Every request reused one connection
+        pool.close()
+
+        # A refused connect frees its slot, even when the host is given by name
+        for i in range(3):
+            self.assertRaises(ConnectionRefusedError, pool.acquire, ('localhost', 12399), timeout=0.5)
+        self.assertEqual(pool._open[('localhost', 12399)], 0)
+
+    def test_reactor(self):
+        reactor = net.Reactor()
+        requests = []
+        reactor.register(net.TCPServer(host='127.0.0.1', port=12353, ack='ACK'), requests.append)
+        reactor.register(net.UDPServer(host='127.0.0.1', port=12354), requests.append)
+
+        thread = threading.Thread(target=lambda: net.TCPClient(host='127.0.0.1', port=12353, timeout=2).send("foo"))
+        thread.start()
+        net.UDPClient(host='127.0.0.1', port=12354).send("bar")
+
+        while len(requests) < 2:
+            self.assertGreater(reactor.run_once(2), 0)
+        thread.join()
+        reactor.close()
+
+        self.assertEqual(sorted(r.content for r in requests), [b'bar', b'foo'])
+
+    def test_udp_batch(self):
+        server = net.UDPServer(host='127.0.0.1', port=12355)
+        client = net.UDPClient(host='127.0.0.1', port=12355)
+
+        self.assertEqual(client.send_many("foo{}".format(i) for i in range(10)), 10)
+        batch = server.listen_batch(max_packets=8, timeout=2)
+        self.assertEqual([bytes(r.content) for r in batch], ["foo{}".format(i).encode() for i in range(8)])
+
+        batch = server.listen_batch(max_packets=8, timeout=2)
+        self.assertEqual([bytes(r.content) for r in batch], [b'foo8', b'foo9'])
+        self.assertEqual(server.listen_batch(timeout=0), [])
+
+        # Once send_many() has connected the socket, send() still follows changes to port
+        other = net.UDPServer(host='127.0.0.1', port=12380)
+        client.port = 12380
+        client.send(b'moved')
+        self.assertEqual(bytes(other.listen_batch(timeout=2)[0].content), b'moved')
+        self.assertEqual(server.listen_batch(timeout=0), [])
+
+    def test_codecs(self):
+        record = {'id': 2 ** 70, 'price': 1.5, 'name': 'foo', 'tags': ['a', None, True], 'pair': (1, b'\x00')}
+
+        for encoding in (net.BINARY, net.PICKLE):
+            codec = net.get_codec(encoding)
+            self.assertEqual(codec.decode(codec.encode(record)), record)
+
+        self.assertEqual(net.get_codec(net.JSON).decode(net.get_codec(net.JSON).encode({'a': [1, 2]})), {'a': [1, 2]})
+        self.assertRaises(ValueError, net.get_codec, 'foo')
+        self.assertRaises(TypeError, net.get_codec(net.BINARY).encode, object())
+
+        server = net.UDPServer(host='127.0.0.1', port=12356)
+        net.UDPClient(host='127.0.0.1', port=12356, encoding=net.JSON).send({'a': 1})
+        self.assertEqual(server.listen(encoding=net.JSON).content, {'a': 1})
+
+    def test_tcp_serve_forever(self):
+        server = net.TCPServer(host='127.0.0.1', port=12357, ack='ACK')
+        requests = []
+        thread = threading.Thread(target=server.serve_forever, args=(requests.append,), kwargs={'workers': 2, 'poll_interval': 0.1})
+        thread.start()
+
+        client = net.TCPClient(host='127.0.0.1', port=12357, timeout=2)
+        responses = [client.send("foo{}".format(i)) for i in range(5)]
+        server.shutdown()
+        thread.join()
+
+        self.assertEqual({r.content for r in responses}, {b'ACK'})
+        self.assertEqual(sorted(r.content for r in requests), ["foo{}".format(i).encode() for i in range(5)])
+
+    def test_sharded_server(self):
+        server = net.ShardedServer(workers=2, server_kwargs={'host': '127.0.0.1', 'port': 12358}, poll_interval=0.1).start()
+        time.sleep(0.5)  # Let the workers bind
+
+        for i in range(100):
+            net.UDPClient(host='127.0.0.1', port=12358).send("foo")  # A new source port each time, so the kernel can pick another worker
+
+        for attempt in range(50):
+            if server.stats()['messages'] == 100:
+                break
+            time.sleep(0.1)
+        server.stop()
+
+        stats = server.stats()
+        self.assertEqual(stats['messages'], 100)
+        self.assertEqual(stats['bytes'], 300)
+        self.assertEqual(len(stats['workers']), 2)
+
+    def test_benchmarks(self):
+        result = benchmarks.bench_tcp('keep_alive', 64, 2, None, count=20)
+        self.assertEqual(result['received'], 20)
+        self.assertLessEqual(result['p50_us'], result['p999_us'])
+
+        result = benchmarks.bench_datagrams('udp', 'batch', 64, 2, net.BINARY, count=20)
+        self.assertEqual(result['sent'], 20)
+
+        slower = dict(result, messages_per_s=result['messages_per_s'] / 2)
+        rows, regressions = benchmarks.compare([result], [slower])
+        self.assertEqual(len(regressions), 1)
+
+        results = benchmarks.bench_compression(payloads=(1024,), repeat=2, count=5)
+        self.assertEqual({r['compression'] for r in results}, {None} | set(net.COMPRESSORS))
+        self.assertTrue(all(r['ratio'] < 0.5 for r in results if r['compression']))
+
+    def test_metrics(self):
+        metrics = net.Metrics()
+        server = net.UDPServer(host='127.0.0.1', port=12359, metrics=metrics)
+        client = net.UDPClient(host='127.0.0.1', port=12359, metrics=metrics)
+        for i in range(10):
+            client.send("foo")
+            server.listen()
+
+        snapshot = metrics.snapshot()
+        self.assertEqual(snapshot['counters']['messages_in'], 10)
+        self.assertEqual(snapshot['counters']['bytes_out'], 30)
+        self.assertEqual(snapshot['histograms']['decode_time']['count'], 10)
+
+        histogram = net.Histogram()
+        for micros in range(1, 1001):
+            histogram.record(micros / 1e6)
+        self.assertAlmostEqual(histogram.percentile(0.5), 500e-6, delta=500e-6 / 32)
+        self.assertAlmostEqual(histogram.percentile(0.99), 990e-6, delta=990e-6 / 32)
+        for nanos in list(range(1, 5000, 7)) + [random.randrange(1, 10 ** 10) for i in range(1000)]:
+            histogram = net.Histogram()
+            histogram.record(nanos / 1e9)
+            histogram.record(100.0)  # So the percentile isn't clamped to max
+            self.assertAlmostEqual(histogram.percentile(0.5), nanos / 1e9, delta=nanos / 1e9 / 64)
+
+        exporter = net.MetricsServer(metrics=metrics, port=0)
+        with urllib.request.urlopen('http://127.0.0.1:{}/metrics'.format(exporter.port)) as response:
+            self.assertIn('network_tools_messages_in_total 10', response.read().decode())
+        with urllib.request.urlopen('http://127.0.0.1:{}/snapshot'.format(exporter.port)) as response:
+            self.assertEqual(json.loads(response.read().decode())['counters']['messages_out'], 10)
+        exporter.close()
+
+    def test_transmission(self):
+        buffer = bytearray(b'{"a": 1}')
+        request = net.Transmission(raw=memoryview(buffer), encoding=net.JSON, sender=('127.0.0.1', 1))
+        self.assertRaises(AttributeError, setattr, request, 'foo', 1)  # Slotted
+
+        copy = request.copy()
+        buffer[:] = b'[2]     '
+        self.assertEqual(request.content, [2])  # Decoded on first access, from the (since reused) buffer
+        self.assertEqual(copy.content, {'a': 1})
+        self.assertEqual(str(net.Transmission(content=b'foo')), 'foo')
+
+        request.release()
+        self.assertIsNone(request.raw)
+
+    def test_resolver(self):
+        resolver = net.Resolver(negative_ttl=60)
+
+        with unittest.mock.patch('socket.getaddrinfo', wraps=socket.getaddrinfo) as getaddrinfo:
+            for i in range(3):
+                self.assertEqual(resolver.resolve('localhost', 80, socket.AF_INET), ('127.0.0.1', 80))
+                self.assertRaises(socket.gaierror, resolver.resolve, 'host.invalid', 80)
+            self.assertEqual(getaddrinfo.call_count, 2)  # One lookup each, then cached
+
+            resolver.clear()
+            resolver.resolve('localhost', 80, socket.AF_INET)
+            self.assertEqual(getaddrinfo.call_count, 3)
 
     def test_udp_client(self):
         client = net.UDPClient()
@@ -62,6 +325,460 @@ class TestNetworkTools(unittest.TestCase):
         client = net.MulticastClient(timeout=1)
         client.send("foo")
 
+    def test_multicast_publisher(self):
+        server = net.MulticastServer(host='224.1.1.2', port=12361)
+        server.socket.settimeout(2)
+        client = net.MulticastClient(host='224.1.1.2', port=12361, loop=True, ttl=1, rate=200)
+
+        start = time.perf_counter()
+        self.assertEqual(client.publish_many("foo{}".format(i) for i in range(20)), 20)
+        self.assertGreater(time.perf_counter() - start, 19 / 200 * 0.9)  # Paced to the rate
+        self.assertEqual([server.listen().content for i in range(20)], ["foo{}".format(i).encode() for i in range(20)])
+        client.close()
+
+        sock, group = net.MulticastClient(host='ff02::1', port=12361)._open()  # IPv6 options are set on the socket
+        self.assertEqual(sock.family, socket.AF_INET6)
+        sock.close()
+
+    def test_multicast_groups(self):
+        server = net.MulticastServer(host='224.1.1.3', port=12362, groups=['224.1.1.4'])
+        server.socket.settimeout(2)
+        self.assertEqual(sorted(server.joined), ['224.1.1.3', '224.1.1.4'])
+
+        for group in ('224.1.1.3', '224.1.1.4'):
+            net.MulticastClient(host=group, port=12362, loop=True).send(group)
+        requests = [server.listen() for i in range(2)]
+        self.assertEqual(sorted(request.receiver[0] for request in requests), ['224.1.1.3', '224.1.1.4'])
+        self.assertTrue(all(request.content == request.receiver[0].encode() for request in requests))
+
+        server.leave('224.1.1.4')
+        net.MulticastClient(host='224.1.1.4', port=12362, loop=True).send("gone")
+        net.MulticastClient(host='224.1.1.3', port=12362, loop=True).send("kept")
+        server.socket.settimeout(None)  # listen_batch() waits with its own timeout
+        batch = server.listen_batch(timeout=2)
+        self.assertEqual([request.copy().content for request in batch], [b"kept"])
+
+    def test_file_transfer(self):
+        server = net.TCPServer(host='127.0.0.1', port=12363, ack='ACK', timeout=2)
+        client = net.TCPClient(host='127.0.0.1', port=12363, timeout=2)
+        payload = os.urandom(3 * 1024 * 1024 + 7)
+
+        with tempfile.TemporaryDirectory() as directory:
+            source = os.path.join(directory, 'source')
+            with open(source, 'wb') as file:
+                file.write(payload)
+
+            for mapped in (False, True):
+                target = os.path.join(directory, 'target')
+                requests = []
+                thread = threading.Thread(target=lambda: requests.append(server.listen_file(target, mmap=mapped, chunk_size=65536)))
+                thread.start()
+                response = client.send_file(source)
+                thread.join()
+
+                self.assertEqual(response.content, b'ACK')
+                self.assertEqual(requests[0].content, target)
+                with open(target, 'rb') as file:
+                    self.assertEqual(file.read(), payload)
+
+    def test_compression(self):
+        records = [{'id': i, 'symbol': 'ABCD', 'side': 'buy'} for i in range(100)]
+        client = net.UDPClient(host='127.0.0.1', port=12364, encoding=net.JSON, compression=net.ZLIB, compress_min_size=64)
+        server = net.UDPServer(host='127.0.0.1', port=12364, encoding=net.JSON, compression=net.LZMA, metrics=net.Metrics())
+
+        wire = client.encode(records, net.JSON)
+        self.assertEqual(wire[0], net.get_compressor(net.ZLIB).flag)
+        self.assertLess(len(wire), len(net.get_codec(net.JSON).encode(records)) / 4)
+        self.assertEqual(client.encode('x', None), b'\x00x')  # Below compress_min_size
+
+        client.send(records)
+        client.send(records, compress=False)
+        client.send_many([b'raw'])
+        self.assertEqual(server.listen().content, records)
+        self.assertEqual(server.listen().content, records)
+        self.assertEqual(bytes(server.listen_batch(timeout=2)[0].raw), b'raw')
+
+        tcp_server = net.TCPServer(host='127.0.0.1', port=12365, ack='ACK', framed=True, compression=net.ZLIB)
+        thread = threading.Thread(target=lambda: records.append(tcp_server.listen().content))
+        thread.start()
+        net.TCPClient(host='127.0.0.1', port=12365, timeout=2, framed=True, compression=net.LZMA).send('y' * 10000)
+        thread.join()
+        self.assertEqual(bytes(records[-1]), b'y' * 10000)
+
+        # Messages reach worker processes as bytes, as memoryviews can't be pickled
+        mux_server = net.TCPServer(host='127.0.0.1', port=12379, multiplexed=True, compression=net.ZLIB)
+        mux_client = net.TCPClient(host='127.0.0.1', port=12379, timeout=5, multiplexed=True, compression=net.ZLIB)
+        thread = threading.Thread(target=mux_server.serve_forever, args=(shout,), daemon=True,
+                                  kwargs={'workers': 1, 'executor': 'process', 'poll_interval': 0.1})
+        thread.start()
+        try:
+            self.assertEqual(bytes(mux_client.send('foo').content), b'FOO')
+            self.assertEqual(bytes(mux_client.send('y' * 1000).content), b'Y' * 1000)
+        finally:
+            mux_server.shutdown()
+            thread.join()
+            mux_client.close()
+
+        # A corrupt message is dropped and counted, and the server carries on
+        server.metrics, tcp_server.metrics = net.Metrics(), net.Metrics()
+        reactor = net.Reactor()
+        reactor.register(server, records.append)
+        with unittest.mock.patch('builtins.print'):
+            plain = net.UDPClient(host='127.0.0.1', port=12364)
+            plain.send(b'\x07junk')
+            self.assertEqual(reactor.run_once(2), 1)
+            plain.send_many([b'\x01junk', b'\x00"ok"'])
+            self.assertEqual([r.content for r in server.listen_batch(timeout=2)], ['ok'])
+
+            thread = threading.Thread(target=lambda: self.assertRaises(socket.error, tcp_server.listen))
+            thread.start()
+            net.TCPClient(host='127.0.0.1', port=12365, timeout=2, framed=True).send(b'\x01junk')
+            thread.join()
+        reactor.unregister(server)
+        self.assertEqual((server.metrics.counters['errors'], tcp_server.metrics.counters['errors']), (2, 1))
+        self.assertEqual(len(tcp_server._selector.get_map()), 1)  # Only the listening socket
+
+    def test_reliable_udp(self):
+        server = net.ReliableUDPServer(host='127.0.0.1', port=12366, timeout=0.1)
+        client = net.ReliableUDPClient(host='127.0.0.1', port=12366, metrics=net.Metrics())
+
+        # Simulate a lossy link by dropping a fifth of the datagrams each way. Each direction is only sent from one
+        # thread, and has its own seeded generator, so the pattern of losses repeats.
+        def lossy(transmit, seed):
+            rng = random.Random(seed)
+            return lambda *args: None if rng.random() < 0.2 else transmit(*args)
+        client._transmit = lossy(client._transmit, 1)
+        server._transmit = lossy(server._transmit, 2)
+
+        # The server only ACKs while it's listening, so keep listening until the client has everything ACKed
+        payloads = [os.urandom(size) for size in (0, 10, 200 * 1024, 1400 * 3)]
+        requests = []
+        sent = threading.Event()
+        def listen():
+            while not sent.is_set():
+                request = server.listen()
+                if request is not None:
+                    requests.append(request)
+        thread = threading.Thread(target=listen, daemon=True)
+        thread.start()
+        try:
+            self.assertEqual(client.send_many(payloads), len(payloads))
+        finally:
+            sent.set()
+            thread.join()
+
+        self.assertEqual([bytes(r.content) for r in requests], payloads)  # Each delivered once, in order
+        self.assertGreater(client.metrics.counters['retransmits'], 0)
+
+        # Fragments announcing too many fragments, or a count the message didn't start with, are dropped
+        server.metrics = net.Metrics()
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.bind(('127.0.0.1', 0))
+        try:
+            sock.sendto(net.RUDP_DATA.pack(net._RUDP_DATA, 1, 0, 0xFFFFFFF0), ('127.0.0.1', 12366))
+            sock.sendto(net.RUDP_DATA.pack(net._RUDP_DATA, 2, 0, 2) + b'a', ('127.0.0.1', 12366))
+            sock.sendto(net.RUDP_DATA.pack(net._RUDP_DATA, 2, 5, 8) + b'b', ('127.0.0.1', 12366))
+            time.sleep(0.1)
+            self.assertIsNone(server.listen())
+            sender = sock.getsockname()
+        finally:
+            sock.close()
+        self.assertEqual(server.metrics.counters['errors'], 1)
+        self.assertNotIn((sender, 1), server._partial)
+        self.assertEqual(server._partial[(sender, 2)][0], [b'a', None])
+
+    def test_buffer_sizing(self):
+        server = net.UDPServer(host='127.0.0.1', port=12367, recv_buffer=1 << 20)
+        client = net.UDPClient(host='127.0.0.1', port=12367, send_buffer=1 << 20)
+        self.assertGreaterEqual(server.socket.getsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF), min(1 << 20, 4096 * 2))
+        self.assertEqual(server.read_size, 4096)
+
+        # Datagrams larger than the read size arrive whole, and the next reads are sized for them
+        client.send(b'x' * 20000)
+        self.assertEqual(len(server.listen().raw), 20000)
+        self.assertEqual(server.read_size, 32768)
+        client.send_many([b'x' * 20000] * 3)
+        batch = []
+        while len(batch) < 3:
+            batch += server.listen_batch(timeout=2)
+        self.assertEqual([len(r.raw) for r in batch], [20000] * 3)
+        self.assertEqual([bytes(r.raw) for r in batch], [b'x' * 20000] * 3)
+
+        if sys.platform.startswith('linux'):
+            self.assertEqual(server.drops(), 0)
+
+        tcp_server = net.TCPServer(host='127.0.0.1', port=12368, ack='ACK', recv_buffer=1 << 20)
+        requests = []
+        thread = threading.Thread(target=lambda: requests.append(tcp_server.listen()))
+        thread.start()
+        net.TCPClient(host='127.0.0.1', port=12368, timeout=2, send_buffer=1 << 20).send(b'y' * 10000)
+        thread.join()
+        self.assertGreater(len(requests[0].raw), 4096)  # Grown past one buffer_size read
+        self.assertGreater(tcp_server.read_size, 4096)
+
+    def test_tcp_multiplexed(self):
+        server = net.TCPServer(host='127.0.0.1', port=12369, multiplexed=True, timeout=2)
+        client = net.TCPClient(host='127.0.0.1', port=12369, timeout=2, multiplexed=True)
+
+        # Answer every request, newest first, on a single connection
+        futures = [client.submit("foo{}".format(i)) for i in range(10)]
+        requests = [server.listen() for i in range(10)]
+        self.assertEqual(len({r.sender for r in requests}), 1)
+        for request in reversed(requests):
+            server.respond(request, bytes(request.content).upper())
+        self.assertEqual([bytes(f.result(2).content) for f in futures], ["FOO{}".format(i).encode() for i in range(10)])
+
+        # serve_forever answers with each handler's return value, or the error it raised
+        def handler(request):
+            if request.content < 0:
+                raise ValueError("negative")
+            return {'echo': request.content}
+
+        thread = threading.Thread(target=server.serve_forever, args=(handler,), daemon=True,
+                                  kwargs={'workers': 4, 'poll_interval': 0.1, 'encoding': net.JSON})
+        thread.start()
+        try:
+            futures = [client.submit(i, encoding=net.JSON) for i in range(20)]
+            self.assertEqual([f.result(2).content for f in futures], [{'echo': i} for i in range(20)])
+            self.assertEqual(client.send(99, encoding=net.JSON).content, {'echo': 99})
+            with unittest.mock.patch('builtins.print'):
+                self.assertRaises(net.RemoteError, client.send, -1, encoding=net.JSON)
+        finally:
+            server.shutdown()
+            thread.join()
+            client.close()
+
+        self.assertRaises(ValueError, net.TCPClient().submit, "foo")
+
+    def test_stream(self):
+        # UDP, one request at a time until the stop token is set
+        server = net.UDPServer(host='127.0.0.1', port=12371, poll_interval=0.05)
+        client = net.UDPClient(host='127.0.0.1', port=12371)
+        stop = threading.Event()
+        client.send_many("foo{}".format(i) for i in range(10))
+        received = []
+        for request in server.stream(stop=stop, encoding=net.TEXT):
+            received.append(request.content)
+            if len(received) == 10:
+                stop.set()
+        self.assertEqual(received, ["foo{}".format(i) for i in range(10)])
+        self.assertRaises(ValueError, next, server.stream(batch=0))
+        self.assertRaises(TypeError, next, net._BaseServer().stream())
+
+        # Batches, as an async iterator
+        async def consume():
+            stop = asyncio.Event()
+            client.send_many([b'bar'] * 5)
+            batches = []
+            async for batch in server.astream(batch=8, stop=stop):
+                batches.append([bytes(request.raw) for request in batch])
+                if sum(map(len, batches)) == 5:
+                    stop.set()
+            return batches
+        self.assertEqual(sum(asyncio.run(consume()), []), [b'bar'] * 5)
+
+        # TCP, with kept alive connections
+        tcp_server = net.TCPServer(host='127.0.0.1', port=12372, ack='ACK', keep_alive=True, poll_interval=0.05)
+        tcp_client = net.TCPClient(host='127.0.0.1', port=12372, timeout=2, keep_alive=True, pool=net.ConnectionPool())
+        thread = threading.Thread(target=lambda: [tcp_client.send("foo") for i in range(5)], daemon=True)
+        thread.start()
+        stop, received = threading.Event(), []
+        for request in tcp_server.stream(stop=stop):
+            received.append(request.content)
+            if len(received) == 5:
+                stop.set()
+        thread.join()
+        self.assertEqual(received, [b'foo'] * 5)
+
+        # AsyncTCPServer streams from its own event loop
+        async def exchange():
+            server = net.AsyncTCPServer(host='127.0.0.1', port=12373, ack='ACK')
+            stop = asyncio.Event()
+            received = []
+            async def consume():
+                async for request in server.stream(stop=stop, encoding=net.TEXT):
+                    received.append(request.content)
+                    if len(received) == 5:
+                        stop.set()
+            task = asyncio.ensure_future(consume())
+            while server.server is None:
+                await asyncio.sleep(0.01)
+            client = net.AsyncTCPClient(host='127.0.0.1', port=12373, timeout=2)
+            await asyncio.gather(*[client.send("foo") for i in range(5)])
+            await task
+            await server.close()
+            return received
+        self.assertEqual(asyncio.run(exchange()), ["foo"] * 5)
+
+    def test_unix_sockets(self):
+        directory = tempfile.mkdtemp()
+        path = os.path.join(directory, 'stream.sock')
+        try:
+            server = net.UnixStreamServer(path=path, ack='ACK', keep_alive=True, timeout=2)
+            client = net.UnixStreamClient(path=path, timeout=2, keep_alive=True, pool=net.ConnectionPool())
+            requests = []
+            thread = threading.Thread(target=lambda: requests.extend(server.listen(encoding=net.JSON) for i in range(3)), daemon=True)
+            thread.start()
+            responses = [client.send({'n': i}, encoding=net.JSON) for i in range(3)]
+            thread.join()
+            self.assertEqual([bytes(r.content) for r in responses], [b'ACK'] * 3)
+            self.assertEqual([r.content for r in requests], [{'n': i} for i in range(3)])
+            self.assertEqual(requests[0].receiver, path)
+            self.assertRaises(OSError, net.UnixStreamServer, path=path)  # A live server keeps its path
+            server.socket.close()
+
+            # Datagrams can be larger than UDP allows, and a stale socket file is replaced
+            path = os.path.join(directory, 'datagram.sock')
+            net.UnixDatagramServer(path=path).socket.close()
+            server = net.UnixDatagramServer(path=path)
+            self.assertRaises(OSError, net.UnixDatagramServer, path=path)
+            client = net.UnixDatagramClient(path=path)
+            client.send(b'x' * 100000)
+            self.assertEqual(len(server.listen().raw), 100000)
+            client.send_many([b'foo', b'bar'])
+            self.assertEqual([bytes(r.raw) for r in server.listen_batch(timeout=2)], [b'foo', b'bar'])
+            server.socket.close()
+        finally:
+            shutil.rmtree(directory)
+
+        # Latency and throughput against the INET classes
+        results = benchmarks.bench_unix(payloads=(64,), count=200)
+        self.assertEqual([r['transport'] for r in results], ['tcp', 'unix', 'udp', 'unix_dgram'])
+        self.assertEqual([r['received'] for r in results[1::2]], [200, 200])  # Unix datagrams aren't dropped
+        self.assertTrue(all(r['speedup'] > 0 and r['p50_us'] > 0 for r in results[1::2]))
+
+    def test_capture_replay(self):
+        directory = tempfile.mkdtemp()
+        path = os.path.join(directory, 'capture.log')
+        try:
+            capture = net.Capture(path=path)
+            server = net.UDPServer(host='127.0.0.1', port=12374, capture=capture)
+            client = net.UDPClient(host='127.0.0.1', port=12374)
+            for i in range(3):
+                client.send("foo{}".format(i))
+                server.listen()
+                time.sleep(0.1)
+            client.send_many([b'bar'] * 2)
+            batch = []
+            while len(batch) < 2:
+                batch += server.listen_batch(timeout=2)
+            capture.close()
+            self.assertEqual(capture.records, 5)
+
+            # Capturing again appends, and a record cut short is ignored
+            capture = net.Capture(path=path)
+            capture.record(net.Transmission(raw=b'baz', sender='/tmp/client.sock'))
+            capture.close()
+            with open(path, 'ab') as log:
+                log.write(net.CAPTURE_RECORD.pack(0, 0, 0, 100) + b'x')
+
+            reader = net.CaptureReader(path=path, encoding=net.TEXT)
+            records = [(timestamp, request.copy()) for timestamp, request in reader]
+            reader.close()
+            self.assertEqual([request.content for timestamp, request in records], ['foo0', 'foo1', 'foo2', 'bar', 'bar', 'baz'])
+            self.assertEqual(records[0][1].receiver, ('127.0.0.1', 12374))
+            self.assertEqual(records[0][1].sender[1], client.socket.getsockname()[1])
+            self.assertEqual((records[-1][1].sender, records[-1][1].receiver), ('/tmp/client.sock', None))
+            timestamps = [timestamp for timestamp, request in records]
+            self.assertEqual(timestamps, sorted(timestamps))
+
+            # At double speed the replay takes half as long as the capture, and as fast as possible it's batched
+            target = net.UDPServer(host='127.0.0.1', port=12375)
+            start = time.perf_counter()
+            self.assertEqual(net.replay(path, net.UDPClient(host='127.0.0.1', port=12375), speed=2), 6)
+            self.assertGreater(time.perf_counter() - start, (timestamps[-1] - timestamps[0]) / 2 * 0.9)
+            self.assertEqual(net.replay(path, net.UDPClient(host='127.0.0.1', port=12375), speed=None), 6)
+            received = []
+            while len(received) < 12:
+                received += [bytes(request.raw) for request in target.listen_batch(timeout=2)]
+            self.assertEqual(received, [b'foo0', b'foo1', b'foo2', b'bar', b'bar', b'baz'] * 2)
+
+            tcp_server = net.TCPServer(host='127.0.0.1', port=12376, ack='ACK', timeout=2)
+            thread = threading.Thread(target=lambda: received.extend(tcp_server.listen() for i in range(6)), daemon=True)
+            thread.start()
+            self.assertEqual(net.replay(path, net.TCPClient(host='127.0.0.1', port=12376, timeout=2), speed=None), 6)
+            thread.join()
+            self.assertEqual([bytes(request.raw) for request in received[12:]], [b'foo0', b'foo1', b'foo2', b'bar', b'bar', b'baz'])
+
+            with open(path, 'wb') as log:
+                log.write(b'not a capture')
+            self.assertRaises(ValueError, net.CaptureReader, path=path)
+        finally:
+            shutil.rmtree(directory)
+
+    def test_tracing(self):
+        # UDP: one way latency, and sequence gaps counted as lost or reordered
+        server = net.UDPServer(host='127.0.0.1', port=12377, trace=True, encoding=net.JSON, metrics=net.Metrics())
+        client = net.UDPClient(host='127.0.0.1', port=12377, trace=True, metrics=net.Metrics())
+        for i in range(3):
+            client.send({'n': i}, encoding=net.JSON)
+        requests = [server.listen() for i in range(3)]
+        self.assertEqual([request.content for request in requests], [{'n': i} for i in range(3)])
+        self.assertEqual([request.sequence for request in requests], [0, 1, 2])
+        self.assertTrue(all(r.sent_at <= r.received_at <= r.decoded_at for r in requests))
+        self.assertIsNone(requests[0].acked_at)
+
+        next(client._sequence)  # Sequence number 3 is lost
+        late, early = client._stamp(b'"late"')[0], client._stamp(b'"early"')[0]
+        client.socket.sendto(early, ('127.0.0.1', 12377))
+        client.socket.sendto(late, ('127.0.0.1', 12377))
+        client.send_many([b'"batched"'])
+        batch = []
+        while len(batch) < 3:
+            batch += server.listen_batch(timeout=2)
+        self.assertEqual([(request.sequence, request.content) for request in batch], [(5, 'early'), (4, 'late'), (6, 'batched')])
+        counters, histograms = server.metrics.counters, server.metrics.snapshot()['histograms']
+        self.assertEqual((counters['lost'], counters['reordered']), (1, 1))
+        self.assertEqual(histograms['network_latency']['count'], 6)
+        self.assertEqual(client.metrics.snapshot()['histograms']['encode_time']['count'], 3)
+
+        # TCP: the ack carries the server's times back, so the client sees every stage of the round trip
+        tcp_server = net.TCPServer(host='127.0.0.1', port=12378, ack='ACK', trace=True, framed=True, timeout=2, metrics=net.Metrics())
+        tcp_client = net.TCPClient(host='127.0.0.1', port=12378, timeout=2, trace=True, framed=True, metrics=net.Metrics())
+        requests = []
+        thread = threading.Thread(target=lambda: requests.append(tcp_server.listen()), daemon=True)
+        thread.start()
+        response = tcp_client.send("foo")
+        thread.join()
+        self.assertEqual((bytes(response.content), bytes(requests[0].content)), (b'ACK', b'foo'))
+        self.assertEqual((response.sequence, response.received_at, response.acked_at), (0, requests[0].received_at, requests[0].acked_at))
+        self.assertTrue(response.sent_at <= response.received_at <= response.acked_at)
+        self.assertTrue(0 < response.rtt < 2)
+        self.assertEqual(tcp_client.metrics.snapshot()['histograms']['rtt']['count'], 1)
+        self.assertEqual(tcp_server.metrics.snapshot()['histograms']['ack_time']['count'], 1)
+
+    def test_load_generator(self):
+
+        def run(*argv):
+            output = io.StringIO()
+            with contextlib.redirect_stdout(output):
+                self.assertEqual(main.main(['loopback'] + list(argv) + ['--duration', '0.3', '--interval', '0', '--json']), 0)
+            return json.loads(output.getvalue())
+
+        summary = run('udp', '--payload', '100', '--rate', '200')
+        self.assertEqual((summary['transport'], summary['payload'], summary['latency']), ('udp', 100, 'one_way'))
+        self.assertTrue(0 < summary['sent'] <= 61)  # Paced to 200 messages per second
+        self.assertEqual((summary['received'], summary['lost']), (summary['sent'], 0))
+        self.assertEqual(summary['sent_mb_per_s'], round(summary['sent'] * 100 / summary['seconds'] / 1e6, 3))
+        self.assertIsNotNone(summary['p50_us'])
+
+        for argv in (('tcp', '--mode', 'keep_alive', '--concurrency', '2', '--encoding', 'json'),
+                     ('async_tcp', '--model', 'asyncio', '--concurrency', '2'),
+                     ('unix_dgram', '--model', 'processes', '--concurrency', '2')):
+            summary = run(*argv)
+            self.assertEqual((summary['concurrency'], summary['errors']), (2, 0))
+            self.assertTrue(summary['sent'] > 0)
+            self.assertEqual(summary['received'], summary['sent'])
+            self.assertTrue(summary['p50_us'] <= summary['p99_us'])
+
+        with contextlib.redirect_stderr(io.StringIO()), self.assertRaises(SystemExit):
+            main.parse(['loopback', 'udp', '--model', 'asyncio'])
+
+    def test_lazy_imports(self):
+        # Modules that are slow to import are left until a feature that needs them is used
+        code = "import sys, network_tools; print(sorted({'asyncio', 'concurrent.futures', 'multiprocessing', 'http.server'} & set(sys.modules)))"
+        self.assertEqual(subprocess.check_output([sys.executable, '-c', code], cwd=os.path.dirname(os.path.abspath(__file__))).strip(), b'[]')
+
     def test_multicast_sever(self):
         server = net.MulticastServer(port=12342, timeout=1)
         # server.listen()